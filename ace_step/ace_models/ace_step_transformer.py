@@ -26,6 +26,13 @@ from diffusers.loaders import FromOriginalModelMixin, PeftAdapterMixin
 
 
 from .attention import LinearTransformerBlock, t2i_modulate
+from .customer_attention_processor import (
+    CrossAttnKVCache,
+    AttentionTemperature,
+    CustomLiteLAProcessor2_0,
+    make_cross_attention_mask,
+)
+from .step_cache import StepCache, StepCacheSchedule
 from .lyrics_utils.lyric_encoder import ConformerEncoder as LyricEncoder
 
 
@@ -227,6 +234,9 @@ class ACEStepTransformer2DModel(
         ssl_latent_dims: List[int] = [1024, 768],
         lyric_encoder_vocab_size: int = 6681,
         lyric_hidden_size: int = 1024,
+        lyric_encoder_attention_heads: int = 16,
+        lyric_encoder_linear_units: int = 4096,
+        lyric_encoder_num_blocks: int = 6,
         patch_size: List[int] = [16, 1],
         max_height: int = 16,
         max_width: int = 4096,
@@ -288,7 +298,12 @@ class ACEStepTransformer2DModel(
         # lyric
         self.lyric_embs = nn.Embedding(lyric_encoder_vocab_size, lyric_hidden_size)
         self.lyric_encoder = LyricEncoder(
-            input_size=lyric_hidden_size, static_chunk_size=0
+            input_size=lyric_hidden_size,
+            output_size=lyric_hidden_size,
+            attention_heads=lyric_encoder_attention_heads,
+            linear_units=lyric_encoder_linear_units,
+            num_blocks=lyric_encoder_num_blocks,
+            static_chunk_size=0,
         )
         self.lyric_proj = nn.Linear(lyric_hidden_size, self.inner_dim)
 
@@ -360,15 +375,84 @@ class ACEStepTransformer2DModel(
         for module in self.children():
             fn_recursive_feed_forward(module, chunk_size, dim)
 
+    def set_linear_attention_chunk_size(self, chunk_size: Optional[int] = 1024) -> None:
+        """
+        Sequence chunk of the linear self-attention, bounds its float32 temporaries to `chunk_size` positions.
+        `None` computes the whole sequence at once (fastest, highest peak memory).
+        """
+        for block in self.transformer_blocks:
+            if isinstance(block.attn.processor, CustomLiteLAProcessor2_0):
+                block.attn.processor.chunk_size = chunk_size
+
+    def compile_blocks(self, **compile_kwargs):
+        """
+        Regional compilation: each transformer block's `forward` is compiled on its own, static shapes by default.
+        The blocks only take tensors (`decode` computes the cross attention keys / values and mask), so the caches,
+        ERG temperatures and the step cache stay eager and add no guards, identical blocks share their graphs and
+        the forward hooks of a `BlockStreamer` run outside the compiled code.
+        """
+        compile_kwargs.setdefault("dynamic", False)
+        for block in self.transformer_blocks:
+            block.forward = torch.compile(block.forward, **compile_kwargs)
+        return self
+
+    def cross_key_value(
+        self,
+        block: LinearTransformerBlock,
+        encoder_hidden_states: torch.Tensor,
+        rotary_freqs_cis: Tuple[torch.Tensor, torch.Tensor],
+        encoder_rotary_freqs_cis: Tuple[torch.Tensor, torch.Tensor],
+        cross_attn_kv_cache: Optional[CrossAttnKVCache] = None,
+    ):
+        """Cross attention keys / values of `block`, from `cross_attn_kv_cache` when it holds them."""
+        key_value = cross_attn_kv_cache.entries.get(block.cross_attn) if cross_attn_kv_cache is not None else None
+        if key_value is None:
+            block_streamer = getattr(self, "block_streamer", None)
+            if block_streamer is not None:
+                # needed before the block's forward pre-hook would load its weights
+                block_streamer.load(block)
+            key_value = block.cross_attn.processor.key_value(
+                block.cross_attn, encoder_hidden_states, rotary_freqs_cis, encoder_rotary_freqs_cis
+            )
+            if cross_attn_kv_cache is not None:
+                cross_attn_kv_cache.entries[block.cross_attn] = key_value
+        return key_value
+
+    def embed_timestep(self, timestep: torch.Tensor, dtype: torch.dtype):
+        """Timestep embedding and the AdaLN modulation vector `t_block` derives from it, one row per timestep."""
+        embedded_timestep = self.timestep_embedder(self.time_proj(timestep).to(dtype=dtype))
+        return embedded_timestep, self.t_block(embedded_timestep)
+
+    def step_cache_probe(
+        self,
+        hidden_states: torch.Tensor,
+        timestep_embedding: Tuple[torch.Tensor, torch.Tensor],
+        attention_mask: Optional[torch.Tensor] = None,
+    ):
+        """
+        Timestep-modulated input of the first block for latents `hidden_states`, what `StepCacheSchedule` decides on.
+        Frames masked out by `attention_mask` (shape bucket padding) are zeroed, they do not change the decision.
+        """
+        temb = timestep_embedding[1].expand(hidden_states.shape[0], -1)
+        modulated = StepCacheSchedule.modulated_input(self.proj_in(hidden_states), temb)
+        if attention_mask is not None:
+            modulated = modulated * attention_mask[:, :, None].to(modulated.dtype)
+        return modulated
+
     def forward_lyric_encoder(
         self,
         lyric_token_idx: Optional[torch.LongTensor] = None,
         lyric_mask: Optional[torch.LongTensor] = None,
+        attn_temperature: Optional[AttentionTemperature] = None,
     ):
         # N x T x D
         lyric_embs = self.lyric_embs(lyric_token_idx)
         prompt_prenet_out, _mask = self.lyric_encoder(
-            lyric_embs, lyric_mask, decoding_chunk_size=1, num_decoding_left_chunks=-1
+            lyric_embs,
+            lyric_mask,
+            decoding_chunk_size=1,
+            num_decoding_left_chunks=-1,
+            attn_temperature=attn_temperature,
         )
         prompt_prenet_out = self.lyric_proj(prompt_prenet_out)
         return prompt_prenet_out
@@ -425,12 +509,27 @@ class ACEStepTransformer2DModel(
         ] = None,
         controlnet_scale: Union[float, torch.Tensor] = 1.0,
         return_dict: bool = True,
+        cross_attn_kv_cache: Optional[CrossAttnKVCache] = None,
+        step_cache: Optional[StepCache] = None,
+        attn_temperature: Optional[AttentionTemperature] = None,
+        timestep_embedding: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+        padded_frames: bool = False,
     ):
-
-        embedded_timestep = self.timestep_embedder(
-            self.time_proj(timestep).to(dtype=hidden_states.dtype)
-        )
-        temb = self.t_block(embedded_timestep)
+        # padded_frames: the frames masked out by attention_mask pad the latents to a shape bucket (see
+        # ace_step.shape_buckets). They are kept out of the feed forward convolutions of their valid neighbours,
+        # attend to the encoder states instead of to nothing and come out as zeros, so the valid frames are the
+        # same as without the padding
+
+        if cross_attn_kv_cache is not None:
+            cross_attn_kv_cache.bind(encoder_hidden_states, encoder_hidden_mask, attention_mask)
+
+        if timestep_embedding is not None:
+            # precomputed by a SamplingPlan for a timestep shared by every row
+            embedded_timestep, temb = (
+                embedding.expand(hidden_states.shape[0], -1) for embedding in timestep_embedding
+            )
+        else:
+            embedded_timestep, temb = self.embed_timestep(timestep, hidden_states.dtype)
 
         hidden_states = self.proj_in(hidden_states)
 
@@ -448,8 +547,42 @@ class ACEStepTransformer2DModel(
             encoder_hidden_states, seq_len=encoder_hidden_states.shape[1]
         )
 
+        # the cross attention mask only depends on the masks, computed once per decode (once per loop with a cache)
+        cross_attention_mask = cross_attn_kv_cache.attention_mask if cross_attn_kv_cache is not None else None
+        if cross_attention_mask is None:
+            cross_attention_mask = make_cross_attention_mask(
+                attention_mask,
+                encoder_hidden_mask,
+                self.transformer_blocks[0].cross_attn.heads,
+                hidden_states.dtype,
+                padded_queries=padded_frames,
+            )
+            if cross_attn_kv_cache is not None:
+                cross_attn_kv_cache.attention_mask = cross_attention_mask
+        ff_mask = attention_mask if padded_frames else None
+
+        if step_cache is not None:
+            cache_start, cache_end = step_cache.block_range(len(self.transformer_blocks))
+        reuse_cached_blocks = False
+
         for index_block, block in enumerate(self.transformer_blocks):
 
+            if step_cache is not None and index_block == cache_start:
+                reuse_cached_blocks = step_cache.should_reuse(hidden_states)
+                if reuse_cached_blocks:
+                    hidden_states = step_cache.apply(hidden_states)
+            if reuse_cached_blocks and index_block < cache_end:
+                continue
+
+            cross_key_value = self.cross_key_value(
+                block, encoder_hidden_states, rotary_freqs_cis, encoder_rotary_freqs_cis, cross_attn_kv_cache
+            )
+            query_scale = (
+                attn_temperature.query_scale(index_block, hidden_states.shape[0], hidden_states.device, hidden_states.dtype)
+                if attn_temperature is not None
+                else None
+            )
+
             if self.training and self.gradient_checkpointing:
 
                 hidden_states = torch.utils.checkpoint.checkpoint(
@@ -461,6 +594,10 @@ class ACEStepTransformer2DModel(
                     rotary_freqs_cis=rotary_freqs_cis,
                     rotary_freqs_cis_cross=encoder_rotary_freqs_cis,
                     temb=temb,
+                    cross_key_value=cross_key_value,
+                    cross_attention_mask=cross_attention_mask,
+                    query_scale=query_scale,
+                    ff_mask=ff_mask,
                     use_reentrant=False,
                 )
 
@@ -473,8 +610,15 @@ class ACEStepTransformer2DModel(
                     rotary_freqs_cis=rotary_freqs_cis,
                     rotary_freqs_cis_cross=encoder_rotary_freqs_cis,
                     temb=temb,
+                    cross_key_value=cross_key_value,
+                    cross_attention_mask=cross_attention_mask,
+                    query_scale=query_scale,
+                    ff_mask=ff_mask,
                 )
 
+            if step_cache is not None and not reuse_cached_blocks and index_block == cache_end - 1:
+                step_cache.store(hidden_states)
+
             for ssl_encoder_depth in self.ssl_encoder_depths:
                 if index_block == ssl_encoder_depth:
                     inner_hidden_states.append(hidden_states)
@@ -519,6 +663,8 @@ class ACEStepTransformer2DModel(
                 proj_losses.append((ssl_name, proj_loss / bs))
 
         output = self.final_layer(hidden_states, embedded_timestep, output_length)
+        if padded_frames:
+            output = output * attention_mask[:, None, None, :].to(output.dtype)
         if not return_dict:
             return (output, proj_losses)
 
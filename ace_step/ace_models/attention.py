@@ -11,7 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from typing import Tuple, Union
+from typing import Optional, Tuple, Union
 
 import torch
 import torch.nn.functional as F
@@ -168,9 +168,12 @@ class GLUMBConv(nn.Module):
             act=act[2],
         )
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(self, x: torch.Tensor, mask: Optional[torch.Tensor] = None) -> torch.Tensor:
         x = x.transpose(1, 2)
         x = self.inverted_conv(x)
+        if mask is not None:
+            # masked (padded) positions read as the depthwise conv's zero padding, they do not leak into their neighbours
+            x = x * mask[:, None, :].to(x.dtype)
         x = self.depth_conv(x)
 
         x, gate = torch.chunk(x, 2, dim=1)
@@ -255,6 +258,10 @@ class LinearTransformerBlock(nn.Module):
         rotary_freqs_cis: Union[torch.Tensor, Tuple[torch.Tensor]] = None,
         rotary_freqs_cis_cross: Union[torch.Tensor, Tuple[torch.Tensor]] = None,
         temb: torch.FloatTensor = None,
+        cross_key_value: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+        cross_attention_mask: Optional[torch.Tensor] = None,
+        query_scale: Optional[torch.Tensor] = None,
+        ff_mask: Optional[torch.Tensor] = None,
     ):
 
         N = hidden_states.shape[0]
@@ -278,6 +285,7 @@ class LinearTransformerBlock(nn.Module):
                 encoder_attention_mask=encoder_attention_mask,
                 rotary_freqs_cis=rotary_freqs_cis,
                 rotary_freqs_cis_cross=rotary_freqs_cis_cross,
+                query_scale=query_scale,
             )
         else:
             attn_output, _ = self.attn(
@@ -287,6 +295,7 @@ class LinearTransformerBlock(nn.Module):
                 encoder_attention_mask=None,
                 rotary_freqs_cis=rotary_freqs_cis,
                 rotary_freqs_cis_cross=None,
+                query_scale=query_scale,
             )
 
         if self.use_adaln_single:
@@ -301,6 +310,9 @@ class LinearTransformerBlock(nn.Module):
                 encoder_attention_mask=encoder_attention_mask,
                 rotary_freqs_cis=rotary_freqs_cis,
                 rotary_freqs_cis_cross=rotary_freqs_cis_cross,
+                key_value=cross_key_value,
+                cross_attention_mask=cross_attention_mask,
+                query_scale=query_scale,
             )
             hidden_states = attn_output + hidden_states
 
@@ -310,7 +322,7 @@ class LinearTransformerBlock(nn.Module):
             norm_hidden_states = norm_hidden_states * (1 + scale_mlp) + shift_mlp
 
         # step 4: feed forward
-        ff_output = self.ff(norm_hidden_states)
+        ff_output = self.ff(norm_hidden_states, mask=ff_mask)
         if self.use_adaln_single:
             ff_output = gate_mlp * ff_output
 
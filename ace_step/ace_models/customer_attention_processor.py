@@ -23,13 +23,127 @@ from diffusers.models.attention_processor import Attention
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
 
 
+class CrossAttnKVCache:
+    """
+    Per-request cache of the cross attention keys / values computed from `encoder_hidden_states`.
+
+    `encoder_hidden_states` is produced once by `ACEStepTransformer2DModel.encode` and stays the same for the whole
+    denoising loop, so the `to_k` / `to_v` projections, the key RoPE and the attention mask only need to be computed
+    on the first `decode` call, which passes them to the blocks. Use one cache per guidance branch. The cache empties
+    itself whenever it is bound to different encoder states or masks.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.attention_mask = None
+        self._bound = None
+
+    def bind(self, encoder_hidden_states, encoder_attention_mask=None, attention_mask=None):
+        bound = (encoder_hidden_states, encoder_attention_mask, attention_mask)
+        if self._bound is None or any(a is not b for a, b in zip(self._bound, bound)):
+            self.reset()
+            self._bound = bound
+
+    def reset(self):
+        self.entries = {}
+        self.attention_mask = None
+        self._bound = None
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class AttentionTemperature:
+    """
+    ERG attention temperature: the queries of layers `l_min:l_max` are scaled by `tau` for the batch rows in `rows`.
+
+    Passed per call down to the attention processors (and the lyric encoder attention) instead of forward hooks on
+    the q projections, so weakened and normal branches can share one batch.
+    """
+
+    def __init__(self, tau=0.01, l_min=0, l_max=0, rows=slice(None)):
+        self.tau = tau
+        self.l_min = l_min
+        self.l_max = l_max
+        self.rows = rows
+        self._scales = {}
+
+    def query_scale(self, layer_index, batch_size, device, dtype):
+        """Per row query scale (batch_size,) for `layer_index`, None for layers without temperature."""
+        if not self.l_min <= layer_index < self.l_max:
+            return None
+        key = (batch_size, device, dtype)
+        scale = self._scales.get(key)
+        if scale is None:
+            scale = torch.ones(batch_size, device=device, dtype=dtype)
+            scale[self.rows] = self.tau
+            self._scales[key] = scale
+        return scale
+
+
+def scale_query(query, query_scale):
+    # query: (batch, ..., dim), query_scale: (batch,)
+    if query_scale is None:
+        return query
+    return query * query_scale.view(-1, *([1] * (query.ndim - 1)))
+
+
+def make_cross_attention_mask(attention_mask, encoder_attention_mask, heads, dtype, padded_queries=False):
+    """
+    Additive SDPA mask (batch, heads, S, S_enc) of the cross attention from the query mask (batch, S) and the encoder
+    mask (batch, S_enc). A masked out query row has no key to attend to, its all -inf row comes out of SDPA as NaN.
+    With `padded_queries=True` the masked queries are padding (frames padded to a shape bucket, see
+    `ace_step.shape_buckets`) and attend to the encoder tokens like the valid ones, so they stay finite and no NaN
+    reaches the valid frames through the next self-attention.
+    """
+    # attention_mask: N x S1
+    # encoder_attention_mask: N x S2
+    # cross attention 整合attention_mask和encoder_attention_mask
+    combined_mask = attention_mask[:, :, None] * encoder_attention_mask[:, None, :]
+    if padded_queries:
+        combined_mask = torch.where(attention_mask[:, :, None] == 1, combined_mask, encoder_attention_mask[:, None, :])
+    attention_mask = torch.where(combined_mask == 1, 0.0, -torch.inf)
+    return attention_mask[:, None, :, :].expand(-1, heads, -1, -1).to(dtype)
+
+
 class CustomLiteLAProcessor2_0:
     """Attention processor used typically in processing the SD3-like self-attention projections. add rms norm for query and key and apply RoPE"""
 
-    def __init__(self):
+    def __init__(self, chunk_size=1024):
         self.kernel_func = nn.ReLU(inplace=False)
         self.eps = 1e-15
-        self.pad_val = 1.0
+        # sequence positions per float32 chunk of the linear attention, None runs the whole sequence at once
+        self.chunk_size = chunk_size
+
+    def linear_attention(self, query, key, value):
+        """
+        ReLU linear attention, query / value: [B, H, D, S], key: [B, H, S_kv, D] -> [B, H, D, S] in query.dtype.
+
+        Associative form of `pad(value, 1) @ key @ query`: the [D, D] summary `value @ key` and the normalizer
+        `key.sum(S_kv)` are accumulated in float32 over key / value chunks, then the output is computed chunk by
+        chunk of the query. Only one chunk is upcast to float32 at a time and the padded value copy is never built.
+        """
+        kv_len, q_len = key.shape[-2], query.shape[-1]
+        kv_chunk = self.chunk_size or kv_len
+        q_chunk = self.chunk_size or q_len
+
+        vk = None
+        key_sum = None
+        for start in range(0, kv_len, kv_chunk):
+            key_chunk = key[:, :, start:start + kv_chunk].float()
+            value_chunk = value[..., start:start + kv_chunk].float()
+            chunk_vk = torch.matmul(value_chunk, key_chunk)
+            chunk_key_sum = key_chunk.sum(dim=-2, keepdim=True)
+            vk = chunk_vk if vk is None else vk + chunk_vk
+            key_sum = chunk_key_sum if key_sum is None else key_sum + chunk_key_sum
+
+        hidden_states = torch.empty(query.shape, dtype=query.dtype, device=query.device)
+        for start in range(0, q_len, q_chunk):
+            query_chunk = query[..., start:start + q_chunk].float()
+            numerator = torch.matmul(vk, query_chunk)
+            denominator = torch.matmul(key_sum, query_chunk)
+            hidden_states[..., start:start + q_chunk] = numerator / (denominator + self.eps)
+        return hidden_states
 
     def apply_rotary_emb(
         self,
@@ -70,6 +184,7 @@ class CustomLiteLAProcessor2_0:
         encoder_attention_mask: Optional[torch.FloatTensor] = None,
         rotary_freqs_cis: Union[torch.Tensor, Tuple[torch.Tensor]] = None,
         rotary_freqs_cis_cross: Union[torch.Tensor, Tuple[torch.Tensor]] = None,
+        query_scale: Optional[torch.Tensor] = None,
         *args,
         **kwargs,
     ) -> torch.FloatTensor:
@@ -89,7 +204,7 @@ class CustomLiteLAProcessor2_0:
 
         # `sample` projections.
         dtype = hidden_states.dtype
-        query = attn.to_q(hidden_states)
+        query = scale_query(attn.to_q(hidden_states), query_scale)
         key = attn.to_k(hidden_states)
         value = attn.to_v(hidden_states)
 
@@ -155,18 +270,7 @@ class CustomLiteLAProcessor2_0:
         query = self.kernel_func(query)
         key = self.kernel_func(key)
 
-        query, key, value = query.float(), key.float(), value.float()
-
-        value = F.pad(value, (0, 0, 0, 1), mode="constant", value=self.pad_val)
-
-        vk = torch.matmul(value, key)
-
-        hidden_states = torch.matmul(vk, query)
-
-        if hidden_states.dtype in [torch.float16, torch.bfloat16]:
-            hidden_states = hidden_states.float()
-
-        hidden_states = hidden_states[:, :, :-1] / (hidden_states[:, :, -1:] + self.eps)
+        hidden_states = self.linear_attention(query, key, value)
 
         hidden_states = hidden_states.view(batch_size, attn.heads * head_dim, -1).permute(0, 2, 1)
 
@@ -240,6 +344,40 @@ class CustomerAttnProcessor2_0:
 
         return out
 
+    def key_value(
+        self,
+        attn: Attention,
+        encoder_hidden_states: torch.FloatTensor,
+        rotary_freqs_cis: Union[torch.Tensor, Tuple[torch.Tensor]] = None,
+        rotary_freqs_cis_cross: Union[torch.Tensor, Tuple[torch.Tensor]] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Keys and values [B, H, S_enc, D] of `encoder_hidden_states`, with the key norm and RoPE applied."""
+        batch_size = encoder_hidden_states.shape[0]
+        has_encoder_hidden_state_proj = hasattr(attn, "add_q_proj") and hasattr(attn, "add_k_proj") and hasattr(attn, "add_v_proj")
+
+        if attn.norm_cross:
+            encoder_hidden_states = attn.norm_encoder_hidden_states(encoder_hidden_states)
+
+        key = attn.to_k(encoder_hidden_states)
+        value = attn.to_v(encoder_hidden_states)
+
+        inner_dim = key.shape[-1]
+        head_dim = inner_dim // attn.heads
+
+        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        if attn.norm_k is not None:
+            key = attn.norm_k(key)
+
+        # Apply RoPE if needed
+        if rotary_freqs_cis is not None:
+            if not attn.is_cross_attention:
+                key = self.apply_rotary_emb(key, rotary_freqs_cis)
+            elif rotary_freqs_cis_cross is not None and has_encoder_hidden_state_proj:
+                key = self.apply_rotary_emb(key, rotary_freqs_cis_cross)
+        return key, value
+
     def __call__(
         self,
         attn: Attention,
@@ -249,6 +387,9 @@ class CustomerAttnProcessor2_0:
         encoder_attention_mask: Optional[torch.FloatTensor] = None,
         rotary_freqs_cis: Union[torch.Tensor, Tuple[torch.Tensor]] = None,
         rotary_freqs_cis_cross: Union[torch.Tensor, Tuple[torch.Tensor]] = None,
+        key_value: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+        cross_attention_mask: Optional[torch.Tensor] = None,
+        query_scale: Optional[torch.Tensor] = None,
         *args,
         **kwargs,
     ) -> torch.Tensor:
@@ -269,45 +410,28 @@ class CustomerAttnProcessor2_0:
         if attn.group_norm is not None:
             hidden_states = attn.group_norm(hidden_states.transpose(1, 2)).transpose(1, 2)
 
-        query = attn.to_q(hidden_states)
+        query = scale_query(attn.to_q(hidden_states), query_scale)
 
-        if encoder_hidden_states is None:
-            encoder_hidden_states = hidden_states
-        elif attn.norm_cross:
-            encoder_hidden_states = attn.norm_encoder_hidden_states(encoder_hidden_states)
-
-        key = attn.to_k(encoder_hidden_states)
-        value = attn.to_v(encoder_hidden_states)
-
-        inner_dim = key.shape[-1]
-        head_dim = inner_dim // attn.heads
+        # keys / values only depend on encoder_hidden_states, decode computes them once and reuses them across steps
+        if key_value is None:
+            if encoder_hidden_states is None:
+                encoder_hidden_states = hidden_states
+            key_value = self.key_value(attn, encoder_hidden_states, rotary_freqs_cis, rotary_freqs_cis_cross)
+        key, value = key_value
+        head_dim = key.shape[-1]
 
         query = query.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
 
-        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
-        value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
-
         if attn.norm_q is not None:
             query = attn.norm_q(query)
-        if attn.norm_k is not None:
-            key = attn.norm_k(key)
 
-        # Apply RoPE if needed
         if rotary_freqs_cis is not None:
             query = self.apply_rotary_emb(query, rotary_freqs_cis)
-            if not attn.is_cross_attention:
-                key = self.apply_rotary_emb(key, rotary_freqs_cis)
-            elif rotary_freqs_cis_cross is not None and has_encoder_hidden_state_proj:
-                key = self.apply_rotary_emb(key, rotary_freqs_cis_cross)
-
-        if attn.is_cross_attention and encoder_attention_mask is not None and has_encoder_hidden_state_proj:
-            # attention_mask: N x S1
-            # encoder_attention_mask: N x S2
-            # cross attention 整合attention_mask和encoder_attention_mask
-            combined_mask = attention_mask[:, :, None] * encoder_attention_mask[:, None, :]
-            attention_mask = torch.where(combined_mask == 1, 0.0, -torch.inf)
-            attention_mask = attention_mask[:, None, :, :].expand(-1, attn.heads, -1, -1).to(query.dtype)
 
+        if attn.is_cross_attention and cross_attention_mask is not None:
+            attention_mask = cross_attention_mask
+        elif attn.is_cross_attention and encoder_attention_mask is not None and has_encoder_hidden_state_proj:
+            attention_mask = make_cross_attention_mask(attention_mask, encoder_attention_mask, attn.heads, query.dtype)
         elif not attn.is_cross_attention and attention_mask is not None:
             attention_mask = attn.prepare_attention_mask(attention_mask, sequence_length, batch_size)
             # scaled_dot_product_attention expects attention_mask shape to be
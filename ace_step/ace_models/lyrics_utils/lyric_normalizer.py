@@ -1,9 +1,13 @@
 import re
-from opencc import OpenCC
+from functools import lru_cache
 
 
-t2s_converter = OpenCC('t2s')
-s2t_converter = OpenCC('s2t')
+@lru_cache(maxsize=None)
+def get_opencc_converter(config):
+    # OpenCC loads its dictionaries on construction, only pay for it when Chinese text is normalized
+    from opencc import OpenCC
+
+    return OpenCC(config)
 
 
 EMOJI_PATTERN = re.compile(
@@ -59,8 +63,8 @@ def normalize_text(text, language, strip=True):
 
     # Step 6: 多语言转换
     if language == "zh":
-        text = t2s_converter.convert(text)
+        text = get_opencc_converter('t2s').convert(text)
     if language == "yue":
-        text = s2t_converter.convert(text)
+        text = get_opencc_converter('s2t').convert(text)
     # 其他语言根据需要添加
     return text
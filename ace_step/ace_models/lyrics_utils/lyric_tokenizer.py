@@ -1,46 +1,54 @@
 import os
 import re
 import textwrap
-from functools import cached_property
-import pypinyin
-import torch
-
-from hangul_romanize import Transliter
-from hangul_romanize.rule import academic
-from num2words import num2words
-from spacy.lang.ar import Arabic
-from spacy.lang.en import English
-from spacy.lang.es import Spanish
-from spacy.lang.ja import Japanese
-from spacy.lang.zh import Chinese
+from functools import cached_property, lru_cache
+
 from tokenizers import Tokenizer
 from typing import Dict, List, Optional, Set, Union
 
-from ace_step.ace_models.lyrics_utils.zh_num2words import TextNorm as zh_num2words
 
 
+# The per-language front-ends (spacy, num2words, pypinyin, hangul_romanize) are imported on first use, so
+# importing this module stays cheap and a language that never shows up in the lyrics never loads its packages.
+
 #copy from https://github.com/coqui-ai/TTS/blob/dbf1a08a0d4e47fdad6172e433eeb34bc6b13b4e/TTS/tts/layers/xtts/tokenizer.py
 def get_spacy_lang(lang):
     if lang == "zh":
+        from spacy.lang.zh import Chinese
         return Chinese()
     elif lang == "ja":
+        from spacy.lang.ja import Japanese
         return Japanese()
     elif lang == "ar":
+        from spacy.lang.ar import Arabic
         return Arabic()
     elif lang == "es":
+        from spacy.lang.es import Spanish
         return Spanish()
     else:
         # For most languages, Enlish does the job
+        from spacy.lang.en import English
         return English()
 
 
+@lru_cache(maxsize=None)
+def get_spacy_sentencizer(lang):
+    nlp = get_spacy_lang(lang)
+    nlp.add_pipe("sentencizer")
+    return nlp
+
+
+def num2words(*args, **kwargs):
+    from num2words import num2words as _num2words
+    return _num2words(*args, **kwargs)
+
+
 def split_sentence(text, lang, text_split_length=250):
     """Preprocess the input text"""
     text_splits = []
     if text_split_length is not None and len(text) >= text_split_length:
         text_splits.append("")
-        nlp = get_spacy_lang(lang)
-        nlp.add_pipe("sentencizer")
+        nlp = get_spacy_sentencizer(lang)
         doc = nlp(text)
         for sentence in doc.sents:
             if len(text_splits[-1]) + len(str(sentence)) <= text_split_length:
@@ -523,6 +531,8 @@ def _expand_number(m, lang="en"):
 
 def expand_numbers_multilingual(text, lang="en"):
     if lang == "zh":
+        from ace_step.ace_models.lyrics_utils.zh_num2words import TextNorm as zh_num2words
+
         text = zh_num2words()(text)
     else:
         if lang in ["en", "ru"]:
@@ -581,6 +591,8 @@ def basic_cleaners(text):
 
 
 def chinese_transliterate(text):
+    import pypinyin
+
     return "".join(
         [p[0] for p in pypinyin.pinyin(text, style=pypinyin.Style.TONE3, heteronym=False, neutral_tone_with_five=True)]
     )
@@ -592,8 +604,16 @@ def japanese_cleaners(text, katsu):
     return text
 
 
+@lru_cache(maxsize=1)
+def get_korean_transliter():
+    from hangul_romanize import Transliter
+    from hangul_romanize.rule import academic
+
+    return Transliter(academic)
+
+
 def korean_transliterate(text):
-    r = Transliter(academic)
+    r = get_korean_transliter()
     return r.translit(text)
 
 
@@ -664,7 +684,7 @@ class VoiceBpeTokenizer:
         return self.tokenizer.encode(txt).ids
 
     def decode(self, seq, skip_special_tokens=False):
-        if isinstance(seq, torch.Tensor):
+        if hasattr(seq, "cpu"):
             seq = seq.cpu().numpy()
         txt = self.tokenizer.decode(seq, skip_special_tokens=False).replace(" ", "")
         txt = txt.replace("[SPACE]", " ")
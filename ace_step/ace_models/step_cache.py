@@ -0,0 +1,109 @@
+import torch
+
+
+class StepCacheSchedule:
+    """
+    Decides, once per denoising step, whether the transformer block stack can be skipped (TeaCache style).
+
+    Adjacent denoising steps change the blocks' output very little. Every step, the schedule compares the
+    timestep-modulated input of the first block (`ACEStepTransformer2DModel.step_cache_probe`) with the previous
+    step's and accumulates the relative L1 change. While the total stays under `threshold`, the step is skipped: every
+    guidance branch adds the residual of its last full computation instead of running blocks
+    `[start_block, end_block)`. Once the total reaches the threshold, the step is computed and the total resets.
+    Higher thresholds skip more steps at the cost of fidelity.
+
+    The total is kept on the device, reading the decision back is the only host sync, one per step for all the
+    branches. The first `warmup_steps` and the last step are always computed.
+    """
+
+    def __init__(self, threshold=0.05, start_block=0, end_block=None, warmup_steps=1):
+        self.threshold = threshold
+        self.start_block = start_block
+        self.end_block = end_block
+        self.warmup_steps = warmup_steps
+        self.reset()
+
+    def reset(self):
+        self.previous_modulated = None
+        self.accumulated = None
+        self.step = None
+        self.computed_step = None
+        self.reuse = False
+
+    def block_range(self, num_blocks):
+        end_block = num_blocks if self.end_block is None else min(self.end_block, num_blocks)
+        return self.start_block, end_block
+
+    @staticmethod
+    def modulated_input(hidden_states, temb):
+        # AdaLN-single input of a block without its learned table: rms norm, then the temb shift / scale of the msa
+        shift, scale = temb.reshape(hidden_states.shape[0], 6, -1)[:, :2].chunk(2, dim=1)
+        variance = hidden_states.float().pow(2).mean(-1, keepdim=True)
+        norm_hidden_states = hidden_states * torch.rsqrt(variance + 1e-6).to(hidden_states.dtype)
+        return norm_hidden_states * (1 + scale) + shift
+
+    def decide(self, step, num_steps, modulated):
+        """Called before the step's decodes with the probe of its latents, True when the branches reuse their residuals."""
+        previous = self.previous_modulated
+        self.previous_modulated = modulated
+        self.step = step
+        self.reuse = False
+        if previous is not None and previous.shape == modulated.shape:
+            change = (modulated - previous).abs().mean() / previous.abs().mean().clamp_min(1e-8)
+            self.accumulated = change if self.accumulated is None else self.accumulated + change
+            forced = step < self.warmup_steps or step >= num_steps - 1
+            self.reuse = not forced and self.computed_step is not None and bool(self.accumulated < self.threshold)
+        if not self.reuse:
+            self.accumulated = None
+            self.computed_step = step
+        return self.reuse
+
+
+class StepCache:
+    """
+    Residual of the transformer block stack for one guidance branch, reused on the steps its `StepCacheSchedule`
+    skips. Use one cache per guidance branch, like `CrossAttnKVCache`, all sharing one schedule. A branch whose
+    residual is not from the schedule's last computed step (it did not run then, e.g. outside the guidance
+    interval) computes its blocks even on a skipped step.
+    """
+
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.computed_steps = 0
+        self.skipped_steps = 0
+        self.reset()
+
+    def reset(self):
+        self.residual = None
+        self.residual_step = None
+        self.block_input = None
+
+    def block_range(self, num_blocks):
+        return self.schedule.block_range(num_blocks)
+
+    def should_reuse(self, hidden_states):
+        """Called with the input of `start_block`, True when the cached residual can stand in for the blocks."""
+        reuse = (
+            self.schedule.reuse
+            and self.residual is not None
+            and self.residual_step == self.schedule.computed_step
+            and self.residual.shape == hidden_states.shape
+        )
+        if reuse:
+            self.skipped_steps += 1
+        else:
+            self.computed_steps += 1
+            self.block_input = hidden_states
+        return reuse
+
+    def apply(self, hidden_states):
+        return hidden_states + self.residual
+
+    def store(self, hidden_states):
+        """Called with the output of the last cached block after a full computation."""
+        self.residual = hidden_states - self.block_input
+        self.residual_step = self.schedule.step
+        self.block_input = None
+
+    def stats(self):
+        return {"computed_steps": self.computed_steps, "skipped_steps": self.skipped_steps}
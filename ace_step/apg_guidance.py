@@ -92,3 +92,63 @@ def cfg_zero_star(noise_pred_with_cond, noise_pred_uncond, guidance_scale, i, ze
     else:
         noise_pred = noise_pred_uncond * alpha + guidance_scale * (noise_pred_with_cond - noise_pred_uncond * alpha)
     return noise_pred
+
+
+def guidance_agreement(pred_cond, pred_uncond, metric="cosine"):
+    """
+    How close the conditional and unconditional predictions are, worst item of the batch, as a 0-dim tensor.
+
+    "cosine": smallest cosine similarity, 1.0 means identical directions.
+    "norm": largest ||cond - uncond|| / ||cond||, 0.0 means identical predictions.
+    """
+    bsz = pred_cond.shape[0]
+    cond_flat = pred_cond.reshape(bsz, -1).float()
+    uncond_flat = pred_uncond.reshape(bsz, -1).float()
+    if metric == "cosine":
+        return torch.nn.functional.cosine_similarity(cond_flat, uncond_flat, dim=1).min()
+    elif metric == "norm":
+        ratio = (cond_flat - uncond_flat).norm(dim=1) / cond_flat.norm(dim=1).clamp_min(1e-8)
+        return ratio.max()
+    raise ValueError(f"Unknown guidance agreement metric: {metric}")
+
+
+class AdaptiveGuidanceTruncation:
+    """
+    Drops the unconditional passes once guidance stops changing the prediction.
+
+    Every guided step compares `pred_cond` and `pred_uncond` with `guidance_agreement`. After `patience` consecutive
+    steps within `tolerance` (cosine >= 1 - tolerance, or norm ratio <= tolerance), `truncated` turns True and the
+    caller runs the conditional pass only for the rest of the guidance interval. Independent of the cfg / apg /
+    cfg_star rule that combines the predictions.
+
+    The streak is counted on the device. It is read back only once it can have reached `patience` (`max_streak`
+    steps since it was last known), so the steps before that do not sync with the host.
+    """
+
+    def __init__(self, tolerance=0.01, patience=3, metric="cosine"):
+        self.tolerance = tolerance
+        self.patience = patience
+        self.metric = metric
+        self.streak = None
+        # upper bound of the streak on the host
+        self.max_streak = 0
+        self.truncated = False
+        self.truncated_at = None
+
+    def agrees(self, value):
+        if self.metric == "cosine":
+            return value >= 1.0 - self.tolerance
+        return value <= self.tolerance
+
+    def update(self, step, pred_cond, pred_uncond):
+        """Returns the step's agreement as a 0-dim tensor."""
+        value = guidance_agreement(pred_cond, pred_uncond, self.metric)
+        agrees = self.agrees(value).int()
+        self.streak = agrees if self.streak is None else (self.streak + 1) * agrees
+        self.max_streak += 1
+        if self.max_streak >= self.patience:
+            self.max_streak = int(self.streak)
+            if self.max_streak >= self.patience:
+                self.truncated = True
+                self.truncated_at = step
+        return value
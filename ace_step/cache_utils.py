@@ -0,0 +1,202 @@
+import os
+import hashlib
+from collections import OrderedDict
+
+import torch
+from loguru import logger
+from safetensors.torch import save_file, load_file
+
+
+def tensor_nbytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(tensor_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(tensor_nbytes(v) for v in value.values())
+    return 0
+
+
+def hash_tensor(tensor, hasher=None):
+    """Feed the raw bytes, shape and dtype of `tensor` into a sha256 hasher."""
+    if hasher is None:
+        hasher = hashlib.sha256()
+    tensor = tensor.detach().cpu().contiguous()
+    hasher.update(str((tuple(tensor.shape), str(tensor.dtype))).encode())
+    hasher.update(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+    return hasher
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by the total tensor bytes it holds and, optionally, by its entry count.
+
+    Values are tensors (or tuples / dicts of tensors), other values count as zero bytes and should be bounded with
+    `max_entries`. `max_bytes=0` disables the cache for tensors.
+    """
+
+    def __init__(self, max_bytes=512 * 1024**2, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        size = tensor_nbytes(value)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= tensor_nbytes(self.entries.pop(key))
+        self.entries[key] = value
+        self.nbytes += size
+        while self.nbytes > self.max_bytes or (
+            self.max_entries is not None and len(self.entries) > self.max_entries
+        ):
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= tensor_nbytes(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class LatentCache(LRUCache):
+    """
+    Content addressed cache of DCAE latents for source / reference audio.
+
+    Keys hash the waveform bytes, the sample rate and the DCAE / vocoder checkpoints, so editing the same song
+    again skips `MusicDCAE.encode`. With `disk_dir` set, latents are also written there as safetensors files and
+    survive a restart or an eviction from memory. The disk tier is a least recently used cache of its own, bounded
+    by `disk_max_bytes` (and `disk_max_entries`): file modification times record the last use, the oldest files are
+    deleted first.
+    """
+
+    def __init__(self, max_bytes=256 * 1024**2, disk_dir=None, disk_max_bytes=1024**3, disk_max_entries=None):
+        super().__init__(max_bytes=max_bytes)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_max_entries = disk_max_entries
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._evict_disk()
+
+    @staticmethod
+    def make_key(audio, model_id):
+        hasher = hashlib.sha256(str(model_id).encode())
+        if isinstance(audio, (tuple, list)):
+            waveform, sr = audio
+            hash_tensor(waveform, hasher)
+            hasher.update(str(int(sr)).encode())
+        else:
+            # file inputs are identified by path, size and modification time
+            stat = os.stat(audio)
+            hasher.update(f"{os.path.abspath(audio)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return hasher.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.safetensors")
+
+    def _disk_entries(self):
+        # (mtime, size, path) of the cached files, least recently used first
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".safetensors"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return sorted(entries)
+
+    def _evict_disk(self):
+        entries = self._disk_entries()
+        total = sum(size for _, size, _ in entries)
+        while entries and (
+            total > self.disk_max_bytes
+            or (self.disk_max_entries is not None and len(entries) > self.disk_max_entries)
+        ):
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def disk_stats(self):
+        entries = self._disk_entries() if self.disk_dir is not None else []
+        return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries)}
+
+    def get(self, key, device=None):
+        latents = super().get(key)
+        if latents is None and self.disk_dir is not None and os.path.exists(self._disk_path(key)):
+            try:
+                latents = load_file(self._disk_path(key))["latents"]
+            except Exception as e:
+                logger.warning(f"failed to load cached latents {key}: {e}")
+                return None
+            # counted as a miss above, it is served from disk
+            self.misses -= 1
+            self.hits += 1
+            # the modification time is the disk tier's last use
+            os.utime(self._disk_path(key))
+            if device is not None:
+                latents = latents.to(device)
+            super().put(key, latents)
+        return latents
+
+    def put(self, key, latents):
+        super().put(key, latents)
+        if self.disk_dir is None:
+            return
+        if os.path.exists(self._disk_path(key)):
+            os.utime(self._disk_path(key))
+            return
+        try:
+            save_file({"latents": latents.detach().cpu().contiguous()}, self._disk_path(key))
+        except Exception as e:
+            logger.warning(f"failed to save cached latents {key}: {e}")
+            return
+        self._evict_disk()
+
+
+class TextEmbeddingCache(LRUCache):
+    """
+    Cache of UMT5 prompt embeddings, kept on the device they were computed on.
+
+    Keys cover the texts, the tokenizer max length, the ERG temperature settings (`None` for the plain forward) and
+    the text encoder identity and dtype. Tags change far less often than seeds or lyrics, so most runs hit.
+    """
+
+    def __init__(self, max_bytes=128 * 1024**2):
+        super().__init__(max_bytes=max_bytes)
+
+    @staticmethod
+    def make_key(texts, text_max_length, tau=None, l_min=None, l_max=None, model_id=None, dtype=None):
+        return (tuple(texts), text_max_length, tau, l_min, l_max, model_id, str(dtype))
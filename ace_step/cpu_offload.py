@@ -1,5 +1,7 @@
 import torch
 import functools
+import contextlib
+from collections import OrderedDict
 from typing import Callable, TypeVar
 
 
@@ -22,6 +24,288 @@ class CpuOffloader:
             torch.cuda.synchronize()
 
 
+def model_nbytes(model):
+    return sum(t.numel() * t.element_size() for t in model.parameters()) + sum(
+        t.numel() * t.element_size() for t in model.buffers()
+    )
+
+
+class ModelResidencyManager:
+    """
+    Decides which offloaded models live on the compute device.
+
+    Outside of a `scope()` a model is moved back to the CPU after every use, like `CpuOffloader`. Inside a scope
+    (a whole request or diffusion loop) models stay resident after use and are only evicted, least recently used
+    first, when loading another model would exceed `memory_budget` bytes. `memory_budget=0` keeps only the model in
+    use resident, `None` never evicts. Transfers are counted; with `accounting_only=True` nothing is moved, which
+    lets the residency decisions be checked on a CPU-only machine.
+    """
+
+    def __init__(self, device, memory_budget=0, accounting_only=False):
+        self.device = device
+        self.memory_budget = memory_budget
+        self.accounting_only = accounting_only
+        self.resident = OrderedDict() # model -> bytes, in LRU order
+        self.in_use = {} # model -> number of active `use` contexts
+        self.dtypes = {} # model -> dtype it is loaded in, the one it had when first acquired
+        self.scope_depth = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.transfers_to_device = 0
+        self.transfers_to_host = 0
+        self.bytes_to_device = 0
+        self.bytes_to_host = 0
+
+    def stats(self):
+        return {
+            "resident": len(self.resident),
+            "resident_bytes": self.resident_bytes(),
+            "transfers_to_device": self.transfers_to_device,
+            "transfers_to_host": self.transfers_to_host,
+            "bytes_to_device": self.bytes_to_device,
+            "bytes_to_host": self.bytes_to_host,
+        }
+
+    def resident_bytes(self):
+        return sum(self.resident.values())
+
+    def _move(self, model, device, dtype=None):
+        if self.accounting_only or hasattr(model, "torchao_quantized"):
+            return
+        if dtype is None:
+            model.to(device)
+        else:
+            model.to(device, dtype=dtype)
+
+    def _evict(self, model):
+        nbytes = self.resident.pop(model)
+        self._move(model, "cpu")
+        self.transfers_to_host += 1
+        self.bytes_to_host += nbytes
+
+    def _make_room(self, nbytes):
+        if self.memory_budget is None:
+            return
+        evicted = False
+        for candidate in list(self.resident):
+            if self.resident_bytes() + nbytes <= self.memory_budget:
+                break
+            if self.in_use.get(candidate, 0) == 0:
+                self._evict(candidate)
+                evicted = True
+        if evicted and not self.accounting_only and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def acquire(self, model):
+        if model in self.resident:
+            self.resident.move_to_end(model)
+        else:
+            nbytes = model_nbytes(model)
+            self._make_room(nbytes)
+            # like CpuOffloader, the model comes back in its own dtype
+            dtype = self.dtypes.setdefault(model, getattr(model, "dtype", None))
+            self._move(model, self.device, dtype)
+            self.resident[model] = nbytes
+            self.transfers_to_device += 1
+            self.bytes_to_device += nbytes
+        self.in_use[model] = self.in_use.get(model, 0) + 1
+        return model
+
+    def release(self, model):
+        self.in_use[model] -= 1
+        if self.in_use[model] == 0:
+            del self.in_use[model]
+            if self.scope_depth == 0 and model in self.resident:
+                self._evict(model)
+                if not self.accounting_only and torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+
+    @contextlib.contextmanager
+    def use(self, model):
+        self.acquire(model)
+        try:
+            yield model
+        finally:
+            self.release(model)
+
+    @contextlib.contextmanager
+    def scope(self):
+        self.scope_depth += 1
+        try:
+            yield self
+        finally:
+            self.scope_depth -= 1
+            if self.scope_depth == 0:
+                self.offload_all()
+
+    def offload_all(self):
+        for model in list(self.resident):
+            if self.in_use.get(model, 0) == 0:
+                self._evict(model)
+        if not self.accounting_only and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            torch.cuda.synchronize()
+
+
+def module_tensors(module):
+    return list(module.parameters()) + list(module.buffers())
+
+
+class BlockStreamer:
+    """
+    Layer-wise offload: streams the weights of a sequence of blocks through the accelerator.
+
+    Every streamed block keeps its weights in (pinned) host memory. A forward pre-hook swaps the block's device
+    copy in, and starts the asynchronous copy of the next block of the same group on a side stream, so the transfer
+    overlaps the current block's compute. A forward hook drops the device copy again. The first `resident_blocks`
+    of each group stay on the device. Peak accelerator memory is the resident blocks, the running block, the
+    prefetched one and the activations. With `accounting_only=True` no tensor is moved and only the transfers and
+    the peak number of loaded blocks are recorded.
+    """
+
+    def __init__(self, device, resident_blocks=1, accounting_only=False):
+        self.device = torch.device(device)
+        self.resident_blocks = resident_blocks
+        self.accounting_only = accounting_only
+        self.use_streams = not accounting_only and self.device.type == "cuda"
+        self.copy_stream = torch.cuda.Stream(device=self.device) if self.use_streams else None
+        self.host = {} # block -> [(tensor, host copy)]
+        self.permanent = set()
+        self.loaded = set()
+        self.pending = {} # block -> (device tensors, copy event)
+        self.handles = []
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.transfers_to_device = 0
+        self.bytes_to_device = 0
+        self.prefetches = 0
+        self.evictions = 0
+        self.peak_loaded_blocks = len(self.loaded)
+
+    def stats(self):
+        return {
+            "transfers_to_device": self.transfers_to_device,
+            "bytes_to_device": self.bytes_to_device,
+            "prefetches": self.prefetches,
+            "evictions": self.evictions,
+            "peak_loaded_blocks": self.peak_loaded_blocks,
+        }
+
+    def attach(self, model, groups):
+        """Streams the blocks in `groups` (lists of modules, in call order) and moves the rest of `model` to the device."""
+        self.model = model
+        self.groups = groups
+        streamed = set()
+        for group in groups:
+            for block in group:
+                streamed.update(id(t) for t in module_tensors(block))
+
+        if not self.accounting_only:
+            for t in module_tensors(model):
+                if id(t) not in streamed:
+                    t.data = t.data.to(self.device)
+
+        for group in groups:
+            group = list(group)
+            for i, block in enumerate(group):
+                entries = []
+                for t in module_tensors(block):
+                    host = t.data
+                    if not self.accounting_only:
+                        host = host.to("cpu")
+                        if self.use_streams:
+                            host = host.pin_memory()
+                        t.data = host
+                    entries.append((t, host))
+                self.host[block] = entries
+                if i < self.resident_blocks:
+                    self.permanent.add(block)
+                    self._ensure_loaded(block)
+                self.handles.append(block.register_forward_pre_hook(functools.partial(self._pre_hook, group, i)))
+                self.handles.append(block.register_forward_hook(self._post_hook))
+        return self
+
+    def detach(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        for block in list(self.loaded) + list(self.pending):
+            self._offload(block)
+        self.host = {}
+        self.permanent = set()
+        self.pending = {}
+
+    def _nbytes(self, block):
+        return sum(host.numel() * host.element_size() for _, host in self.host[block])
+
+    def _track_peak(self):
+        self.peak_loaded_blocks = max(self.peak_loaded_blocks, len(self.loaded) + len(self.pending))
+
+    def _prefetch(self, block):
+        if block in self.loaded or block in self.pending:
+            return
+        self.prefetches += 1
+        self.transfers_to_device += 1
+        self.bytes_to_device += self._nbytes(block)
+        if self.accounting_only:
+            self.pending[block] = (None, None)
+        elif self.use_streams:
+            # the copy must not start before the compute stream is done with memory it may reuse
+            self.copy_stream.wait_stream(torch.cuda.current_stream(self.device))
+            with torch.cuda.stream(self.copy_stream):
+                tensors = [host.to(self.device, non_blocking=True) for _, host in self.host[block]]
+                event = torch.cuda.Event()
+                event.record(self.copy_stream)
+            self.pending[block] = (tensors, event)
+        else:
+            self.pending[block] = ([host.to(self.device) for _, host in self.host[block]], None)
+        self._track_peak()
+
+    def _ensure_loaded(self, block):
+        if block in self.loaded:
+            return
+        if block not in self.pending:
+            self._prefetch(block)
+            self.prefetches -= 1 # a blocking load, not a prefetch
+        tensors, event = self.pending.pop(block)
+        if not self.accounting_only:
+            if event is not None:
+                current_stream = torch.cuda.current_stream(self.device)
+                current_stream.wait_event(event)
+                for tensor in tensors:
+                    tensor.record_stream(current_stream)
+            for (t, _), tensor in zip(self.host[block], tensors):
+                t.data = tensor
+        self.loaded.add(block)
+        self._track_peak()
+
+    def load(self, block):
+        """Loads `block` ahead of its forward, for weights used outside of it (the forward hooks then find it loaded)."""
+        self._ensure_loaded(block)
+
+    def _offload(self, block):
+        self.pending.pop(block, None)
+        if block not in self.loaded:
+            return
+        if not self.accounting_only:
+            for t, host in self.host[block]:
+                t.data = host
+        self.loaded.discard(block)
+        self.evictions += 1
+
+    def _pre_hook(self, group, index, module, args):
+        self._ensure_loaded(module)
+        # the last block prefetches nothing, the group's first block is not needed before the next forward
+        if index + 1 < len(group):
+            self._prefetch(group[index + 1])
+
+    def _post_hook(self, module, args, output):
+        if module not in self.permanent:
+            self._offload(module)
+
+
 T = TypeVar('T')
 
 def cpu_offload(model_attr: str):
@@ -35,9 +319,31 @@ def cpu_offload(model_attr: str):
             device = self.device
             # Get the model from the class attribute
             model = getattr(self, model_attr)
-            
+
+            # block streamed models handle their own placement
+            if getattr(model, "block_streamer", None) is not None:
+                return func(self, *args, **kwargs)
+
+            manager = getattr(self, "residency_manager", None)
+            if manager is not None:
+                with manager.use(model):
+                    return func(self, *args, **kwargs)
+
             with CpuOffloader(model, device):
                 return func(self, *args, **kwargs)
                         
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
+
+
+def residency_scope(func: Callable[..., T]) -> Callable[..., T]:
+    """Keeps offloaded models resident, within the residency manager budget, for the whole call."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        manager = getattr(self, "residency_manager", None)
+        if not self.cpu_offload or manager is None:
+            return func(self, *args, **kwargs)
+        with manager.scope():
+            return func(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,212 @@
+import json
+import time
+import inspect
+import functools
+import contextlib
+import contextvars
+
+import torch
+from loguru import logger
+
+
+_current = contextvars.ContextVar("ace_step_instrumentation", default=None)
+
+
+def synchronize(device):
+    device = torch.device(device)
+    if device.type == "cuda" and torch.cuda.is_available():
+        torch.cuda.synchronize(device)
+    elif device.type == "mps" and torch.backends.mps.is_available():
+        torch.mps.synchronize()
+
+
+class Instrumentation:
+    """
+    Per-stage timing and memory of one pipeline call.
+
+    Stages are named blocks, opened with `stage(name)` anywhere below the pipeline while the instrumentation is
+    active (see `activate`), so the models need no reference to it. Every stage records:
+
+    - `wall_time`: host time spent in the block, what a caller sees without synchronizing.
+    - `device_time`: time until the device has finished the block's work. The device is synchronized on entry and
+      exit, which serializes the kernel queue, so only enable it to measure.
+    - `peak_memory`: peak allocated device memory inside the block, nested blocks included (CUDA only).
+
+    Calls to a stage with the same name are summed, e.g. `decode.cond` over all diffusion steps. `max_depth` limits
+    recording to the outer stages, deeper ones cost nothing. With `profile_ranges` every stage is also a
+    `torch.profiler.record_function` range named `ace_step.<name>`, for traces taken with `torch.profiler`.
+    """
+
+    def __init__(self, device=None, synchronize=True, track_memory=True, profile_ranges=False, max_depth=None):
+        self.device = torch.device(device) if device is not None else None
+        self.synchronize = synchronize and self.device is not None
+        self.track_memory = (
+            track_memory and self.device is not None and self.device.type == "cuda" and torch.cuda.is_available()
+        )
+        self.profile_ranges = profile_ranges
+        self.max_depth = max_depth
+        self.stages = {}
+        self.stack = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.max_depth is not None and len(self.stack) >= self.max_depth:
+            # still counts as a level, stages opened inside it are deeper than max_depth too
+            self.stack.append(None)
+            try:
+                yield
+            finally:
+                self.stack.pop()
+            return
+
+        parent = next((frame["name"] for frame in reversed(self.stack) if frame is not None), None)
+        frame = {"name": name, "peak": 0}
+        if self.track_memory:
+            # the running peak is per frame: fold the parent's peak so far in before resetting the counter
+            if self.stack and self.stack[-1] is not None:
+                self.stack[-1]["peak"] = max(self.stack[-1]["peak"], torch.cuda.max_memory_allocated(self.device))
+            torch.cuda.reset_peak_memory_stats(self.device)
+        if self.synchronize:
+            synchronize(self.device)
+        self.stack.append(frame)
+
+        record_range = (
+            torch.profiler.record_function(f"ace_step.{name}") if self.profile_ranges else contextlib.nullcontext()
+        )
+        start = time.perf_counter()
+        try:
+            with record_range:
+                yield
+        finally:
+            wall_time = time.perf_counter() - start
+            device_time = None
+            if self.synchronize:
+                synchronize(self.device)
+                device_time = time.perf_counter() - start
+            self.stack.pop()
+
+            peak = None
+            if self.track_memory:
+                peak = max(frame["peak"], torch.cuda.max_memory_allocated(self.device))
+                if self.stack and self.stack[-1] is not None:
+                    self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+            self.record(name, parent, wall_time, device_time, peak)
+
+    def record(self, name, parent, wall_time, device_time=None, peak_memory=None):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = {
+                "parent": parent,
+                "calls": 0,
+                "wall_time": 0.0,
+                "device_time": None,
+                "peak_memory": None,
+            }
+        entry["calls"] += 1
+        entry["wall_time"] += wall_time
+        if device_time is not None:
+            entry["device_time"] = (entry["device_time"] or 0.0) + device_time
+        if peak_memory is not None:
+            entry["peak_memory"] = max(entry["peak_memory"] or 0, peak_memory)
+
+    def report(self):
+        return {
+            "device": str(self.device) if self.device is not None else None,
+            "synchronized": self.synchronize,
+            "stages": {name: dict(entry) for name, entry in self.stages.items()},
+        }
+
+    def to_json(self, path=None):
+        text = json.dumps(self.report(), indent=2)
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        return text
+
+    def summary(self):
+        lines = []
+        for name, entry in self.stages.items():
+            if entry["parent"] is not None:
+                continue
+            line = f"{name} time cost: {entry['wall_time']:.2f} seconds."
+            if entry["device_time"] is not None:
+                line += f" (device {entry['device_time']:.2f}s)"
+            lines.append(line)
+        return lines
+
+
+@contextlib.contextmanager
+def activate(instrumentation):
+    """Make `instrumentation` the target of `stage` in this context."""
+    token = _current.set(instrumentation)
+    try:
+        yield instrumentation
+    finally:
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def stage(name):
+    """A recorded stage of the active instrumentation, a no-op when there is none."""
+    instrumentation = _current.get()
+    if instrumentation is None:
+        return contextlib.nullcontext()
+    return instrumentation.stage(name)
+
+
+def instrumented(func):
+    """
+    Records the stages of a pipeline call, the result is kept as `self.last_report`.
+
+    Takes three keyword arguments off the call: `instrument` records every stage with device synchronization and
+    peak memory (otherwise only the outer stages' wall time, at no measurable cost), `profile_ranges` adds the
+    `torch.profiler` ranges and `report_path` writes the report there as JSON. A call that returns a generator
+    (`stream_decode`) is reported once the generator is exhausted or closed, with the stages it ran.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, instrument=False, profile_ranges=False, report_path=None, **kwargs):
+        instrumentation = Instrumentation(
+            device=self.device,
+            synchronize=instrument,
+            track_memory=instrument,
+            profile_ranges=profile_ranges,
+            max_depth=None if instrument or profile_ranges else 1,
+        )
+
+        def finish():
+            for line in instrumentation.summary():
+                logger.info(line)
+            self.last_report = instrumentation.report()
+            if report_path:
+                instrumentation.to_json(report_path)
+
+        try:
+            with activate(instrumentation):
+                result = func(self, *args, **kwargs)
+        except BaseException:
+            finish()
+            raise
+        if inspect.isgenerator(result):
+            return _reported_generator(result, instrumentation, finish)
+        finish()
+        return result
+
+    return wrapper
+
+
+def _reported_generator(generator, instrumentation, finish):
+    # the generator's body runs on each next(), under the instrumentation of the call that returned it
+    try:
+        while True:
+            with activate(instrumentation):
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        generator.close()
+        finish()
@@ -0,0 +1,122 @@
+import re
+import hashlib
+
+from loguru import logger
+
+from ace_step.language_segmentation import LangSegment
+from ace_step.ace_models.lyrics_utils.lyric_tokenizer import VoiceBpeTokenizer
+from ace_step.cache_utils import LRUCache
+
+
+SUPPORT_LANGUAGES = {
+    "en": 259, "de": 260, "fr": 262, "es": 284, "it": 285,
+    "pt": 286, "pl": 294, "tr": 295, "ru": 267, "cs": 293,
+    "nl": 297, "ar": 5022, "zh": 5023, "ja": 5412, "hu": 5753,
+    "ko": 6152, "hi": 6680
+}
+
+structure_pattern = re.compile(r"\[.*?\]")
+
+
+class LyricProcessor:
+    """
+    Lyrics front-end of the pipeline: per-line language detection and BPE tokenization.
+
+    Songs repeat choruses and the same lyrics are re-run with new seeds, so results are memoized per line, keyed by
+    (line, detected lang), and per whole lyrics string. Both caches are bounded by entry count.
+    """
+
+    def __init__(self, line_cache_size=4096, lyrics_cache_size=64):
+        lang_segment = LangSegment()
+
+        lang_segment.setfilters([
+            'af', 'am', 'an', 'ar', 'as', 'az', 'be', 'bg', 'bn', 'br', 'bs', 'ca', 'cs', 'cy', 'da', 'de', 'dz', 'el',
+            'en', 'eo', 'es', 'et', 'eu', 'fa', 'fi', 'fo', 'fr', 'ga', 'gl', 'gu', 'he', 'hi', 'hr', 'ht', 'hu', 'hy',
+            'id', 'is', 'it', 'ja', 'jv', 'ka', 'kk', 'km', 'kn', 'ko', 'ku', 'ky', 'la', 'lb', 'lo', 'lt', 'lv', 'mg',
+            'mk', 'ml', 'mn', 'mr', 'ms', 'mt', 'nb', 'ne', 'nl', 'nn', 'no', 'oc', 'or', 'pa', 'pl', 'ps', 'pt', 'qu',
+            'ro', 'ru', 'rw', 'se', 'si', 'sk', 'sl', 'sq', 'sr', 'sv', 'sw', 'ta', 'te', 'th', 'tl', 'tr', 'ug', 'uk',
+            'ur', 'vi', 'vo', 'wa', 'xh', 'zh', 'zu'
+        ])
+        self.lang_segment = lang_segment
+        self.lyric_tokenizer = VoiceBpeTokenizer()
+
+        self.lang_cache = LRUCache(max_entries=line_cache_size)
+        self.line_cache = LRUCache(max_entries=line_cache_size)
+        self.lyrics_cache = LRUCache(max_entries=lyrics_cache_size)
+
+    def get_lang(self, text):
+        language = "en"
+        try:
+            _ = self.lang_segment.getTexts(text)
+            langCounts = self.lang_segment.getCounts()
+            language = langCounts[0][0]
+            if len(langCounts) > 1 and language == "en":
+                language = langCounts[1][0]
+        except Exception as err:
+            language = "en"
+        return language
+
+    def get_line_lang(self, line):
+        lang = self.lang_cache.get(line)
+        if lang is None:
+            lang = self.get_lang(line)
+
+            if lang not in SUPPORT_LANGUAGES:
+                lang = "en"
+            if "zh" in lang:
+                lang = "zh"
+            if "spa" in lang:
+                lang = "es"
+            self.lang_cache.put(line, lang)
+        return lang
+
+    def tokenize_line(self, line, lang):
+        key = (line, lang)
+        token_idx = self.line_cache.get(key)
+        if token_idx is None:
+            if structure_pattern.match(line):
+                token_idx = self.lyric_tokenizer.encode(line, "en")
+            else:
+                token_idx = self.lyric_tokenizer.encode(line, lang)
+            self.line_cache.put(key, token_idx)
+        return token_idx
+
+    def tokenize_lyrics(self, lyrics, debug=False):
+        # debug logs every line, so it always takes the slow path
+        lyrics_key = hashlib.sha256(lyrics.encode("utf-8")).hexdigest()
+        if not debug:
+            cached = self.lyrics_cache.get(lyrics_key)
+            if cached is not None:
+                return list(cached)
+
+        lines = lyrics.split("\n")
+        lyric_token_idx = [261]
+        has_error = False
+        for line in lines:
+            line = line.strip()
+            if not line:
+                lyric_token_idx += [2]
+                continue
+
+            lang = self.get_line_lang(line)
+
+            try:
+                token_idx = self.tokenize_line(line, lang)
+                if debug:
+                    toks = self.lyric_tokenizer.batch_decode(
+                        [[tok_id] for tok_id in token_idx]
+                    )
+                    logger.info(f"debbug {line} --> {lang} --> {toks}")
+                lyric_token_idx = lyric_token_idx + token_idx + [2]
+            except Exception as e:
+                has_error = True
+                print("tokenize error", e, "for line", line, "major_language", lang)
+
+        if not has_error:
+            self.lyrics_cache.put(lyrics_key, list(lyric_token_idx))
+        return lyric_token_idx
+
+    def clear_cache(self):
+        self.lang_cache.clear()
+        self.line_cache.clear()
+        self.lyrics_cache.clear()
@@ -7,6 +7,7 @@ Apache 2.0 License
 """
 
 import os
+import math
 import torch
 from diffusers import AutoencoderDC
 import torchaudio
@@ -18,8 +19,10 @@ from tqdm import tqdm
 
 try:
     from ace_step.music_dcae.music_vocoder import ADaMoSHiFiGANV1
+    from ace_step.instrumentation import stage
 except ImportError:
     from .music_vocoder import ADaMoSHiFiGANV1
+    from ..instrumentation import stage
 
 
 root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -27,6 +30,62 @@ DEFAULT_PRETRAINED_PATH = os.path.join(root_dir, "checkpoints", "music_dcae_f8c8
 VOCODER_PRETRAINED_PATH = os.path.join(root_dir, "checkpoints", "music_vocoder")
 
 
+class StreamingResampler:
+    """
+    Block-wise `torchaudio.transforms.Resample` that matches resampling the whole signal at once.
+
+    Input is consumed in units of `orig_freq / gcd` samples, which map to whole `new_freq / gcd` output samples, and
+    every block is resampled with enough left / right input context to cover the sinc kernel. Output that still
+    depends on unseen input is held back until the next `push` or the final `flush`.
+    """
+
+    def __init__(self, orig_freq, new_freq, device=None):
+        gcd = math.gcd(orig_freq, new_freq)
+        self.in_unit = orig_freq // gcd
+        self.out_unit = new_freq // gcd
+        self.orig_freq = orig_freq
+        self.new_freq = new_freq
+        self.resampler = torchaudio.transforms.Resample(orig_freq, new_freq).to(device)
+        width = getattr(self.resampler, "width", 16)
+        self.context = self.in_unit * (math.ceil((width + self.in_unit) / self.in_unit) + 1)
+        self.buffer = None # (C, N) input samples from buffer_start on
+        self.buffer_start = 0
+        self.emitted = 0 # input samples whose output has been returned, multiple of in_unit
+
+    def _resample(self, end, final):
+        # resample input [emitted, end) with its context and return the matching output samples
+        start = max(0, self.emitted - self.context)
+        segment_end = end if final else end + self.context
+        segment = self.buffer[:, start - self.buffer_start:segment_end - self.buffer_start]
+        out = self.resampler(segment.float())
+        out_start = (self.emitted - start) // self.in_unit * self.out_unit
+        if final:
+            out = out[:, out_start:]
+        else:
+            out = out[:, out_start:out_start + (end - self.emitted) // self.in_unit * self.out_unit]
+        self.emitted = end
+        keep_from = max(0, self.emitted - self.context)
+        self.buffer = self.buffer[:, keep_from - self.buffer_start:]
+        self.buffer_start = keep_from
+        return out
+
+    def push(self, block):
+        self.buffer = block if self.buffer is None else torch.cat([self.buffer, block], dim=1)
+        available_end = self.buffer_start + self.buffer.shape[1]
+        end = (available_end - self.context) // self.in_unit * self.in_unit
+        if end <= self.emitted:
+            return block.new_zeros((block.shape[0], 0), dtype=torch.float32)
+        return self._resample(end, final=False)
+
+    def flush(self):
+        if self.buffer is None:
+            return torch.zeros((1, 0))
+        available_end = self.buffer_start + self.buffer.shape[1]
+        if available_end <= self.emitted:
+            return self.buffer.new_zeros((self.buffer.shape[0], 0), dtype=torch.float32)
+        return self._resample(available_end, final=True)
+
+
 class MusicDCAE(ModelMixin, ConfigMixin, FromOriginalModelMixin):
     @register_to_config
     def __init__(
@@ -58,9 +117,15 @@ class MusicDCAE(ModelMixin, ConfigMixin, FromOriginalModelMixin):
         self.latent_chunk_size = self.mel_chunk_size // self.time_dimention_multiple
         self.scale_factor = 0.1786
         self.shift_factor = -1.9091
+        # bytes of activations the batched vocoder decode may use, None decodes channel by channel
+        self.vocoder_memory_budget = None
 
     def load_audio(self, audio_path):
-        audio, sr = torchaudio.load(audio_path)
+        # audio_path is either a file path or an in-memory (waveform [C, T], sample_rate) pair
+        if isinstance(audio_path, (tuple, list)):
+            audio, sr = audio_path
+        else:
+            audio, sr = torchaudio.load(audio_path)
         if audio.shape[0] == 1:
             audio = audio.repeat(2, 1)
         return audio, sr
@@ -111,28 +176,56 @@ class MusicDCAE(ModelMixin, ConfigMixin, FromOriginalModelMixin):
         latents = (latents - self.shift_factor) * self.scale_factor
         return latents, latent_lengths
 
+    def vocoder_bytes_per_frame(self, dtype):
+        """Rough peak activation bytes of one vocoder row (one channel of one item) per mel frame."""
+        config = self.vocoder.config
+        length, peak = 1, 0
+        for i, rate in enumerate(config.upsample_rates):
+            length *= rate
+            peak = max(peak, length * (config.upsample_initial_channel // 2 ** (i + 1)))
+        # upsampled activation, the running resblock sum and the resblock intermediates
+        return 4 * peak * torch.tensor([], dtype=dtype).element_size()
+
     @torch.no_grad()
-    def decode(self, latents, audio_lengths=None, sr=None):
+    def vocoder_decode_batched(self, mels, memory_budget):
+        # mels: N x n_mels x T, one row per (item, channel)
+        bytes_per_row = self.vocoder_bytes_per_frame(mels.dtype) * mels.shape[-1]
+        chunk_size = max(1, int(memory_budget // bytes_per_row))
+        with stage("vocoder"):
+            wavs = [self.vocoder.decode(chunk).squeeze(1) for chunk in mels.split(chunk_size)]
+            return torch.cat(wavs, dim=0)
+
+    @torch.no_grad()
+    def decode(self, latents, audio_lengths=None, sr=None, vocoder_memory_budget=None):
+        if vocoder_memory_budget is None:
+            vocoder_memory_budget = self.vocoder_memory_budget
+
         latents = latents / self.scale_factor + self.shift_factor
 
+        if vocoder_memory_budget:
+            return self._decode_batched(latents, audio_lengths, sr, vocoder_memory_budget)
+
         pred_wavs = []
 
         for latent in latents:
-            mels = self.dcae.decoder(latent.unsqueeze(0))
-            mels = mels * 0.5 + 0.5
-            mels = mels * (self.max_mel_value - self.min_mel_value) + self.min_mel_value
+            with stage("dcae_decode"):
+                mels = self.dcae.decoder(latent.unsqueeze(0))
+                mels = mels * 0.5 + 0.5
+                mels = mels * (self.max_mel_value - self.min_mel_value) + self.min_mel_value
 
             # wav = self.vocoder.decode(mels[0]).squeeze(1)
             # decode waveform for each channels to reduce vram footprint
-            wav_ch1 = self.vocoder.decode(mels[:,0,:,:]).squeeze(1).cpu()
-            wav_ch2 = self.vocoder.decode(mels[:,1,:,:]).squeeze(1).cpu()
-            wav = torch.cat([wav_ch1, wav_ch2],dim=0)
+            with stage("vocoder"):
+                wav_ch1 = self.vocoder.decode(mels[:,0,:,:]).squeeze(1).cpu()
+                wav_ch2 = self.vocoder.decode(mels[:,1,:,:]).squeeze(1).cpu()
+                wav = torch.cat([wav_ch1, wav_ch2],dim=0)
 
             if sr is not None:
-                resampler = (
-                    torchaudio.transforms.Resample(44100, sr)
-                )
-                wav = resampler(wav.cpu().float())
+                with stage("resampling"):
+                    resampler = (
+                        torchaudio.transforms.Resample(44100, sr)
+                    )
+                    wav = resampler(wav.cpu().float())
             else:
                 sr = 44100
             pred_wavs.append(wav)
@@ -143,19 +236,40 @@ class MusicDCAE(ModelMixin, ConfigMixin, FromOriginalModelMixin):
             ]
         return sr, pred_wavs
 
-    @torch.no_grad()
-    def decode_overlap(self, latents, audio_lengths=None, sr=None):
+    def _decode_batched(self, latents, audio_lengths, sr, vocoder_memory_budget):
+        # all items and both channels go through the vocoder together, in chunks bounded by the memory budget
+        mels = []
+        with stage("dcae_decode"):
+            for latent in latents:
+                mel = self.dcae.decoder(latent.unsqueeze(0))
+                mel = mel * 0.5 + 0.5
+                mel = mel * (self.max_mel_value - self.min_mel_value) + self.min_mel_value
+                mels.append(mel)
+            mels = torch.cat(mels, dim=0)
+        bsz, num_channels = mels.shape[:2]
+
+        wavs = self.vocoder_decode_batched(mels.flatten(0, 1), vocoder_memory_budget)
+        wavs = wavs.view(bsz, num_channels, -1)
+
+        if sr is not None:
+            with stage("resampling"):
+                resampler = torchaudio.transforms.Resample(44100, sr).to(wavs.device)
+                wavs = resampler(wavs.float())
+        else:
+            sr = 44100
+
+        # single device to host copy
+        wavs = wavs.cpu()
+        pred_wavs = list(wavs)
+        if audio_lengths is not None:
+            pred_wavs = [wav[:, :length] for wav, length in zip(pred_wavs, audio_lengths)]
+        return sr, pred_wavs
+
+    def _overlap_dcae_mels(self, current_latent):
         """
-        Decodes latents into waveforms using an overlapped DCAE and Vocoder.
+        Overlapped DCAE: yields denormalized mel segments (1, C, H_mel, W) in order, trimmed so they concatenate.
         """
-        print("Using Overlapped DCAE and Vocoder")
-
-        MODEL_INTERNAL_SR = 44100
         DCAE_LATENT_TO_MEL_STRIDE = 8
-        VOCODER_AUDIO_SAMPLES_PER_MEL_FRAME = 512
-
-        pred_wavs = []
-        final_output_sr = sr if sr is not None else MODEL_INTERNAL_SR
 
         # --- DCAE Parameters ---
         # dcae_win_len_latent: Window length in the latent domain for DCAE processing
@@ -169,6 +283,63 @@ class MusicDCAE(ModelMixin, ConfigMixin, FromOriginalModelMixin):
         # dcae_mel_overlap_len: Overlap length in the mel domain to be trimmed/blended
         dcae_mel_overlap_len = dcae_mel_win_len // 4
 
+        latent_len = current_latent.shape[3]
+        if latent_len == 0:
+            return # No mel segments to generate
+
+        # Determine anchor points for DCAE windows
+        # An anchor marks a reference point for a window slice.
+        # Window slice: current_latent[..., anchor - offset : anchor - offset + win_len]
+        # First anchor ensures window starts at 0. Last anchor ensures tail is covered.
+        dcae_anchors = list(range(dcae_anchor_offset, latent_len - dcae_anchor_offset, dcae_anchor_hop))
+        if not dcae_anchors: # If latent is too short for the range, use one anchor
+            dcae_anchors = [dcae_anchor_offset]
+
+        for i, anchor in enumerate(dcae_anchors):
+            win_start_idx = max(0, anchor - dcae_anchor_offset)
+            win_end_idx = min(latent_len, win_start_idx + dcae_win_len_latent)
+
+            dcae_input_segment = current_latent[:, :, :, win_start_idx:win_end_idx]
+            if dcae_input_segment.shape[3] == 0: continue
+
+            with stage("dcae_decode"):
+                mel_output_full = self.dcae.decoder(dcae_input_segment) # (1, C, H_mel, W_mel_fixed_from_dcae)
+
+            is_first = (i == 0)
+            is_last = (i == len(dcae_anchors) - 1)
+
+            if is_first and is_last: # Only one segment
+                # Use mel corresponding to actual input latent length
+                true_mel_content_len = dcae_input_segment.shape[3] * DCAE_LATENT_TO_MEL_STRIDE
+                mel_to_keep = mel_output_full[:, :, :, :min(true_mel_content_len, mel_output_full.shape[3])]
+            elif is_first: # First segment, trim end overlap
+                mel_to_keep = mel_output_full[:, :, :, :-dcae_mel_overlap_len]
+            elif is_last: # Last segment, trim start overlap
+                # And ensure we only take content relevant to the (potentially partial) last latent window
+                # The mel_output_full is fixed length. The useful part starts after overlap.
+                # The length of the useful part depends on how much of dcae_input_segment was actual content.
+                # For simplicity in overlap-add, typically trim fixed overlap.
+                # If dcae_input_segment was shorter than dcae_win_len_latent, mel_output_full might contain padding effects.
+                # Standard OLA keeps the corresponding tail.
+                mel_to_keep = mel_output_full[:, :, :, dcae_mel_overlap_len:]
+            else: # Middle segment, trim both overlaps
+                mel_to_keep = mel_output_full[:, :, :, dcae_mel_overlap_len:-dcae_mel_overlap_len]
+
+            if mel_to_keep.shape[3] > 0:
+                # Denormalize mels
+                mel_to_keep = mel_to_keep * 0.5 + 0.5
+                mel_to_keep = mel_to_keep * (self.max_mel_value - self.min_mel_value) + self.min_mel_value
+                yield mel_to_keep
+
+    def _overlap_native_blocks(self, latent_item):
+        """
+        Overlapped DCAE + vocoder for one latent, yields finished (C_audio, Samples) blocks at the native 44.1kHz.
+
+        Mel segments are pulled from the DCAE only when the next vocoder window needs them, and everything except
+        the crossfade tail is yielded as soon as a vocoder window is blended in.
+        """
+        VOCODER_AUDIO_SAMPLES_PER_MEL_FRAME = 512
+
         # --- Vocoder Parameters ---
         # vocoder_win_len_audio: Audio samples per vocoder processing window
         vocoder_win_len_audio = 512 * 512 # Example: 262144 samples
@@ -183,175 +354,185 @@ class MusicDCAE(ModelMixin, ConfigMixin, FromOriginalModelMixin):
         cf_win_tail = torch.linspace(1, 0, crossfade_len_audio, device=self.device).unsqueeze(0).unsqueeze(0)
         cf_win_head = torch.linspace(0, 1, crossfade_len_audio, device=self.device).unsqueeze(0).unsqueeze(0)
 
-        for latent_idx, latent_item in enumerate(latents):
-            latent_item = latent_item.to(self.device)
-            current_latent = (latent_item / self.scale_factor + self.shift_factor).unsqueeze(0) # (1, C, H, W_latent)
-            latent_len = current_latent.shape[3]
-
-            # 1. DCAE: Latent to Mel Spectrogram (Overlapped)
-            mels_segments = []
-            if latent_len == 0:
-                pass # No mel segments to generate
-            else:
-                # Determine anchor points for DCAE windows
-                # An anchor marks a reference point for a window slice.
-                # Window slice: current_latent[..., anchor - offset : anchor - offset + win_len]
-                # First anchor ensures window starts at 0. Last anchor ensures tail is covered.
-                dcae_anchors = list(range(dcae_anchor_offset, latent_len - dcae_anchor_offset, dcae_anchor_hop))
-                if not dcae_anchors: # If latent is too short for the range, use one anchor
-                    dcae_anchors = [dcae_anchor_offset]
+        latent_item = latent_item.to(self.device)
+        current_latent = (latent_item / self.scale_factor + self.shift_factor).unsqueeze(0) # (1, C, H, W_latent)
+
+        # 1. DCAE: Latent to Mel Spectrogram (Overlapped), decoded lazily
+        mel_segments = self._overlap_dcae_mels(current_latent)
+        mels = None # mel frames from mel_offset on, earlier frames are never read again
+        mel_offset = 0
+        mels_done = False
+
+        def ensure_mel_frames(end):
+            # decode DCAE windows until mel frames [.., end) are available or the latent is exhausted
+            nonlocal mels, mels_done
+            while not mels_done and (mels is None or mel_offset + mels.shape[3] < end):
+                segment = next(mel_segments, None)
+                if segment is None:
+                    mels_done = True
+                else:
+                    mels = segment if mels is None else torch.cat([mels, segment], dim=3)
+            return mel_offset + (mels.shape[3] if mels is not None else 0)
+
+        def mel_block_at(start, end):
+            nonlocal mels, mel_offset
+            mels = mels[:, :, :, start - mel_offset:]
+            mel_offset = start
+            return mels[0, :, :, :end - start].to(self.device)
+
+        # 2. Vocoder: Mel Spectrogram to Waveform (Overlapped)
+        mel_available = ensure_mel_frames(vocoder_input_mel_frames_per_block)
+        if mel_available == 0:
+            return
+
+        # Initial vocoder window
+        # Vocoder expects (C_mel, H_mel, W_mel_block)
+        mel_block = mel_block_at(0, min(vocoder_input_mel_frames_per_block, mel_available))
+        
+        # Pad mel_block if it's shorter than vocoder_input_mel_frames_per_block (e.g. very short audio)
+        if 0 < mel_block.shape[2] < vocoder_input_mel_frames_per_block:
+            pad_len = vocoder_input_mel_frames_per_block - mel_block.shape[2]
+            mel_block = torch.nn.functional.pad(mel_block, (0, pad_len), mode='constant', value=0) # Pad last dim
+        
+        with stage("vocoder"):
+            current_audio_output = self.vocoder.decode(mel_block) # (C_audio, 1, Samples)
+        current_audio_output = current_audio_output[:, :, :-vocoder_overlap_len_audio] # Remove end overlap
+
+        # p_audio_samples tracks the start of the *next* audio segment to generate (in conceptual total audio samples)
+        p_audio_samples = vocoder_hop_len_audio 
+
+        while True:
+            mel_frame_start = p_audio_samples // VOCODER_AUDIO_SAMPLES_PER_MEL_FRAME
+            mel_frame_end = mel_frame_start + vocoder_input_mel_frames_per_block
+            # once the window is available, the song is known to go on past this hop
+            mel_available = ensure_mel_frames(mel_frame_end)
+
+            if mel_frame_start >= mel_available: break # No more mel frames
+
+            # only the crossfade tail of what is decoded so far can still change
+            if current_audio_output.shape[2] > crossfade_len_audio:
+                yield current_audio_output[:, :, :-crossfade_len_audio].squeeze(1)
+                current_audio_output = current_audio_output[:, :, -crossfade_len_audio:]
+
+            mel_block = mel_block_at(mel_frame_start, min(mel_frame_end, mel_available))
+
+            # Pad if current mel_block is too short (end of sequence)
+            if mel_block.shape[2] < vocoder_input_mel_frames_per_block:
+                pad_len = vocoder_input_mel_frames_per_block - mel_block.shape[2]
+                mel_block = torch.nn.functional.pad(mel_block, (0, pad_len), mode='constant', value=0)
+
+            with stage("vocoder"):
+                new_audio_win = self.vocoder.decode(mel_block) # (C_audio, 1, Samples)
+
+            # Crossfade
+            # Determine actual crossfade length based on available audio
+            actual_cf_len = min(crossfade_len_audio, current_audio_output.shape[2], new_audio_win.shape[2] - (vocoder_overlap_len_audio - crossfade_len_audio))
+            if actual_cf_len > 0: # Ensure valid slice lengths for crossfade
+                tail_part = current_audio_output[:, :, -actual_cf_len:]
+                head_part = new_audio_win[:, :, vocoder_overlap_len_audio - actual_cf_len : vocoder_overlap_len_audio]
                 
-                for i, anchor in enumerate(dcae_anchors):
-                    win_start_idx = max(0, anchor - dcae_anchor_offset)
-                    win_end_idx = min(latent_len, win_start_idx + dcae_win_len_latent)
-                    
-                    dcae_input_segment = current_latent[:, :, :, win_start_idx:win_end_idx]
-                    if dcae_input_segment.shape[3] == 0: continue
-
-                    mel_output_full = self.dcae.decoder(dcae_input_segment) # (1, C, H_mel, W_mel_fixed_from_dcae)
-
-                    is_first = (i == 0)
-                    is_last = (i == len(dcae_anchors) - 1)
-
-                    if is_first and is_last: # Only one segment
-                        # Use mel corresponding to actual input latent length
-                        true_mel_content_len = dcae_input_segment.shape[3] * DCAE_LATENT_TO_MEL_STRIDE
-                        mel_to_keep = mel_output_full[:, :, :, :min(true_mel_content_len, mel_output_full.shape[3])]
-                    elif is_first: # First segment, trim end overlap
-                        mel_to_keep = mel_output_full[:, :, :, :-dcae_mel_overlap_len]
-                    elif is_last: # Last segment, trim start overlap
-                        # And ensure we only take content relevant to the (potentially partial) last latent window
-                        # The mel_output_full is fixed length. The useful part starts after overlap.
-                        # The length of the useful part depends on how much of dcae_input_segment was actual content.
-                        # For simplicity in overlap-add, typically trim fixed overlap.
-                        # If dcae_input_segment was shorter than dcae_win_len_latent, mel_output_full might contain padding effects.
-                        # Standard OLA keeps the corresponding tail.
-                        mel_to_keep = mel_output_full[:, :, :, dcae_mel_overlap_len:]
-                    else: # Middle segment, trim both overlaps
-                        mel_to_keep = mel_output_full[:, :, :, dcae_mel_overlap_len:-dcae_mel_overlap_len]
-                    
-                    if mel_to_keep.shape[3] > 0:
-                        mels_segments.append(mel_to_keep)
-            
-            if not mels_segments:
-                num_mel_channels = current_latent.shape[1]
-                mel_height = self.dcae.decoder_output_mel_height
-                concatenated_mels = torch.empty(
-                    (1, num_mel_channels, mel_height, 0),
-                    device=current_latent.device, dtype=current_latent.dtype
-                )
-            else:
-                concatenated_mels = torch.cat(mels_segments, dim=3)
+                crossfaded_segment = tail_part * cf_win_tail[:,:,:actual_cf_len] + \
+                                     head_part * cf_win_head[:,:,:actual_cf_len]
+                
+                current_audio_output = torch.cat([current_audio_output[:, :, :-actual_cf_len], crossfaded_segment], dim=2)
 
-            # Denormalize mels
-            concatenated_mels = concatenated_mels * 0.5 + 0.5
-            concatenated_mels = concatenated_mels * (self.max_mel_value - self.min_mel_value) + self.min_mel_value
+            # Append non-overlapping part of new_audio_win
+            is_final_append = mels_done and (
+                p_audio_samples + vocoder_hop_len_audio >= mel_available * VOCODER_AUDIO_SAMPLES_PER_MEL_FRAME
+            )
+            if is_final_append:
+                segment_to_append = new_audio_win[:, :, vocoder_overlap_len_audio:]
+            else:
+                segment_to_append = new_audio_win[:, :, vocoder_overlap_len_audio:-vocoder_overlap_len_audio]
+            
+            current_audio_output = torch.cat([current_audio_output, segment_to_append], dim=2)
             
-            mel_total_frames = concatenated_mels.shape[3]
+            p_audio_samples += vocoder_hop_len_audio
+
+        yield current_audio_output.squeeze(1)
+
+    def _overlap_target_length(self, latent_item, idx, audio_lengths, sr):
+        # expected length of the original latent at the FINAL output sample rate
+        MODEL_INTERNAL_SR = 44100
+        _num_mel_frames = latent_item.shape[-1] * 8
+        _conceptual_native_audio_len = _num_mel_frames * 512
+        max_possible_len = int(_conceptual_native_audio_len * sr / MODEL_INTERNAL_SR)
+        if audio_lengths is not None:
+            # User-provided length is the primary target, capped by max possible
+            return min(audio_lengths[idx], max_possible_len)
+        return max_possible_len
 
-            # 2. Vocoder: Mel Spectrogram to Waveform (Overlapped)
-            if mel_total_frames == 0:
+    @torch.no_grad()
+    def decode_overlap(self, latents, audio_lengths=None, sr=None):
+        """
+        Decodes latents into waveforms using an overlapped DCAE and Vocoder.
+        """
+        print("Using Overlapped DCAE and Vocoder")
+
+        MODEL_INTERNAL_SR = 44100
+
+        pred_wavs = []
+        final_output_sr = sr if sr is not None else MODEL_INTERNAL_SR
+
+        for latent_idx, latent_item in enumerate(latents):
+            blocks = list(self._overlap_native_blocks(latent_item))
+            if not blocks:
                 # Assuming mono or stereo output based on mel channels (typically mono for vocoder from single mel)
                 num_audio_channels = 1 # Or determine from vocoder capabilities / mel channels
                 final_wav = torch.zeros((num_audio_channels, 0), device=self.device, dtype=torch.float32)
             else:
-                # Initial vocoder window
-                # Vocoder expects (C_mel, H_mel, W_mel_block)
-                mel_block = concatenated_mels[0, :, :, :vocoder_input_mel_frames_per_block].to(self.device)
-                
-                # Pad mel_block if it's shorter than vocoder_input_mel_frames_per_block (e.g. very short audio)
-                if 0 < mel_block.shape[2] < vocoder_input_mel_frames_per_block:
-                    pad_len = vocoder_input_mel_frames_per_block - mel_block.shape[2]
-                    mel_block = torch.nn.functional.pad(mel_block, (0, pad_len), mode='constant', value=0) # Pad last dim
-                
-                current_audio_output = self.vocoder.decode(mel_block) # (C_audio, 1, Samples)
-                current_audio_output = current_audio_output[:, :, :-vocoder_overlap_len_audio] # Remove end overlap
-
-                # p_audio_samples tracks the start of the *next* audio segment to generate (in conceptual total audio samples)
-                p_audio_samples = vocoder_hop_len_audio 
-                conceptual_total_audio_len_native_sr = mel_total_frames * VOCODER_AUDIO_SAMPLES_PER_MEL_FRAME
-                
-                pbar_total = 1 + max(0, (conceptual_total_audio_len_native_sr - (vocoder_win_len_audio - vocoder_overlap_len_audio))) // vocoder_hop_len_audio
-                
-                # Use tqdm if you want a progress bar for the vocoder part
-                # with tqdm(total=pbar_total, desc=f"Vocoder {latent_idx+1}/{len(latents)}", leave=False) as pbar:
-                # pbar.update(1) # For initial window
-                # The loop for subsequent windows
-                while p_audio_samples < conceptual_total_audio_len_native_sr:
-                    mel_frame_start = p_audio_samples // VOCODER_AUDIO_SAMPLES_PER_MEL_FRAME
-                    mel_frame_end = mel_frame_start + vocoder_input_mel_frames_per_block
-                    
-                    if mel_frame_start >= mel_total_frames: break # No more mel frames
-
-                    mel_block = concatenated_mels[0, :, :, mel_frame_start:min(mel_frame_end, mel_total_frames)].to(self.device)
-                    
-                    if mel_block.shape[2] == 0: break # Should not happen if mel_frame_start is valid
-
-                    # Pad if current mel_block is too short (end of sequence)
-                    if mel_block.shape[2] < vocoder_input_mel_frames_per_block:
-                        pad_len = vocoder_input_mel_frames_per_block - mel_block.shape[2]
-                        mel_block = torch.nn.functional.pad(mel_block, (0, pad_len), mode='constant', value=0)
-
-                    new_audio_win = self.vocoder.decode(mel_block) # (C_audio, 1, Samples)
-
-                    # Crossfade
-                    # Determine actual crossfade length based on available audio
-                    actual_cf_len = min(crossfade_len_audio, current_audio_output.shape[2], new_audio_win.shape[2] - (vocoder_overlap_len_audio - crossfade_len_audio))
-                    if actual_cf_len > 0: # Ensure valid slice lengths for crossfade
-                        tail_part = current_audio_output[:, :, -actual_cf_len:]
-                        head_part = new_audio_win[:, :, vocoder_overlap_len_audio - actual_cf_len : vocoder_overlap_len_audio]
-                        
-                        crossfaded_segment = tail_part * cf_win_tail[:,:,:actual_cf_len] + \
-                                             head_part * cf_win_head[:,:,:actual_cf_len]
-                        
-                        current_audio_output = torch.cat([current_audio_output[:, :, :-actual_cf_len], crossfaded_segment], dim=2)
-
-                    # Append non-overlapping part of new_audio_win
-                    is_final_append = (p_audio_samples + vocoder_hop_len_audio >= conceptual_total_audio_len_native_sr)
-                    if is_final_append:
-                        segment_to_append = new_audio_win[:, :, vocoder_overlap_len_audio:]
-                    else:
-                        segment_to_append = new_audio_win[:, :, vocoder_overlap_len_audio:-vocoder_overlap_len_audio]
-                    
-                    current_audio_output = torch.cat([current_audio_output, segment_to_append], dim=2)
-                    
-                    p_audio_samples += vocoder_hop_len_audio
-                    # pbar.update(1) # if using tqdm
-                
-                final_wav = current_audio_output.squeeze(1) # (C_audio, Samples)
+                final_wav = torch.cat(blocks, dim=1) # (C_audio, Samples)
 
             # 3. Resampling (if necessary)
             if final_output_sr != MODEL_INTERNAL_SR and final_wav.numel() > 0:
                 # Resample expects CPU tensor if using torchaudio.transforms on older versions or for some backends
-                resampler = torchaudio.transforms.Resample(
-                    MODEL_INTERNAL_SR, final_output_sr, dtype=final_wav.dtype
-                )
-                final_wav = resampler(final_wav.cpu()).to(self.device) # Move back to device if needed later
+                with stage("resampling"):
+                    resampler = torchaudio.transforms.Resample(
+                        MODEL_INTERNAL_SR, final_output_sr, dtype=final_wav.dtype
+                    )
+                    final_wav = resampler(final_wav.cpu()).to(self.device) # Move back to device if needed later
             
             pred_wavs.append(final_wav)
 
         # 4. Final Truncation
         processed_pred_wavs = []
         for i, wav in enumerate(pred_wavs):
-            # Calculate expected length based on original latent, at the FINAL output sample rate
-            _num_latent_frames = latents[i].shape[-1] # Use original latent item for shape
-            _num_mel_frames = _num_latent_frames * DCAE_LATENT_TO_MEL_STRIDE
-            _conceptual_native_audio_len = _num_mel_frames * VOCODER_AUDIO_SAMPLES_PER_MEL_FRAME
-            max_possible_len = int(_conceptual_native_audio_len * final_output_sr / MODEL_INTERNAL_SR)
-
-            current_wav_len = wav.shape[1]
-            
-            if audio_lengths is not None:
-                # User-provided length is the primary target, capped by actual and max possible
-                target_len = min(audio_lengths[i], current_wav_len, max_possible_len)
-            else:
-                # No user length, use max possible capped by actual
-                target_len = min(max_possible_len, current_wav_len)
-            
+            target_len = min(self._overlap_target_length(latents[i], i, audio_lengths, final_output_sr), wav.shape[1])
             processed_pred_wavs.append(wav[:, :max(0, target_len)].cpu()) # Ensure length is non-negative
 
         return final_output_sr, processed_pred_wavs
 
+    @torch.no_grad()
+    def decode_overlap_stream(self, latents, audio_lengths=None, sr=None):
+        """
+        Streaming variant of `decode_overlap`: yields `(item_index, wav_block)` with finished, crossfaded
+        (C_audio, Samples) CPU blocks at `sr` as each vocoder window completes. Concatenating the blocks of an item
+        gives its full waveform.
+        """
+        MODEL_INTERNAL_SR = 44100
+        final_output_sr = sr if sr is not None else MODEL_INTERNAL_SR
+
+        for latent_idx, latent_item in enumerate(latents):
+            target_len = self._overlap_target_length(latent_item, latent_idx, audio_lengths, final_output_sr)
+            resampler = None
+            if final_output_sr != MODEL_INTERNAL_SR:
+                resampler = StreamingResampler(MODEL_INTERNAL_SR, final_output_sr, device=self.device)
+
+            emitted = 0
+            for block in self._overlap_native_blocks(latent_item):
+                if resampler is not None:
+                    with stage("resampling"):
+                        block = resampler.push(block)
+                block = block[:, :max(0, target_len - emitted)]
+                if block.shape[1] > 0:
+                    emitted += block.shape[1]
+                    yield latent_idx, block.float().cpu()
+            if resampler is not None:
+                with stage("resampling"):
+                    block = resampler.flush()[:, :max(0, target_len - emitted)]
+                if block.shape[1] > 0:
+                    yield latent_idx, block.float().cpu()
+
     def forward(self, audios, audio_lengths=None, sr=None):
         latents, latent_lengths = self.encode(
             audios=audios, audio_lengths=audio_lengths, sr=sr
@@ -1,7 +1,8 @@
 import random
-import time
+import contextlib
 import os
 import re
+import time
 import torch
 from loguru import logger
 from tqdm import tqdm
@@ -13,30 +14,39 @@ from diffusers.utils.torch_utils import randn_tensor
 from ace_step.schedulers.scheduling_flow_match_euler_discrete import FlowMatchEulerDiscreteScheduler
 from ace_step.schedulers.scheduling_flow_match_heun_discrete import FlowMatchHeunDiscreteScheduler
 from ace_step.schedulers.scheduling_flow_match_pingpong import FlowMatchPingPongScheduler
-
-from ace_step.language_segmentation import LangSegment
-from ace_step.ace_models.lyrics_utils.lyric_tokenizer import VoiceBpeTokenizer
-from ace_step.apg_guidance import apg_forward, MomentumBuffer, cfg_forward, cfg_zero_star, cfg_double_condition_forward
-from ace_step.cpu_offload import cpu_offload
-
-SUPPORT_LANGUAGES = {
-    "en": 259, "de": 260, "fr": 262, "es": 284, "it": 285, 
-    "pt": 286, "pl": 294, "tr": 295, "ru": 267, "cs": 293, 
-    "nl": 297, "ar": 5022, "zh": 5023, "ja": 5412, "hu": 5753,
-    "ko": 6152, "hi": 6680
-}
-
-structure_pattern = re.compile(r"\[.*?\]")
+from ace_step.schedulers.static_step import StaticSchedulerStep
+
+from ace_step.lyric_processor import LyricProcessor, SUPPORT_LANGUAGES, structure_pattern
+from ace_step.apg_guidance import apg_forward, MomentumBuffer, cfg_forward, cfg_zero_star, cfg_double_condition_forward, AdaptiveGuidanceTruncation
+from ace_step.cpu_offload import cpu_offload, CpuOffloader, ModelResidencyManager, BlockStreamer, residency_scope
+from ace_step.ace_models.customer_attention_processor import CrossAttnKVCache, AttentionTemperature
+from ace_step.ace_models.step_cache import StepCache, StepCacheSchedule
+from ace_step.cache_utils import LatentCache, TextEmbeddingCache
+from ace_step.instrumentation import instrumented, stage
+from ace_step.sampling_plan import SamplingPlan
+from ace_step.shape_buckets import pad_to
 
 # class ACEStepPipeline(DiffusionPipeline):
 class ACEStepPipeline:
 
-    def __init__(self, music_dcae, ace_step, umt5encoder, text_tokenizer, device, dtype, overlapped_decode=False, **kwargs):
+    def __init__(self, music_dcae, ace_step, umt5encoder, text_tokenizer, device, dtype, overlapped_decode=False, cpu_offload=False, latent_cache_size=256, latent_cache_dir=None, latent_disk_cache_size=1024, text_embedding_cache_size=128, vocoder_memory_budget=None, offload_memory_budget=0, block_offload_resident_blocks=None, shape_buckets=None, **kwargs):
         self.dtype = dtype
         self.device = device
 
+        # the pipeline is built once by the model loader and reused across runs,
+        # per-run options such as overlapped_decode can be overridden in __call__
         self.cpu_offload = cpu_offload
         self.overlapped_decode = overlapped_decode
+        # with cpu_offload, models stay on the device for a whole request within offload_memory_budget MB
+        # (0 keeps only the model in use, None keeps all of them)
+        self.residency_manager = None
+        if cpu_offload:
+            self.residency_manager = ModelResidencyManager(
+                device,
+                memory_budget=None if offload_memory_budget is None else offload_memory_budget * 1024**2,
+            )
+        # MB of activations for the batched vocoder decode, None decodes channel by channel (lowest memory)
+        self.vocoder_memory_budget = vocoder_memory_budget
 
         self.music_dcae = music_dcae
         if self.cpu_offload: # might be redundant
@@ -46,24 +56,27 @@ class ACEStepPipeline:
         # self.music_dcae.to(device).eval().to(self.dtype)
 
         self.ace_step_transformer = ace_step
-        if self.cpu_offload:
+        if self.cpu_offload or block_offload_resident_blocks is not None:
             self.ace_step_transformer = self.ace_step_transformer.to("cpu").eval().to(self.dtype)
         else:
             self.ace_step_transformer = self.ace_step_transformer.to(device).eval().to(self.dtype)
         # self.ace_step_transformer.to(device).eval().to(self.dtype)
 
-        lang_segment = LangSegment()
-
-        lang_segment.setfilters([
-            'af', 'am', 'an', 'ar', 'as', 'az', 'be', 'bg', 'bn', 'br', 'bs', 'ca', 'cs', 'cy', 'da', 'de', 'dz', 'el',
-            'en', 'eo', 'es', 'et', 'eu', 'fa', 'fi', 'fo', 'fr', 'ga', 'gl', 'gu', 'he', 'hi', 'hr', 'ht', 'hu', 'hy',
-            'id', 'is', 'it', 'ja', 'jv', 'ka', 'kk', 'km', 'kn', 'ko', 'ku', 'ky', 'la', 'lb', 'lo', 'lt', 'lv', 'mg',
-            'mk', 'ml', 'mn', 'mr', 'ms', 'mt', 'nb', 'ne', 'nl', 'nn', 'no', 'oc', 'or', 'pa', 'pl', 'ps', 'pt', 'qu',
-            'ro', 'ru', 'rw', 'se', 'si', 'sk', 'sl', 'sq', 'sr', 'sv', 'sw', 'ta', 'te', 'th', 'tl', 'tr', 'ug', 'uk',
-            'ur', 'vi', 'vo', 'wa', 'xh', 'zh', 'zu'
-        ])
-        self.lang_segment = lang_segment
-        self.lyric_tokenizer = VoiceBpeTokenizer()
+        # layer-wise offload: only a few transformer / lyric encoder blocks live on the device at a time
+        self.block_streamer = None
+        if block_offload_resident_blocks is not None:
+            self.block_streamer = BlockStreamer(device, resident_blocks=block_offload_resident_blocks).attach(
+                self.ace_step_transformer,
+                [
+                    self.ace_step_transformer.lyric_encoder.encoders,
+                    self.ace_step_transformer.transformer_blocks,
+                ],
+            )
+            self.ace_step_transformer.block_streamer = self.block_streamer
+
+        self.lyric_processor = LyricProcessor()
+        self.lang_segment = self.lyric_processor.lang_segment
+        self.lyric_tokenizer = self.lyric_processor.lyric_tokenizer
         text_encoder_model = umt5encoder
         if self.cpu_offload:
             text_encoder_model = text_encoder_model.to("cpu").eval().to(self.dtype)
@@ -74,19 +87,63 @@ class ACEStepPipeline:
         self.text_encoder_model = text_encoder_model
         self.text_tokenizer = text_tokenizer
 
+        # latents of source / reference audio, in MB (in memory / in latent_cache_dir), 0 disables the cache
+        self.latent_cache = None
+        if latent_cache_size > 0:
+            self.latent_cache = LatentCache(
+                max_bytes=latent_cache_size * 1024**2,
+                disk_dir=latent_cache_dir,
+                disk_max_bytes=latent_disk_cache_size * 1024**2,
+            )
+        # UMT5 prompt embeddings, in MB, 0 disables the cache
+        self.text_embedding_cache = None
+        if text_embedding_cache_size > 0:
+            self.text_embedding_cache = TextEmbeddingCache(max_bytes=text_embedding_cache_size * 1024**2)
+        # computed / skipped steps per guidance branch of the last run with step_cache_threshold > 0
+        self.step_cache_stats = {}
+        # per-stage timings / peak memory of the last call, see ace_step.instrumentation
+        self.last_report = None
+        # ShapeBuckets padding the diffusion inputs to a few fixed shapes for compiled models, None runs them as is
+        self.shape_buckets = shape_buckets
+
     def cleanup(self):
         import gc
         self.music_dcae = None
         self.ace_step_transformer = None
         self.lang_segment = None
         self.lyric_tokenizer = None
+        self.lyric_processor = None
         self.text_encoder_model = None
         self.text_tokenizer = None
+        self.latent_cache = None
+        self.text_embedding_cache = None
         gc.collect()
         torch.cuda.empty_cache()
 
-    @cpu_offload("text_encoder_model")
+    def text_encoder_id(self):
+        config = getattr(self.text_encoder_model, "config", None)
+        return (getattr(config, "_name_or_path", None), id(self.text_encoder_model))
+
     def get_text_embeddings(self, texts, device, text_max_length=256):
+        with stage("text_encoding"):
+            return self._get_text_embeddings(texts, device, text_max_length)
+
+    def _get_text_embeddings(self, texts, device, text_max_length=256):
+        # on a hit the text encoder is neither run nor moved between devices
+        if self.text_embedding_cache is None:
+            return self._encode_text(texts, device, text_max_length)
+        key = self.text_embedding_cache.make_key(
+            texts, text_max_length, model_id=self.text_encoder_id(), dtype=self.dtype
+        )
+        cached = self.text_embedding_cache.get(key)
+        if cached is None:
+            cached = self._encode_text(texts, device, text_max_length)
+            self.text_embedding_cache.put(key, cached)
+        last_hidden_states, attention_mask = cached
+        return last_hidden_states.to(device), attention_mask.to(device)
+
+    @cpu_offload("text_encoder_model")
+    def _encode_text(self, texts, device, text_max_length=256):
         inputs = self.text_tokenizer(
             texts,
             return_tensors="pt",
@@ -103,9 +160,27 @@ class ACEStepPipeline:
         attention_mask = inputs["attention_mask"]
         return last_hidden_states, attention_mask
 
-    @cpu_offload("text_encoder_model")
     def get_text_embeddings_null(
         self, texts, device, text_max_length=256, tau=0.01, l_min=8, l_max=10
+    ):
+        with stage("erg_text_encoding"):
+            return self._get_text_embeddings_null(texts, device, text_max_length, tau, l_min, l_max)
+
+    def _get_text_embeddings_null(self, texts, device, text_max_length, tau, l_min, l_max):
+        if self.text_embedding_cache is None:
+            return self._encode_text_null(texts, device, text_max_length, tau, l_min, l_max)
+        key = self.text_embedding_cache.make_key(
+            texts, text_max_length, tau, l_min, l_max, model_id=self.text_encoder_id(), dtype=self.dtype
+        )
+        last_hidden_states = self.text_embedding_cache.get(key)
+        if last_hidden_states is None:
+            last_hidden_states = self._encode_text_null(texts, device, text_max_length, tau, l_min, l_max)
+            self.text_embedding_cache.put(key, last_hidden_states)
+        return last_hidden_states.to(device)
+
+    @cpu_offload("text_encoder_model")
+    def _encode_text_null(
+        self, texts, device, text_max_length=256, tau=0.01, l_min=8, l_max=10
     ):
         inputs = self.text_tokenizer(
             texts,
@@ -125,7 +200,8 @@ class ACEStepPipeline:
                 output[:] *= tau
                 return output
 
-            for i in range(l_min, l_max):
+            # UMT5 comes from transformers, its attention has no temperature argument, so it keeps the hooks
+            for i in range(l_min, min(l_max, len(self.text_encoder_model.encoder.block))):
                 handler = (
                     self.text_encoder_model.encoder.block[i]
                     .layer[0]
@@ -182,144 +258,81 @@ class ACEStepPipeline:
         return random_generators, actual_seeds
 
     def get_lang(self, text):
-        language = "en"
-        try:
-            _ = self.lang_segment.getTexts(text)
-            langCounts = self.lang_segment.getCounts()
-            language = langCounts[0][0]
-            if len(langCounts) > 1 and language == "en":
-                language = langCounts[1][0]
-        except Exception as err:
-            language = "en"
-        return language
+        return self.lyric_processor.get_lang(text)
 
     def tokenize_lyrics(self, lyrics, debug=False):
-        lines = lyrics.split("\n")
-        lyric_token_idx = [261]
-        for line in lines:
-            line = line.strip()
-            if not line:
-                lyric_token_idx += [2]
-                continue
-
-            lang = self.get_lang(line)
+        with stage("lyric_tokenization"):
+            return self.lyric_processor.tokenize_lyrics(lyrics, debug=debug)
 
-            if lang not in SUPPORT_LANGUAGES:
-                lang = "en"
-            if "zh" in lang:
-                lang = "zh"
-            if "spa" in lang:
-                lang = "es"
-
-            try:
-                if structure_pattern.match(line):
-                    token_idx = self.lyric_tokenizer.encode(line, "en")
-                else:
-                    token_idx = self.lyric_tokenizer.encode(line, lang)
-                if debug:
-                    toks = self.lyric_tokenizer.batch_decode(
-                        [[tok_id] for tok_id in token_idx]
-                    )
-                    logger.info(f"debbug {line} --> {lang} --> {toks}")
-                lyric_token_idx = lyric_token_idx + token_idx + [2]
-            except Exception as e:
-                print("tokenize error", e, "for line", line, "major_language", lang)
-        return lyric_token_idx
-
-    @cpu_offload("ace_step_transformer")
-    def calc_v(
+    def flowedit_branch_guidance(
         self,
-        zt_src,
-        zt_tar,
-        t,
-        encoder_text_hidden_states,
-        text_attention_mask,
-        target_encoder_text_hidden_states,
-        target_text_attention_mask,
-        speaker_embds,
-        target_speaker_embeds,
-        lyric_token_ids,
-        lyric_mask,
-        target_lyric_token_ids,
-        target_lyric_mask,
-        do_classifier_free_guidance=False,
-        guidance_scale=1.0,
-        target_guidance_scale=1.0,
+        noise_pred,
+        do_classifier_free_guidance,
+        guidance_scale,
         cfg_type="apg",
-        attention_mask=None,
         momentum_buffer=None,
-        momentum_buffer_tar=None,
-        return_src_pred=True,
     ):
-        noise_pred_src = None
-        if return_src_pred:
-            src_latent_model_input = (
-                torch.cat([zt_src, zt_src]) if do_classifier_free_guidance else zt_src
+        # noise_pred holds one branch, cond rows followed by uncond rows when guided
+        if not do_classifier_free_guidance:
+            return noise_pred
+        noise_pred_with_cond, noise_pred_uncond = noise_pred.chunk(2)
+        if cfg_type == "apg":
+            return apg_forward(
+                pred_cond=noise_pred_with_cond,
+                pred_uncond=noise_pred_uncond,
+                guidance_scale=guidance_scale,
+                momentum_buffer=momentum_buffer,
             )
-            timestep = t.expand(src_latent_model_input.shape[0])
-            # source
-            noise_pred_src = self.ace_step_transformer(
-                hidden_states=src_latent_model_input,
-                attention_mask=attention_mask,
-                encoder_text_hidden_states=encoder_text_hidden_states,
-                text_attention_mask=text_attention_mask,
-                speaker_embeds=speaker_embds,
-                lyric_token_idx=lyric_token_ids,
-                lyric_mask=lyric_mask,
-                timestep=timestep,
-            ).sample
-
-            if do_classifier_free_guidance:
-                noise_pred_with_cond_src, noise_pred_uncond_src = noise_pred_src.chunk(
-                    2
-                )
-                if cfg_type == "apg":
-                    noise_pred_src = apg_forward(
-                        pred_cond=noise_pred_with_cond_src,
-                        pred_uncond=noise_pred_uncond_src,
-                        guidance_scale=guidance_scale,
-                        momentum_buffer=momentum_buffer,
-                    )
-                elif cfg_type == "cfg":
-                    noise_pred_src = cfg_forward(
-                        cond_output=noise_pred_with_cond_src,
-                        uncond_output=noise_pred_uncond_src,
-                        cfg_strength=guidance_scale,
-                    )
-
-        tar_latent_model_input = (
-            torch.cat([zt_tar, zt_tar]) if do_classifier_free_guidance else zt_tar
-        )
-        timestep = t.expand(tar_latent_model_input.shape[0])
-        # target
-        noise_pred_tar = self.ace_step_transformer(
-            hidden_states=tar_latent_model_input,
-            attention_mask=attention_mask,
-            encoder_text_hidden_states=target_encoder_text_hidden_states,
-            text_attention_mask=target_text_attention_mask,
-            speaker_embeds=target_speaker_embeds,
-            lyric_token_idx=target_lyric_token_ids,
-            lyric_mask=target_lyric_mask,
-            timestep=timestep,
-        ).sample
-
-        if do_classifier_free_guidance:
-            noise_pred_with_cond_tar, noise_pred_uncond_tar = noise_pred_tar.chunk(2)
-            if cfg_type == "apg":
-                noise_pred_tar = apg_forward(
-                    pred_cond=noise_pred_with_cond_tar,
-                    pred_uncond=noise_pred_uncond_tar,
-                    guidance_scale=target_guidance_scale,
-                    momentum_buffer=momentum_buffer_tar,
-                )
-            elif cfg_type == "cfg":
-                noise_pred_tar = cfg_forward(
-                    cond_output=noise_pred_with_cond_tar,
-                    uncond_output=noise_pred_uncond_tar,
-                    cfg_strength=target_guidance_scale,
+        elif cfg_type == "cfg":
+            return cfg_forward(
+                cond_output=noise_pred_with_cond,
+                uncond_output=noise_pred_uncond,
+                cfg_strength=guidance_scale,
+            )
+        return noise_pred
+
+    def flowedit_micro_batches(self, encoder_hidden_states, encoder_hidden_mask, attention_mask, micro_batch_size):
+        """
+        Split the stacked rows of a FlowEdit decode into micro-batches of at most `micro_batch_size` rows.
+
+        The encoder states of every micro-batch are sliced once here, so each one keeps its own cross attention
+        K/V cache valid for the whole loop.
+        """
+        num_rows = encoder_hidden_states.shape[0]
+        if not micro_batch_size or micro_batch_size >= num_rows:
+            micro_batch_size = num_rows
+        micro_batches = []
+        for start in range(0, num_rows, micro_batch_size):
+            rows = slice(start, min(start + micro_batch_size, num_rows))
+            micro_batches.append({
+                "rows": rows,
+                "encoder_hidden_states": encoder_hidden_states[rows],
+                "encoder_hidden_mask": encoder_hidden_mask[rows],
+                "attention_mask": attention_mask[rows],
+                "cross_attn_kv_cache": CrossAttnKVCache(),
+            })
+        return micro_batches
+
+    def flowedit_decode(self, hidden_states, t, micro_batches, branch="edit"):
+        output_length = hidden_states.shape[-1]
+        noise_preds = []
+        for micro_batch in micro_batches:
+            with stage(f"decode.{branch}"):
+                latent_model_input = hidden_states[micro_batch["rows"]]
+                noise_preds.append(
+                    self.ace_step_transformer.decode(
+                        hidden_states=latent_model_input,
+                        attention_mask=micro_batch["attention_mask"],
+                        encoder_hidden_states=micro_batch["encoder_hidden_states"],
+                        encoder_hidden_mask=micro_batch["encoder_hidden_mask"],
+                        output_length=output_length,
+                        timestep=t.expand(latent_model_input.shape[0]),
+                        cross_attn_kv_cache=micro_batch["cross_attn_kv_cache"],
+                    ).sample
                 )
-        return noise_pred_src, noise_pred_tar
+        return torch.cat(noise_preds, dim=0)
 
+    @cpu_offload("ace_step_transformer")
     @torch.no_grad()
     def flowedit_diffusion_process(
         self,
@@ -341,7 +354,16 @@ class ACEStepPipeline:
         n_max=1.0,
         n_avg=1,
         scheduler_type="euler",
+        micro_batch_size=None,
     ):
+        """
+        FlowEdit from `src_latents` towards the target prompt / lyrics.
+
+        Every edit step needs source and target velocities for `n_avg` noise draws, with and without conditioning.
+        They share the timestep and latent shape, so they are stacked along batch as
+        n_avg x (src, tar) x (cond, uncond) x bsz rows and run through `decode` in micro-batches of at most
+        `micro_batch_size` rows (None runs them as one call). Conditioning is encoded once for the whole loop.
+        """
 
         do_classifier_free_guidance = True
         if guidance_scale == 0.0 or guidance_scale == 1.0:
@@ -407,6 +429,51 @@ class ACEStepPipeline:
                 [target_lyric_mask, torch.zeros_like(target_lyric_mask)], 0
             )
 
+        # conditioning does not change between steps, encode both branches once
+        with stage("transformer_encode"):
+            src_encoder_hidden_states, src_encoder_hidden_mask = self.ace_step_transformer.encode(
+                encoder_text_hidden_states=encoder_text_hidden_states,
+                text_attention_mask=text_attention_mask,
+                speaker_embeds=speaker_embds,
+                lyric_token_idx=lyric_token_ids,
+                lyric_mask=lyric_mask,
+            )
+            tar_encoder_hidden_states, tar_encoder_hidden_mask = self.ace_step_transformer.encode(
+                encoder_text_hidden_states=target_encoder_text_hidden_states,
+                text_attention_mask=target_text_attention_mask,
+                speaker_embeds=target_speaker_embeds,
+                lyric_token_idx=target_lyric_token_ids,
+                lyric_mask=target_lyric_mask,
+            )
+
+        # src and tar prompts / lyrics differ in length, pad to stack them, padded tokens are masked out
+        encoder_length = max(src_encoder_hidden_states.shape[1], tar_encoder_hidden_states.shape[1])
+
+        def pad_encoder(hidden_states, mask):
+            pad = encoder_length - hidden_states.shape[1]
+            if pad == 0:
+                return hidden_states, mask
+            return (
+                torch.nn.functional.pad(hidden_states, (0, 0, 0, pad)),
+                torch.nn.functional.pad(mask, (0, pad)),
+            )
+
+        edit_encoder_hidden_states, edit_encoder_hidden_mask = zip(
+            pad_encoder(src_encoder_hidden_states, src_encoder_hidden_mask),
+            pad_encoder(tar_encoder_hidden_states, tar_encoder_hidden_mask),
+        )
+        # rows of one noise draw: src (cond, uncond) then tar (cond, uncond)
+        edit_micro_batches = self.flowedit_micro_batches(
+            torch.cat(edit_encoder_hidden_states, dim=0).repeat(n_avg, 1, 1),
+            torch.cat(edit_encoder_hidden_mask, dim=0).repeat(n_avg, 1),
+            attention_mask.repeat(2 * n_avg, 1),
+            micro_batch_size,
+        )
+        tar_micro_batches = self.flowedit_micro_batches(
+            tar_encoder_hidden_states, tar_encoder_hidden_mask, attention_mask, micro_batch_size
+        )
+        branch_rows = attention_mask.shape[0]
+
         momentum_buffer = MomentumBuffer()
         momentum_buffer_tar = MomentumBuffer()
         x_src = src_latents
@@ -430,8 +497,8 @@ class ACEStepPipeline:
                 t_im1 = torch.zeros_like(t_i).to(t_i.device)
 
             if i < n_max:
-                # Calculate the average of the V predictions
-                V_delta_avg = torch.zeros_like(x_src)
+                # draw the noise in the same order as one forward per draw would, then run all draws together
+                edit_inputs = []
                 for k in range(n_avg):
                     fwd_noise = randn_tensor(
                         shape=x_src.shape,
@@ -444,26 +511,25 @@ class ACEStepPipeline:
 
                     zt_tar = zt_edit + zt_src - x_src
 
-                    Vt_src, Vt_tar = self.calc_v(
-                        zt_src=zt_src,
-                        zt_tar=zt_tar,
-                        t=t,
-                        encoder_text_hidden_states=encoder_text_hidden_states,
-                        text_attention_mask=text_attention_mask,
-                        target_encoder_text_hidden_states=target_encoder_text_hidden_states,
-                        target_text_attention_mask=target_text_attention_mask,
-                        speaker_embds=speaker_embds,
-                        target_speaker_embeds=target_speaker_embeds,
-                        lyric_token_ids=lyric_token_ids,
-                        lyric_mask=lyric_mask,
-                        target_lyric_token_ids=target_lyric_token_ids,
-                        target_lyric_mask=target_lyric_mask,
-                        do_classifier_free_guidance=do_classifier_free_guidance,
-                        guidance_scale=guidance_scale,
-                        target_guidance_scale=target_guidance_scale,
-                        attention_mask=attention_mask,
+                    edit_inputs += [zt_src] * (branch_rows // bsz) + [zt_tar] * (branch_rows // bsz)
+
+                noise_preds = self.flowedit_decode(torch.cat(edit_inputs, dim=0), t, edit_micro_batches)
+                noise_preds = noise_preds.view(n_avg, 2, branch_rows, *noise_preds.shape[1:])
+
+                # Calculate the average of the V predictions
+                V_delta_avg = torch.zeros_like(x_src)
+                for k in range(n_avg):
+                    Vt_src = self.flowedit_branch_guidance(
+                        noise_preds[k, 0],
+                        do_classifier_free_guidance,
+                        guidance_scale,
                         momentum_buffer=momentum_buffer,
                     )
+                    Vt_tar = self.flowedit_branch_guidance(
+                        noise_preds[k, 1],
+                        do_classifier_free_guidance,
+                        target_guidance_scale,
+                    )
                     V_delta_avg += (1 / n_avg) * (
                         Vt_tar - Vt_src
                     )  # - (hfg-1)*( x_src))
@@ -493,26 +559,14 @@ class ACEStepPipeline:
                     xt_src = sigma * fwd_noise + (1.0 - sigma) * x_src
                     xt_tar = zt_edit + xt_src - x_src
 
-                _, Vt_tar = self.calc_v(
-                    zt_src=None,
-                    zt_tar=xt_tar,
-                    t=t,
-                    encoder_text_hidden_states=encoder_text_hidden_states,
-                    text_attention_mask=text_attention_mask,
-                    target_encoder_text_hidden_states=target_encoder_text_hidden_states,
-                    target_text_attention_mask=target_text_attention_mask,
-                    speaker_embds=speaker_embds,
-                    target_speaker_embeds=target_speaker_embeds,
-                    lyric_token_ids=lyric_token_ids,
-                    lyric_mask=lyric_mask,
-                    target_lyric_token_ids=target_lyric_token_ids,
-                    target_lyric_mask=target_lyric_mask,
-                    do_classifier_free_guidance=do_classifier_free_guidance,
-                    guidance_scale=guidance_scale,
-                    target_guidance_scale=target_guidance_scale,
-                    attention_mask=attention_mask,
-                    momentum_buffer_tar=momentum_buffer_tar,
-                    return_src_pred=False,
+                noise_pred_tar = self.flowedit_decode(
+                    torch.cat([xt_tar] * (branch_rows // bsz), dim=0), t, tar_micro_batches, branch="target"
+                )
+                Vt_tar = self.flowedit_branch_guidance(
+                    noise_pred_tar,
+                    do_classifier_free_guidance,
+                    target_guidance_scale,
+                    momentum_buffer=momentum_buffer_tar,
                 )
 
                 dtype = Vt_tar.dtype
@@ -571,6 +625,101 @@ class ACEStepPipeline:
         logger.info(f"{scheduler.sigma_min=} {scheduler.sigma_max=} {timesteps=} {num_inference_steps=}")
         return noisy_image, timesteps, scheduler, num_inference_steps
 
+    def encode_condition_branches(
+        self,
+        encoder_text_hidden_states,
+        text_attention_mask,
+        speaker_embds,
+        lyric_token_ids,
+        lyric_mask,
+        use_erg_lyric=False,
+        do_double_condition_guidance=False,
+        encoder_text_hidden_states_null=None,
+        neg_encoder_text_hidden_states=None,
+        tau=0.01,
+        l_min=4,
+        l_max=6,
+    ):
+        """
+        `ACEStepTransformer2DModel.encode` of the cond, null and (with double guidance) no-lyric branches at once.
+
+        The branches share most of their inputs, so each sub-encoder runs once on the distinct inputs only:
+        speaker embeddings on the real and a single zero row, the genre embedder on the distinct prompts, and the
+        lyric Conformer on the plain, the ERG weakened (temperature on `linear_q` of layers `l_min:l_max`, applied to
+        its rows only) and the all-zero lyrics stacked along batch. Zero inputs and lyrics repeated over the batch
+        are encoded on one row and broadcast.
+
+        Returns `encoder_hidden_states`, `encoder_hidden_mask`, `encoder_hidden_states_null` and
+        `encoder_hidden_states_no_lyric` (None without double guidance).
+        """
+        transformer = self.ace_step_transformer
+        bsz = encoder_text_hidden_states.shape[0]
+        device = encoder_text_hidden_states.device
+
+        def broadcast(rows):
+            return rows.expand(bsz, *rows.shape[1:]) if rows.shape[0] == 1 else rows
+
+        # speaker: real embeddings and one zero row
+        speaker_hidden_states = transformer.speaker_embedder(
+            torch.cat([speaker_embds, torch.zeros_like(speaker_embds[:1])], dim=0)
+        ).unsqueeze(1)
+        speaker_cond, speaker_null = speaker_hidden_states[:bsz], broadcast(speaker_hidden_states[bsz:])
+        speaker_mask = torch.ones(bsz, 1, device=device)
+
+        # lyrics the branches need: "plain" for cond, "weak" (ERG) or "zero" for null / no lyric
+        lyric_kinds = ["plain", "weak" if use_erg_lyric else "zero"]
+        lyric_rows = 1 if bool((lyric_token_ids == lyric_token_ids[:1]).all() and (lyric_mask == lyric_mask[:1]).all()) else bsz
+        lyric_inputs = {
+            "plain": lyric_token_ids[:lyric_rows],
+            "weak": lyric_token_ids[:lyric_rows],
+            "zero": torch.zeros_like(lyric_token_ids[:lyric_rows]),
+        }
+        # the zero lyrics only depend on the mask
+        zero_rows = 1 if bool((lyric_mask == lyric_mask[:1]).all()) else bsz
+
+        stacked_ids, stacked_mask, slices, start = [], [], {}, 0
+        for kind in lyric_kinds:
+            rows = zero_rows if kind == "zero" else lyric_rows
+            stacked_ids.append(lyric_inputs[kind][:rows])
+            stacked_mask.append(lyric_mask[:rows])
+            slices[kind] = slice(start, start + rows)
+            start += rows
+
+        attn_temperature = None
+        if "weak" in slices:
+            attn_temperature = AttentionTemperature(tau, l_min, l_max, rows=slices["weak"])
+        lyric_hidden_states = transformer.forward_lyric_encoder(
+            lyric_token_idx=torch.cat(stacked_ids, dim=0),
+            lyric_mask=torch.cat(stacked_mask, dim=0),
+            attn_temperature=attn_temperature,
+        )
+        lyric_states = {kind: broadcast(lyric_hidden_states[s]) for kind, s in slices.items()}
+
+        # genre: the prompt, and the null prompt (ERG weakened, negative or zeros, the latter on one row)
+        if use_erg_lyric and encoder_text_hidden_states_null is not None:
+            null_text = encoder_text_hidden_states_null
+        elif not use_erg_lyric and neg_encoder_text_hidden_states is not None:
+            null_text = neg_encoder_text_hidden_states
+        else:
+            null_text = torch.zeros_like(encoder_text_hidden_states[:1])
+        if null_text.shape[1:] == encoder_text_hidden_states.shape[1:]:
+            genre_hidden_states = transformer.genre_embedder(torch.cat([encoder_text_hidden_states, null_text], dim=0))
+            genre_cond, genre_null = genre_hidden_states[:bsz], broadcast(genre_hidden_states[bsz:])
+        else:
+            genre_cond = transformer.genre_embedder(encoder_text_hidden_states)
+            genre_null = broadcast(transformer.genre_embedder(null_text))
+
+        null_lyric = lyric_states[lyric_kinds[1]]
+        encoder_hidden_states = torch.cat([speaker_cond, genre_cond, lyric_states["plain"]], dim=1)
+        encoder_hidden_mask = torch.cat([speaker_mask, text_attention_mask, lyric_mask], dim=1)
+        # P(null_speaker, text_weaker / negative / null, lyric_weaker / no_lyric)
+        encoder_hidden_states_null = torch.cat([speaker_null, genre_null, null_lyric], dim=1)
+        encoder_hidden_states_no_lyric = None
+        if do_double_condition_guidance:
+            # P(null_speaker, text, lyric_weaker / no_lyric)
+            encoder_hidden_states_no_lyric = torch.cat([speaker_null, genre_cond, null_lyric], dim=1)
+        return encoder_hidden_states, encoder_hidden_mask, encoder_hidden_states_null, encoder_hidden_states_no_lyric
+
     @cpu_offload("ace_step_transformer")
     @torch.no_grad()
     def text2music_diffusion_process(
@@ -609,6 +758,12 @@ class ACEStepPipeline:
         audio2audio_enable=False,
         ref_audio_strength=0.5,
         ref_latents=None,
+        batched_guidance=False,
+        step_cache_threshold=0.0,
+        adaptive_guidance_tolerance=0.0,
+        adaptive_guidance_patience=3,
+        adaptive_guidance_metric="cosine",
+        compile_step=False,
     ):
 
         logger.info(
@@ -640,6 +795,16 @@ class ACEStepPipeline:
         dtype = encoder_text_hidden_states.dtype
         bsz = encoder_text_hidden_states.shape[0]
 
+        if self.shape_buckets is not None:
+            # prompt and lyric tokens padded to their bucket, the padding is masked out of the cross-attention
+            text_length = self.shape_buckets.text(text_attention_mask.shape[1])
+            encoder_text_hidden_states, text_attention_mask, encoder_text_hidden_states_null, neg_encoder_text_hidden_states = (
+                None if x is None else pad_to(x, text_length, dim=1)
+                for x in (encoder_text_hidden_states, text_attention_mask, encoder_text_hidden_states_null, neg_encoder_text_hidden_states)
+            )
+            lyric_length = self.shape_buckets.lyrics(lyric_mask.shape[1])
+            lyric_token_ids, lyric_mask = pad_to(lyric_token_ids, lyric_length, dim=1), pad_to(lyric_mask, lyric_length, dim=1)
+
         if scheduler_type == "euler":
             scheduler = FlowMatchEulerDiscreteScheduler(
                 num_train_timesteps=1000,
@@ -833,135 +998,126 @@ class ACEStepPipeline:
                 infer_steps=infer_steps,
             )
 
+        valid_frame_length = frame_length
+        if self.shape_buckets is not None:
+            # frames padded to their bucket (zeros, so the noise of the real frames is unchanged), masked out of the
+            # attention and trimmed off after the loop, the padded part of a repaint is free to be generated
+            frame_length = self.shape_buckets.frames(frame_length)
+            target_latents = pad_to(target_latents, frame_length)
+            if is_repaint:
+                x0, z0, zt_edit = (pad_to(x, frame_length) for x in (x0, z0, zt_edit))
+                repaint_mask = pad_to(repaint_mask, frame_length, value=1.0)
+
         attention_mask = torch.ones(bsz, frame_length, device=device, dtype=dtype)
+        if frame_length > valid_frame_length:
+            attention_mask[:, valid_frame_length:] = 0
+        # bucketed runs always take the masked decode, padded or not, so a bucket has one set of graphs
+        padded_frames = self.shape_buckets is not None
 
-        # guidance interval
-        start_idx = int(num_inference_steps * ((1 - guidance_interval) / 2))
-        end_idx = int(num_inference_steps * (guidance_interval / 2 + 0.5))
+        # per-step sigmas, guidance scales and timestep embeddings, fixed for the whole run
+        plan = SamplingPlan(
+            scheduler,
+            timesteps,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            guidance_interval=guidance_interval,
+            guidance_interval_decay=guidance_interval_decay,
+            min_guidance_scale=min_guidance_scale,
+            omega_scale=omega_scale,
+            transformer=self.ace_step_transformer,
+            dtype=dtype,
+        )
         logger.info(
-            f"start_idx: {start_idx}, end_idx: {end_idx}, num_inference_steps: {num_inference_steps}"
+            f"start_idx: {plan.start_idx}, end_idx: {plan.end_idx}, num_inference_steps: {num_inference_steps}"
+        )
+        # sync free scheduler update, optionally compiled (and captured as CUDA graphs on cuda)
+        static_step = StaticSchedulerStep(
+            scheduler_type,
+            scheduler,
+            plan.omega,
+            target_latents,
+            compile=compile_step,
+            compile_mode="reduce-overhead" if compile_step and device.type == "cuda" else None,
+            valid_frames=valid_frame_length,
         )
+        if is_repaint:
+            repaint_keep_mask = repaint_mask == 1.0
 
         momentum_buffer = MomentumBuffer()
 
-        def forward_encoder_with_temperature(self, inputs, tau=0.01, l_min=4, l_max=6):
-            handlers = []
-
-            def hook(module, input, output):
-                output[:] *= tau
-                return output
-
-            for i in range(l_min, l_max):
-                handler = self.ace_step_transformer.lyric_encoder.encoders[
-                    i
-                ].self_attn.linear_q.register_forward_hook(hook)
-                handlers.append(handler)
-
-            encoder_hidden_states, encoder_hidden_mask = (
-                self.ace_step_transformer.encode(**inputs)
+        # adaptive guidance truncation: single conditional pass once cond / uncond agree, 0 disables it
+        guidance_truncation = None
+        if adaptive_guidance_tolerance > 0 and do_classifier_free_guidance:
+            guidance_truncation = AdaptiveGuidanceTruncation(
+                tolerance=adaptive_guidance_tolerance,
+                patience=adaptive_guidance_patience,
+                metric=adaptive_guidance_metric,
             )
 
-            for hook in handlers:
-                hook.remove()
-
-            return encoder_hidden_states
-
-        # P(speaker, text, lyric)
-        encoder_hidden_states, encoder_hidden_mask = self.ace_step_transformer.encode(
-            encoder_text_hidden_states,
-            text_attention_mask,
-            speaker_embds,
-            lyric_token_ids,
-            lyric_mask,
-        )
-
-        if use_erg_lyric:
-            # P(null_speaker, text_weaker, lyric_weaker)
-            encoder_hidden_states_null = forward_encoder_with_temperature(
-                self,
-                inputs={
-                    "encoder_text_hidden_states": (
-                        encoder_text_hidden_states_null
-                        if encoder_text_hidden_states_null is not None
-                        else torch.zeros_like(encoder_text_hidden_states)
-                    ),
-                    "text_attention_mask": text_attention_mask,
-                    "speaker_embeds": torch.zeros_like(speaker_embds),
-                    "lyric_token_idx": lyric_token_ids,
-                    "lyric_mask": lyric_mask,
-                },
+        with stage("transformer_encode"):
+            (
+                encoder_hidden_states,
+                encoder_hidden_mask,
+                encoder_hidden_states_null,
+                encoder_hidden_states_no_lyric,
+            ) = self.encode_condition_branches(
+                encoder_text_hidden_states,
+                text_attention_mask,
+                speaker_embds,
+                lyric_token_ids,
+                lyric_mask,
+                use_erg_lyric=use_erg_lyric,
+                do_double_condition_guidance=do_double_condition_guidance,
+                encoder_text_hidden_states_null=encoder_text_hidden_states_null,
+                neg_encoder_text_hidden_states=neg_encoder_text_hidden_states,
             )
-        else:
-            # Using negative prompt for unconditional guidance
-            if neg_encoder_text_hidden_states is not None:
-                encoder_hidden_states_null, _ = self.ace_step_transformer.encode(
-                    neg_encoder_text_hidden_states,  # Already padded to match
-                    neg_text_attention_mask,         # Already padded to match
-                    torch.zeros_like(speaker_embds),
-                    torch.zeros_like(lyric_token_ids),
-                    lyric_mask,
-                )
-            else:
-                # Original approach with zeros
-                encoder_hidden_states_null, _ = self.ace_step_transformer.encode(
-                    torch.zeros_like(encoder_text_hidden_states),
-                    text_attention_mask,
-                    torch.zeros_like(speaker_embds),
-                    torch.zeros_like(lyric_token_ids),
-                    lyric_mask,
-                )
 
-        encoder_hidden_states_no_lyric = None
-        if do_double_condition_guidance:
-            # P(null_speaker, text, lyric_weaker)
-            if use_erg_lyric:
-                encoder_hidden_states_no_lyric = forward_encoder_with_temperature(
-                    self,
-                    inputs={
-                        "encoder_text_hidden_states": encoder_text_hidden_states,
-                        "text_attention_mask": text_attention_mask,
-                        "speaker_embeds": torch.zeros_like(speaker_embds),
-                        "lyric_token_idx": lyric_token_ids,
-                        "lyric_mask": lyric_mask,
-                    },
-                )
-            # P(null_speaker, text, no_lyric)
-            else:
-                encoder_hidden_states_no_lyric, _ = self.ace_step_transformer.encode(
-                    encoder_text_hidden_states,
-                    text_attention_mask,
-                    torch.zeros_like(speaker_embds),
-                    torch.zeros_like(lyric_token_ids),
-                    lyric_mask,
-                )
+        # built once per batch slice, so the per-row query scales are reused across steps
+        erg_diffusion_temperatures = {}
 
         def forward_diffusion_with_temperature(
-            self, hidden_states, timestep, inputs, tau=0.01, l_min=15, l_max=20
+            self, hidden_states, timestep, inputs, tau=0.01, l_min=15, l_max=20, batch_slice=slice(None)
         ):
-            handlers = []
-
-            def hook(module, input, output):
-                output[:] *= tau
-                return output
-
-            for i in range(l_min, l_max):
-                handler = self.ace_step_transformer.transformer_blocks[
-                    i
-                ].attn.to_q.register_forward_hook(hook)
-                handlers.append(handler)
-                handler = self.ace_step_transformer.transformer_blocks[
-                    i
-                ].cross_attn.to_q.register_forward_hook(hook)
-                handlers.append(handler)
-
-            sample = self.ace_step_transformer.decode(
-                hidden_states=hidden_states, timestep=timestep, **inputs
+            # only the rows in batch_slice are weakened, so ERG can share a batch with the other branches
+            key = (batch_slice.start, batch_slice.stop, tau, l_min, l_max)
+            if key not in erg_diffusion_temperatures:
+                erg_diffusion_temperatures[key] = AttentionTemperature(tau, l_min, l_max, rows=batch_slice)
+            return self.ace_step_transformer.decode(
+                hidden_states=hidden_states,
+                timestep=timestep,
+                attn_temperature=erg_diffusion_temperatures[key],
+                **inputs,
             ).sample
 
-            for hook in handlers:
-                hook.remove()
-
-            return sample
+        # one K/V cache per guidance branch, encoder states are fixed for the whole loop
+        cross_attn_kv_caches = {
+            "cond": CrossAttnKVCache(),
+            "no_lyric": CrossAttnKVCache(),
+            "null": CrossAttnKVCache(),
+            "batched": CrossAttnKVCache(),
+        }
+        # opt-in reuse of the block stack residual across steps, decided once per step for every branch, 0 disables it
+        step_cache_schedule = StepCacheSchedule(threshold=step_cache_threshold) if step_cache_threshold > 0 else None
+        step_caches = {
+            branch: StepCache(step_cache_schedule) if step_cache_schedule is not None else None
+            for branch in cross_attn_kv_caches
+        }
+
+        if batched_guidance and do_classifier_free_guidance:
+            # stack cond / (text only) / uncond along batch once, so the batched K/V cache stays valid
+            branch_hidden_states = [encoder_hidden_states]
+            if (
+                do_double_condition_guidance
+                and encoder_hidden_states_no_lyric is not None
+            ):
+                branch_hidden_states.append(encoder_hidden_states_no_lyric)
+            branch_hidden_states.append(encoder_hidden_states_null)
+            num_branches = len(branch_hidden_states)
+            batched_encoder_hidden_states = torch.cat(branch_hidden_states, dim=0)
+            batched_encoder_hidden_mask = torch.cat(
+                [encoder_hidden_mask] * num_branches, dim=0
+            )
+            batched_attention_mask = torch.cat([attention_mask] * num_branches, dim=0)
 
         for i, t in tqdm(enumerate(timesteps), total=num_inference_steps):
 
@@ -969,79 +1125,138 @@ class ACEStepPipeline:
                 if i < n_min:
                     continue
                 elif i == n_min:
-                    t_i = t / 1000
+                    t_i = plan.sigmas[i]
                     zt_src = (1 - t_i) * x0 + (t_i) * z0
                     target_latents = zt_edit + zt_src - x0
                     logger.info(f"repaint start from {n_min} add {t_i} level of noise")
 
             # expand the latents if we are doing classifier free guidance
             latents = target_latents
+            timestep_embedding = plan.timestep_embedding(i)
+
+            if step_cache_schedule is not None:
+                step_cache_schedule.decide(
+                    i,
+                    num_inference_steps,
+                    self.ace_step_transformer.step_cache_probe(
+                        latents, timestep_embedding, attention_mask if padded_frames else None
+                    ),
+                )
 
-            is_in_guidance_interval = start_idx <= i < end_idx
-            if is_in_guidance_interval and do_classifier_free_guidance:
-                # compute current guidance scale
-                if guidance_interval_decay > 0:
-                    # Linearly interpolate to calculate the current guidance scale
-                    progress = (i - start_idx) / (
-                        end_idx - start_idx - 1
-                    )  # 归一化到[0,1]
-                    current_guidance_scale = (
-                        guidance_scale
-                        - (guidance_scale - min_guidance_scale)
-                        * progress
-                        * guidance_interval_decay
-                    )
-                else:
-                    current_guidance_scale = guidance_scale
+            is_in_guidance_interval = plan.in_guidance_interval[i]
+            is_guidance_truncated = guidance_truncation is not None and guidance_truncation.truncated
+            if is_in_guidance_interval and do_classifier_free_guidance and not is_guidance_truncated:
+                current_guidance_scale = plan.guidance_scales[i]
 
                 latent_model_input = latents
-                timestep = t.expand(latent_model_input.shape[0])
                 output_length = latent_model_input.shape[-1]
-                # P(x|speaker, text, lyric)
-                noise_pred_with_cond = self.ace_step_transformer.decode(
-                    hidden_states=latent_model_input,
-                    attention_mask=attention_mask,
-                    encoder_hidden_states=encoder_hidden_states,
-                    encoder_hidden_mask=encoder_hidden_mask,
-                    output_length=output_length,
-                    timestep=timestep,
-                ).sample
-
-                noise_pred_with_only_text_cond = None
-                if (
-                    do_double_condition_guidance
-                    and encoder_hidden_states_no_lyric is not None
-                ):
-                    noise_pred_with_only_text_cond = self.ace_step_transformer.decode(
-                        hidden_states=latent_model_input,
-                        attention_mask=attention_mask,
-                        encoder_hidden_states=encoder_hidden_states_no_lyric,
-                        encoder_hidden_mask=encoder_hidden_mask,
-                        output_length=output_length,
-                        timestep=timestep,
-                    ).sample
-
-                if use_erg_diffusion:
-                    noise_pred_uncond = forward_diffusion_with_temperature(
-                        self,
-                        hidden_states=latent_model_input,
-                        timestep=timestep,
-                        inputs={
-                            "encoder_hidden_states": encoder_hidden_states_null,
-                            "encoder_hidden_mask": encoder_hidden_mask,
-                            "output_length": output_length,
-                            "attention_mask": attention_mask,
-                        },
+                if batched_guidance:
+                    # run cond / (text only) / uncond as a single decode
+                    batched_latent_model_input = torch.cat(
+                        [latent_model_input] * num_branches, dim=0
                     )
+                    timestep = t.expand(batched_latent_model_input.shape[0])
+                    batched_inputs = {
+                        "encoder_hidden_states": batched_encoder_hidden_states,
+                        "encoder_hidden_mask": batched_encoder_hidden_mask,
+                        "output_length": output_length,
+                        "attention_mask": batched_attention_mask,
+                        "cross_attn_kv_cache": cross_attn_kv_caches["batched"],
+                        "step_cache": step_caches["batched"],
+                        "timestep_embedding": timestep_embedding,
+                        "padded_frames": padded_frames,
+                    }
+                    if use_erg_diffusion:
+                        # the uncond branch is the last slice
+                        with stage("decode.batched"):
+                            noise_preds = forward_diffusion_with_temperature(
+                                self,
+                                hidden_states=batched_latent_model_input,
+                                timestep=timestep,
+                                inputs=batched_inputs,
+                                batch_slice=slice((num_branches - 1) * bsz, None),
+                            )
+                    else:
+                        with stage("decode.batched"):
+                            noise_preds = self.ace_step_transformer.decode(
+                                hidden_states=batched_latent_model_input,
+                                timestep=timestep,
+                                **batched_inputs,
+                            ).sample
+
+                    noise_preds = noise_preds.chunk(num_branches)
+                    noise_pred_with_cond = noise_preds[0]
+                    noise_pred_with_only_text_cond = (
+                        noise_preds[1] if num_branches == 3 else None
+                    )
+                    noise_pred_uncond = noise_preds[-1]
                 else:
-                    noise_pred_uncond = self.ace_step_transformer.decode(
-                        hidden_states=latent_model_input,
-                        attention_mask=attention_mask,
-                        encoder_hidden_states=encoder_hidden_states_null,
-                        encoder_hidden_mask=encoder_hidden_mask,
-                        output_length=output_length,
-                        timestep=timestep,
-                    ).sample
+                    timestep = t.expand(latent_model_input.shape[0])
+                    # P(x|speaker, text, lyric)
+                    with stage("decode.cond"):
+                        noise_pred_with_cond = self.ace_step_transformer.decode(
+                            hidden_states=latent_model_input,
+                            attention_mask=attention_mask,
+                            encoder_hidden_states=encoder_hidden_states,
+                            encoder_hidden_mask=encoder_hidden_mask,
+                            output_length=output_length,
+                            timestep=timestep,
+                            cross_attn_kv_cache=cross_attn_kv_caches["cond"],
+                            step_cache=step_caches["cond"],
+                            timestep_embedding=timestep_embedding,
+                            padded_frames=padded_frames,
+                        ).sample
+
+                    noise_pred_with_only_text_cond = None
+                    if (
+                        do_double_condition_guidance
+                        and encoder_hidden_states_no_lyric is not None
+                    ):
+                        with stage("decode.no_lyric"):
+                            noise_pred_with_only_text_cond = self.ace_step_transformer.decode(
+                                hidden_states=latent_model_input,
+                                attention_mask=attention_mask,
+                                encoder_hidden_states=encoder_hidden_states_no_lyric,
+                                encoder_hidden_mask=encoder_hidden_mask,
+                                output_length=output_length,
+                                timestep=timestep,
+                                cross_attn_kv_cache=cross_attn_kv_caches["no_lyric"],
+                                step_cache=step_caches["no_lyric"],
+                                timestep_embedding=timestep_embedding,
+                                padded_frames=padded_frames,
+                            ).sample
+
+                    if use_erg_diffusion:
+                        with stage("decode.null"):
+                            noise_pred_uncond = forward_diffusion_with_temperature(
+                                self,
+                                hidden_states=latent_model_input,
+                                timestep=timestep,
+                                inputs={
+                                    "encoder_hidden_states": encoder_hidden_states_null,
+                                    "encoder_hidden_mask": encoder_hidden_mask,
+                                    "output_length": output_length,
+                                    "attention_mask": attention_mask,
+                                    "cross_attn_kv_cache": cross_attn_kv_caches["null"],
+                                    "step_cache": step_caches["null"],
+                                    "timestep_embedding": timestep_embedding,
+                                    "padded_frames": padded_frames,
+                                },
+                            )
+                    else:
+                        with stage("decode.null"):
+                            noise_pred_uncond = self.ace_step_transformer.decode(
+                                hidden_states=latent_model_input,
+                                attention_mask=attention_mask,
+                                encoder_hidden_states=encoder_hidden_states_null,
+                                encoder_hidden_mask=encoder_hidden_mask,
+                                output_length=output_length,
+                                timestep=timestep,
+                                cross_attn_kv_cache=cross_attn_kv_caches["null"],
+                                step_cache=step_caches["null"],
+                                timestep_embedding=timestep_embedding,
+                                padded_frames=padded_frames,
+                            ).sample
 
                 if (
                     do_double_condition_guidance
@@ -1077,43 +1292,55 @@ class ACEStepPipeline:
                         zero_steps=zero_steps,
                         use_zero_init=use_zero_init,
                     )
+
+                if guidance_truncation is not None:
+                    agreement = guidance_truncation.update(i, noise_pred_with_cond, noise_pred_uncond)
+                    # lazy, reading the agreement back syncs with the device
+                    logger.opt(lazy=True).debug(
+                        "adaptive guidance step {}: {} {:.5f}", lambda: i, lambda: adaptive_guidance_metric,
+                        lambda: agreement.item(),
+                    )
+                    if guidance_truncation.truncated:
+                        logger.info(
+                            f"adaptive guidance step {i}: agreeing for {adaptive_guidance_patience} steps, "
+                            "conditional pass only from now on"
+                        )
             else:
+                if is_in_guidance_interval and is_guidance_truncated:
+                    logger.debug(f"adaptive guidance step {i}: truncated, conditional pass only")
                 latent_model_input = latents
                 timestep = t.expand(latent_model_input.shape[0])
-                noise_pred = self.ace_step_transformer.decode(
-                    hidden_states=latent_model_input,
-                    attention_mask=attention_mask,
-                    encoder_hidden_states=encoder_hidden_states,
-                    encoder_hidden_mask=encoder_hidden_mask,
-                    output_length=latent_model_input.shape[-1],
-                    timestep=timestep,
-                ).sample
+                with stage("decode.cond"):
+                    noise_pred = self.ace_step_transformer.decode(
+                        hidden_states=latent_model_input,
+                        attention_mask=attention_mask,
+                        encoder_hidden_states=encoder_hidden_states,
+                        encoder_hidden_mask=encoder_hidden_mask,
+                        output_length=latent_model_input.shape[-1],
+                        timestep=timestep,
+                        cross_attn_kv_cache=cross_attn_kv_caches["cond"],
+                        step_cache=step_caches["cond"],
+                        timestep_embedding=timestep_embedding,
+                        padded_frames=padded_frames,
+                    ).sample
 
             if is_repaint and i >= n_min:
-                t_i = t / 1000
-                if i + 1 < len(timesteps):
-                    t_im1 = (timesteps[i + 1]) / 1000
-                else:
-                    t_im1 = torch.zeros_like(t_i).to(t_i.device)
-                dtype = noise_pred.dtype
-                target_latents = target_latents.to(torch.float32)
-                prev_sample = target_latents + (t_im1 - t_i) * noise_pred
-                prev_sample = prev_sample.to(dtype)
-                target_latents = prev_sample
-                zt_src = (1 - t_im1) * x0 + (t_im1) * z0
-                target_latents = torch.where(
-                    repaint_mask == 1.0, target_latents, zt_src
-                )
+                with stage("scheduler_step"):
+                    target_latents = static_step.repaint(
+                        target_latents, noise_pred, plan.sigmas[i], plan.sigmas[i + 1], x0, z0, repaint_keep_mask
+                    )
             else:
-                target_latents = scheduler.step(
-                    model_output=noise_pred,
-                    timestep=t,
-                    sample=target_latents,
-                    return_dict=False,
-                    omega=omega_scale,
-                    generator=random_generators[0],
-                )[0]
+                with stage("scheduler_step"):
+                    target_latents = static_step(i, noise_pred, target_latents, generator=random_generators[0])
 
+        self.step_cache_stats = {
+            branch: step_cache.stats() for branch, step_cache in step_caches.items()
+            if step_cache is not None and step_cache.computed_steps > 0
+        }
+        if self.step_cache_stats:
+            logger.info(f"step cache (threshold {step_cache_threshold}): {self.step_cache_stats}")
+
+        target_latents = target_latents[..., :valid_frame_length]
         if is_extend:
             if to_right_pad_gt_latents is not None:
                 target_latents = torch.cat(
@@ -1126,25 +1353,71 @@ class ACEStepPipeline:
         return target_latents
 
     @cpu_offload("music_dcae")
-    def latents2audio(self, latents, target_wav_duration_second=30.0, sample_rate=48000):
+    def latents2audio(self, latents, target_wav_duration_second=30.0, sample_rate=48000, overlapped_decode=None):
+        if overlapped_decode is None:
+            overlapped_decode = self.overlapped_decode
         output_audios = []
         bs = latents.shape[0]
         pred_latents = latents
         with torch.no_grad():
-            if self.overlapped_decode and target_wav_duration_second > 48:
+            if overlapped_decode and target_wav_duration_second > 48:
                 _, pred_wavs = self.music_dcae.decode_overlap(pred_latents, sr=sample_rate)
             else:
-                _, pred_wavs = self.music_dcae.decode(pred_latents, sr=sample_rate)
+                vocoder_memory_budget = None
+                if self.vocoder_memory_budget:
+                    vocoder_memory_budget = self.vocoder_memory_budget * 1024**2
+                _, pred_wavs = self.music_dcae.decode(
+                    pred_latents, sr=sample_rate, vocoder_memory_budget=vocoder_memory_budget
+                )
         pred_wavs = [pred_wav.cpu().float() for pred_wav in pred_wavs]
         for i in tqdm(range(bs)):
             output_audio = (pred_wavs[i], sample_rate)
             output_audios.append(output_audio)
         return output_audios
 
-    @cpu_offload("music_dcae")
+    def latents2audio_stream(self, latents, target_wav_duration_second=30.0, sample_rate=48000):
+        """
+        Generator over `(item_index, wav_block, sample_rate)`, yielding crossfaded CPU audio blocks as the overlapped
+        DCAE / vocoder windows finish, so playback or writing can start before a long track is fully decoded.
+        Returned by `__call__(stream_decode=True)`, whose report gets its dcae / vocoder / resampling stages once the
+        generator is exhausted or closed.
+        """
+        # the cpu_offload decorator would release the model before a generator body runs
+        if not self.cpu_offload:
+            offloader = contextlib.nullcontext()
+        elif self.residency_manager is not None:
+            offloader = self.residency_manager.use(self.music_dcae)
+        else:
+            offloader = CpuOffloader(self.music_dcae, self.device)
+        with offloader, torch.no_grad():
+            for idx, wav_block in self.music_dcae.decode_overlap_stream(latents, sr=sample_rate):
+                yield idx, wav_block, sample_rate
+
     def infer_latents(self, input_audio_path):
+        # input_audio_path: a file path or a (waveform [C, T], sample_rate) pair
         if input_audio_path is None:
             return None
+        key = None
+        if self.latent_cache is not None:
+            dcae_config = getattr(self.music_dcae, "config", {})
+            model_id = (
+                dcae_config.get("dcae_checkpoint_path"),
+                dcae_config.get("vocoder_checkpoint_path"),
+                str(self.dtype),
+            )
+            key = self.latent_cache.make_key(input_audio_path, model_id)
+            latents = self.latent_cache.get(key, device=self.device)
+            if latents is not None:
+                logger.info(f"latent cache hit, skip dcae encode: {self.latent_cache.stats()}")
+                return latents.clone()
+        latents = self._encode_latents(input_audio_path)
+        if key is not None:
+            self.latent_cache.put(key, latents)
+            latents = latents.clone()
+        return latents
+
+    @cpu_offload("music_dcae")
+    def _encode_latents(self, input_audio_path):
         input_audio, sr = self.music_dcae.load_audio(input_audio_path)
         input_audio = input_audio.unsqueeze(0)
         device, dtype = self.device, self.dtype
@@ -1152,6 +1425,8 @@ class ACEStepPipeline:
         latents, _ = self.music_dcae.encode(input_audio, sr=sr)
         return latents
 
+    @residency_scope
+    @instrumented
     def __call__(
         self,
         audio_duration: float = 60.0,
@@ -1182,94 +1457,103 @@ class ACEStepPipeline:
         repaint_start: int = 0,
         repaint_end: int = 0,
         src_audio_path: str = None,
+        src_audio: tuple = None,
+        ref_audio: tuple = None,
         edit_target_prompt: str = None,
         edit_target_lyrics: str = None,
         edit_n_min: float = 0.0,
         edit_n_max: float = 1.0,
         edit_n_avg: int = 1,
+        edit_micro_batch_size: int = None,
         # save_path: str = None,
         # format: str = "wav",
         batch_size: int = 1,
+        batched_guidance: bool = False,
+        step_cache_threshold: float = 0.0,
+        adaptive_guidance_tolerance: float = 0.0,
+        adaptive_guidance_patience: int = 3,
+        adaptive_guidance_metric: str = "cosine",
+        compile_step: bool = False,
+        overlapped_decode: bool = None,
+        stream_decode: bool = False,
         debug: bool = False,
     ):
 
+        # in-memory (waveform [C, T], sample_rate) inputs take precedence over file paths
+        if ref_audio is not None:
+            ref_audio_input = ref_audio
+
         if audio2audio_enable and ref_audio_input is not None:
             task = "audio2audio"
 
-        start_time = time.time()
+        with stage("preprocess"):
+            random_generators, actual_seeds = self.set_seeds(batch_size, manual_seeds)
+            retake_random_generators, actual_retake_seeds = self.set_seeds(batch_size, retake_seeds)
 
-        random_generators, actual_seeds = self.set_seeds(batch_size, manual_seeds)
-        retake_random_generators, actual_retake_seeds = self.set_seeds(batch_size, retake_seeds)
-
-        if isinstance(oss_steps, str) and len(oss_steps) > 0:
-            oss_steps = list(map(int, oss_steps.split(",")))
-        else:
-            oss_steps = []
+            if isinstance(oss_steps, str) and len(oss_steps) > 0:
+                oss_steps = list(map(int, oss_steps.split(",")))
+            else:
+                oss_steps = []
         
-        texts = [prompt]
-        encoder_text_hidden_states, text_attention_mask = self.get_text_embeddings(texts, self.device)
-        encoder_text_hidden_states = encoder_text_hidden_states.repeat(batch_size, 1, 1)
-        text_attention_mask = text_attention_mask.repeat(batch_size, 1)
-
-        if negative_prompt:
-            neg_texts = [negative_prompt]
-            neg_encoder_text_hidden_states, neg_text_attention_mask = self.get_text_embeddings(
-                neg_texts, self.device
-            )
-            neg_encoder_text_hidden_states = neg_encoder_text_hidden_states.repeat(batch_size, 1, 1)
-            neg_text_attention_mask = neg_text_attention_mask.repeat(batch_size, 1)
+            texts = [prompt]
+            encoder_text_hidden_states, text_attention_mask = self.get_text_embeddings(texts, self.device)
+            encoder_text_hidden_states = encoder_text_hidden_states.repeat(batch_size, 1, 1)
+            text_attention_mask = text_attention_mask.repeat(batch_size, 1)
+
+            if negative_prompt:
+                neg_texts = [negative_prompt]
+                neg_encoder_text_hidden_states, neg_text_attention_mask = self.get_text_embeddings(
+                    neg_texts, self.device
+                )
+                neg_encoder_text_hidden_states = neg_encoder_text_hidden_states.repeat(batch_size, 1, 1)
+                neg_text_attention_mask = neg_text_attention_mask.repeat(batch_size, 1)
             
-            # Determine which is longer and pad the shorter one
-            pos_seq_len = encoder_text_hidden_states.shape[1]
-            neg_seq_len = neg_encoder_text_hidden_states.shape[1]
+                # Determine which is longer and pad the shorter one
+                pos_seq_len = encoder_text_hidden_states.shape[1]
+                neg_seq_len = neg_encoder_text_hidden_states.shape[1]
             
-            if pos_seq_len > neg_seq_len:
-                # Pad negative embeddings
-                pad_size = pos_seq_len - neg_seq_len
-                neg_encoder_text_hidden_states = torch.nn.functional.pad(
-                    neg_encoder_text_hidden_states, (0, 0, 0, pad_size), "constant", 0
-                )
-                neg_text_attention_mask = torch.nn.functional.pad(
-                    neg_text_attention_mask, (0, pad_size), "constant", 0
-                )
-            elif neg_seq_len > pos_seq_len:
-                # Pad positive embeddings
-                pad_size = neg_seq_len - pos_seq_len
-                encoder_text_hidden_states = torch.nn.functional.pad(
-                    encoder_text_hidden_states, (0, 0, 0, pad_size), "constant", 0
-                )
-                text_attention_mask = torch.nn.functional.pad(
-                    text_attention_mask, (0, pad_size), "constant", 0
-                )
-        else:
-            neg_encoder_text_hidden_states = None
-            neg_text_attention_mask = None
-
-        encoder_text_hidden_states_null = None
-        if use_erg_tag:
-            encoder_text_hidden_states_null = self.get_text_embeddings_null(texts, self.device)
-            encoder_text_hidden_states_null = encoder_text_hidden_states_null.repeat(batch_size, 1, 1)
-
-        # not support for released checkpoint
-        speaker_embeds = torch.zeros(batch_size, 512).to(self.device).to(self.dtype)
-
-        # 6 lyric
-        lyric_token_idx = torch.tensor([0]).repeat(batch_size, 1).to(self.device).long()
-        lyric_mask = torch.tensor([0]).repeat(batch_size, 1).to(self.device).long()
-        if len(lyrics) > 0:
-            lyric_token_idx = self.tokenize_lyrics(lyrics, debug=debug)
-            lyric_mask = [1] * len(lyric_token_idx)
-            lyric_token_idx = torch.tensor(lyric_token_idx).unsqueeze(0).to(self.device).repeat(batch_size, 1)
-            lyric_mask = torch.tensor(lyric_mask).unsqueeze(0).to(self.device).repeat(batch_size, 1)
-
-        if audio_duration <= 0:
-            audio_duration = random.uniform(30.0, 240.0)
-            logger.info(f"random audio duration: {audio_duration}")
-
-        end_time = time.time()
-        preprocess_time_cost = end_time - start_time
-        print(f"preprocess time cost: {preprocess_time_cost:.2f} seconds.")
-        start_time = end_time
+                if pos_seq_len > neg_seq_len:
+                    # Pad negative embeddings
+                    pad_size = pos_seq_len - neg_seq_len
+                    neg_encoder_text_hidden_states = torch.nn.functional.pad(
+                        neg_encoder_text_hidden_states, (0, 0, 0, pad_size), "constant", 0
+                    )
+                    neg_text_attention_mask = torch.nn.functional.pad(
+                        neg_text_attention_mask, (0, pad_size), "constant", 0
+                    )
+                elif neg_seq_len > pos_seq_len:
+                    # Pad positive embeddings
+                    pad_size = neg_seq_len - pos_seq_len
+                    encoder_text_hidden_states = torch.nn.functional.pad(
+                        encoder_text_hidden_states, (0, 0, 0, pad_size), "constant", 0
+                    )
+                    text_attention_mask = torch.nn.functional.pad(
+                        text_attention_mask, (0, pad_size), "constant", 0
+                    )
+            else:
+                neg_encoder_text_hidden_states = None
+                neg_text_attention_mask = None
+
+            encoder_text_hidden_states_null = None
+            if use_erg_tag:
+                encoder_text_hidden_states_null = self.get_text_embeddings_null(texts, self.device)
+                encoder_text_hidden_states_null = encoder_text_hidden_states_null.repeat(batch_size, 1, 1)
+
+            # not support for released checkpoint
+            speaker_embeds = torch.zeros(batch_size, 512).to(self.device).to(self.dtype)
+
+            # 6 lyric
+            lyric_token_idx = torch.tensor([0]).repeat(batch_size, 1).to(self.device).long()
+            lyric_mask = torch.tensor([0]).repeat(batch_size, 1).to(self.device).long()
+            if len(lyrics) > 0:
+                lyric_token_idx = self.tokenize_lyrics(lyrics, debug=debug)
+                lyric_mask = [1] * len(lyric_token_idx)
+                lyric_token_idx = torch.tensor(lyric_token_idx).unsqueeze(0).to(self.device).repeat(batch_size, 1)
+                lyric_mask = torch.tensor(lyric_mask).unsqueeze(0).to(self.device).repeat(batch_size, 1)
+
+            if audio_duration <= 0:
+                audio_duration = random.uniform(30.0, 240.0)
+                logger.info(f"random audio duration: {audio_duration}")
 
         add_retake_noise = task in ("retake", "repaint", "extend")
         # retake equal to repaint
@@ -1277,103 +1561,164 @@ class ACEStepPipeline:
             repaint_start = 0
             repaint_end = audio_duration
         
-        src_latents = None
-        if src_audio_path is not None:
-            assert src_audio_path is not None and task in ("repaint", "edit", "extend"), "src_audio_path is required for retake/repaint/extend task"
-            assert os.path.exists(src_audio_path), f"src_audio_path {src_audio_path} does not exist"
-            src_latents = self.infer_latents(src_audio_path)
-
-        ref_latents = None
-        if ref_audio_input is not None and audio2audio_enable:
-            assert ref_audio_input is not None, "ref_audio_input is required for audio2audio task"
-            assert os.path.exists(
-                ref_audio_input
-            ), f"ref_audio_input {ref_audio_input} does not exist"
-            ref_latents = self.infer_latents(ref_audio_input)
-
-        if task == "edit":
-            texts = [edit_target_prompt]
-            target_encoder_text_hidden_states, target_text_attention_mask = self.get_text_embeddings(texts, self.device)
-            target_encoder_text_hidden_states = target_encoder_text_hidden_states.repeat(batch_size, 1, 1)
-            target_text_attention_mask = target_text_attention_mask.repeat(batch_size, 1)
-
-            target_lyric_token_idx = torch.tensor([0]).repeat(batch_size, 1).to(self.device).long()
-            target_lyric_mask = torch.tensor([0]).repeat(batch_size, 1).to(self.device).long()
-            if len(edit_target_lyrics) > 0:
-                target_lyric_token_idx = self.tokenize_lyrics(edit_target_lyrics, debug=True)
-                target_lyric_mask = [1] * len(target_lyric_token_idx)
-                target_lyric_token_idx = torch.tensor(target_lyric_token_idx).unsqueeze(0).to(self.device).repeat(batch_size, 1)
-                target_lyric_mask = torch.tensor(target_lyric_mask).unsqueeze(0).to(self.device).repeat(batch_size, 1)
-
-            target_speaker_embeds = speaker_embeds.clone()
-
-            target_latents = self.flowedit_diffusion_process(
-                encoder_text_hidden_states=encoder_text_hidden_states,
-                text_attention_mask=text_attention_mask,
-                speaker_embds=speaker_embeds,
-                lyric_token_ids=lyric_token_idx,
-                lyric_mask=lyric_mask,
-                target_encoder_text_hidden_states=target_encoder_text_hidden_states, 
-                target_text_attention_mask=target_text_attention_mask,
-                target_speaker_embeds=target_speaker_embeds,
-                target_lyric_token_ids=target_lyric_token_idx,
-                target_lyric_mask=target_lyric_mask,
-                src_latents=src_latents,
-                random_generators=retake_random_generators, # more diversity
-                infer_steps=infer_step,
-                guidance_scale=guidance_scale,
-                n_min=edit_n_min,
-                n_max=edit_n_max,
-                n_avg=edit_n_avg,
-            )
-        else:
-            target_latents = self.text2music_diffusion_process(
-                duration=audio_duration,
-                encoder_text_hidden_states=encoder_text_hidden_states,
-                text_attention_mask=text_attention_mask,
-                speaker_embds=speaker_embeds,
-                lyric_token_ids=lyric_token_idx,
-                lyric_mask=lyric_mask,
-                guidance_scale=guidance_scale,
-                omega_scale=omega_scale,
-                infer_steps=infer_step,
-                random_generators=random_generators,
-                scheduler_type=scheduler_type,
-                cfg_type=cfg_type,
-                guidance_interval=guidance_interval,
-                guidance_interval_decay=guidance_interval_decay,
-                min_guidance_scale=min_guidance_scale,
-                oss_steps=oss_steps,
-                encoder_text_hidden_states_null=encoder_text_hidden_states_null,
-                neg_encoder_text_hidden_states=neg_encoder_text_hidden_states if negative_prompt else None,
-                neg_text_attention_mask=neg_text_attention_mask if negative_prompt else None,
-                use_erg_lyric=use_erg_lyric,
-                use_erg_diffusion=use_erg_diffusion,
-                retake_random_generators=retake_random_generators,
-                retake_variance=retake_variance,
-                add_retake_noise=add_retake_noise,
-                guidance_scale_text=guidance_scale_text,
-                guidance_scale_lyric=guidance_scale_lyric,
-                repaint_start=repaint_start,
-                repaint_end=repaint_end,
-                src_latents=src_latents,
-                audio2audio_enable=audio2audio_enable,
-                ref_audio_strength=ref_audio_strength,
-                ref_latents=ref_latents,
-            )
-
-        end_time = time.time()
-        diffusion_time_cost = end_time - start_time
-        print(f"diffusion time cost: {diffusion_time_cost}")
-        start_time = end_time
+        with stage("source_audio_encoding"):
+            src_latents = None
+            if src_audio is not None:
+                assert task in ("repaint", "edit", "extend"), "src_audio is only used by retake/repaint/extend task"
+                src_latents = self.infer_latents(src_audio)
+            elif src_audio_path is not None:
+                assert src_audio_path is not None and task in ("repaint", "edit", "extend"), "src_audio_path is required for retake/repaint/extend task"
+                assert os.path.exists(src_audio_path), f"src_audio_path {src_audio_path} does not exist"
+                src_latents = self.infer_latents(src_audio_path)
+
+            ref_latents = None
+            if ref_audio_input is not None and audio2audio_enable:
+                assert ref_audio_input is not None, "ref_audio_input is required for audio2audio task"
+                if isinstance(ref_audio_input, str):
+                    assert os.path.exists(
+                        ref_audio_input
+                    ), f"ref_audio_input {ref_audio_input} does not exist"
+                ref_latents = self.infer_latents(ref_audio_input)
+
+        # every batch item starts from the same source / reference audio
+        if src_latents is not None and src_latents.shape[0] != batch_size:
+            src_latents = src_latents.repeat(batch_size, 1, 1, 1)
+        if ref_latents is not None and ref_latents.shape[0] != batch_size:
+            ref_latents = ref_latents.repeat(batch_size, 1, 1, 1)
+
+        with stage("diffusion"):
+            if task == "edit":
+                texts = [edit_target_prompt]
+                target_encoder_text_hidden_states, target_text_attention_mask = self.get_text_embeddings(texts, self.device)
+                target_encoder_text_hidden_states = target_encoder_text_hidden_states.repeat(batch_size, 1, 1)
+                target_text_attention_mask = target_text_attention_mask.repeat(batch_size, 1)
+
+                target_lyric_token_idx = torch.tensor([0]).repeat(batch_size, 1).to(self.device).long()
+                target_lyric_mask = torch.tensor([0]).repeat(batch_size, 1).to(self.device).long()
+                if len(edit_target_lyrics) > 0:
+                    target_lyric_token_idx = self.tokenize_lyrics(edit_target_lyrics, debug=True)
+                    target_lyric_mask = [1] * len(target_lyric_token_idx)
+                    target_lyric_token_idx = torch.tensor(target_lyric_token_idx).unsqueeze(0).to(self.device).repeat(batch_size, 1)
+                    target_lyric_mask = torch.tensor(target_lyric_mask).unsqueeze(0).to(self.device).repeat(batch_size, 1)
+
+                target_speaker_embeds = speaker_embeds.clone()
+
+                target_latents = self.flowedit_diffusion_process(
+                    encoder_text_hidden_states=encoder_text_hidden_states,
+                    text_attention_mask=text_attention_mask,
+                    speaker_embds=speaker_embeds,
+                    lyric_token_ids=lyric_token_idx,
+                    lyric_mask=lyric_mask,
+                    target_encoder_text_hidden_states=target_encoder_text_hidden_states, 
+                    target_text_attention_mask=target_text_attention_mask,
+                    target_speaker_embeds=target_speaker_embeds,
+                    target_lyric_token_ids=target_lyric_token_idx,
+                    target_lyric_mask=target_lyric_mask,
+                    src_latents=src_latents,
+                    random_generators=retake_random_generators, # more diversity
+                    infer_steps=infer_step,
+                    guidance_scale=guidance_scale,
+                    n_min=edit_n_min,
+                    n_max=edit_n_max,
+                    n_avg=edit_n_avg,
+                    micro_batch_size=edit_micro_batch_size,
+                )
+            else:
+                target_latents = self.text2music_diffusion_process(
+                    duration=audio_duration,
+                    encoder_text_hidden_states=encoder_text_hidden_states,
+                    text_attention_mask=text_attention_mask,
+                    speaker_embds=speaker_embeds,
+                    lyric_token_ids=lyric_token_idx,
+                    lyric_mask=lyric_mask,
+                    guidance_scale=guidance_scale,
+                    omega_scale=omega_scale,
+                    infer_steps=infer_step,
+                    random_generators=random_generators,
+                    scheduler_type=scheduler_type,
+                    cfg_type=cfg_type,
+                    guidance_interval=guidance_interval,
+                    guidance_interval_decay=guidance_interval_decay,
+                    min_guidance_scale=min_guidance_scale,
+                    oss_steps=oss_steps,
+                    encoder_text_hidden_states_null=encoder_text_hidden_states_null,
+                    neg_encoder_text_hidden_states=neg_encoder_text_hidden_states if negative_prompt else None,
+                    neg_text_attention_mask=neg_text_attention_mask if negative_prompt else None,
+                    use_erg_lyric=use_erg_lyric,
+                    use_erg_diffusion=use_erg_diffusion,
+                    retake_random_generators=retake_random_generators,
+                    retake_variance=retake_variance,
+                    add_retake_noise=add_retake_noise,
+                    guidance_scale_text=guidance_scale_text,
+                    guidance_scale_lyric=guidance_scale_lyric,
+                    repaint_start=repaint_start,
+                    repaint_end=repaint_end,
+                    src_latents=src_latents,
+                    audio2audio_enable=audio2audio_enable,
+                    ref_audio_strength=ref_audio_strength,
+                    ref_latents=ref_latents,
+                    batched_guidance=batched_guidance,
+                    step_cache_threshold=step_cache_threshold,
+                    adaptive_guidance_tolerance=adaptive_guidance_tolerance,
+                    adaptive_guidance_patience=adaptive_guidance_patience,
+                    adaptive_guidance_metric=adaptive_guidance_metric,
+                    compile_step=compile_step,
+                )
 
-        output_audios = self.latents2audio(
-            latents=target_latents,
-            target_wav_duration_second=audio_duration,
-        )
+        if stream_decode:
+            # returns a generator, see latents2audio_stream
+            return self.latents2audio_stream(
+                latents=target_latents,
+                target_wav_duration_second=audio_duration,
+            )
 
-        end_time = time.time()
-        latent2audio_time_cost = end_time - start_time
-        print(f"latent2audio time cost: {latent2audio_time_cost}")
+        with stage("latent2audio"):
+            output_audios = self.latents2audio(
+                latents=target_latents,
+                target_wav_duration_second=audio_duration,
+                overlapped_decode=overlapped_decode,
+            )
 
         return output_audios
+
+    def warmup(self, durations, text_lengths=None, lyric_lengths=None, infer_step=2, **kwargs):
+        """
+        Short denoising runs so that the compiled transformer blocks have their graphs for every combination of the
+        frame bucket of each of `durations` (seconds) and the prompt / lyric token buckets of `text_lengths` /
+        `lyric_lengths` (token counts, None for every bucket) before the first request. One run on zero embeddings
+        per combination of buckets. `kwargs` go to `text2music_diffusion_process` for the code paths to warm up
+        (batched_guidance, scheduler_type, ...), two steps cover a step inside and one outside the guidance interval.
+        """
+        if self.shape_buckets is None:
+            raise ValueError("warmup needs shape_buckets, without them every request has shapes of its own")
+        buckets = self.shape_buckets
+        config = self.ace_step_transformer.config
+        frame_lengths = sorted({buckets.frames(int(duration * 44100 / 512 / 8)) for duration in durations})
+        text_lengths = sorted({buckets.text(length) for length in text_lengths or buckets.text_buckets})
+        lyric_lengths = sorted({buckets.lyrics(length) for length in lyric_lengths or buckets.lyric_buckets})
+        # the ERG code paths __call__ takes by default
+        kwargs = {"use_erg_lyric": True, "use_erg_diffusion": True, **kwargs}
+
+        for frame_length in frame_lengths:
+            for text_length in text_lengths:
+                for lyric_length in lyric_lengths:
+                    start_time = time.time()
+                    text_hidden_states = torch.zeros(
+                        1, text_length, config.text_embedding_dim, device=self.device, dtype=self.dtype
+                    )
+                    self.text2music_diffusion_process(
+                        duration=frame_length * 512 * 8 / 44100,
+                        encoder_text_hidden_states=text_hidden_states,
+                        encoder_text_hidden_states_null=text_hidden_states,
+                        text_attention_mask=torch.ones(1, text_length, device=self.device, dtype=self.dtype),
+                        speaker_embds=torch.zeros(1, config.speaker_embedding_dim, device=self.device, dtype=self.dtype),
+                        lyric_token_ids=torch.zeros(1, lyric_length, device=self.device, dtype=torch.long),
+                        lyric_mask=torch.ones(1, lyric_length, device=self.device, dtype=torch.long),
+                        random_generators=[torch.Generator(device=self.device).manual_seed(0)],
+                        infer_steps=infer_step,
+                        **kwargs,
+                    )
+                    logger.info(
+                        f"warm up of {frame_length} frames, {text_length} prompt tokens, {lyric_length} lyric tokens "
+                        f"took {time.time() - start_time:.2f} seconds"
+                    )
@@ -0,0 +1,151 @@
+import os
+import glob
+import time
+import hashlib
+import contextlib
+
+import torch
+from loguru import logger
+
+
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".pth")
+
+
+def checkpoint_fingerprint(checkpoint_dir, exclude_prefix=None):
+    """Fingerprint the weight files of a checkpoint directory by name, size and modification time."""
+    hasher = hashlib.sha256()
+    for name in sorted(os.listdir(checkpoint_dir)):
+        if not name.endswith(WEIGHT_SUFFIXES) or (exclude_prefix and name.startswith(exclude_prefix)):
+            continue
+        stat = os.stat(os.path.join(checkpoint_dir, name))
+        hasher.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return hasher.hexdigest()
+
+
+def library_versions():
+    versions = {"torch": torch.__version__}
+    try:
+        import torchao
+        versions["torchao"] = getattr(torchao, "__version__", "unknown")
+    except ImportError:
+        pass
+    return versions
+
+
+@contextlib.contextmanager
+def init_empty_weights():
+    """
+    Parameters created in this context are moved to the meta device as they are registered, so a model built in it
+    allocates and initializes no weights. Buffers, which `load_state_dict` may not restore (non-persistent ones such
+    as rotary frequencies), are built as usual.
+    """
+    register_parameter = torch.nn.Module.register_parameter
+
+    def register_empty_parameter(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            param = module._parameters[name]
+            module._parameters[name] = type(param)(param.to("meta"), requires_grad=param.requires_grad)
+
+    torch.nn.Module.register_parameter = register_empty_parameter
+    try:
+        yield
+    finally:
+        torch.nn.Module.register_parameter = register_parameter
+
+
+def meta_tensors(model):
+    return [name for name, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+
+
+class QuantizedArtifactCache:
+    """
+    Quantized weights of one model, stored next to its checkpoint and reused across loads.
+
+    The artifact name carries a fingerprint of the source weights, the quantization config, the dtype and the
+    torch / torchao versions, so a change to any of them quantizes again instead of loading stale weights. On a hit
+    the full precision checkpoint is not read at all: the model is built with empty (meta) weights and the memory
+    mapped artifact is assigned into it, without reading the whole file up front. An artifact is never rewritten,
+    artifacts from older fingerprints are removed when a new one is written.
+
+    torchao quantized weights are tensor subclasses that safetensors cannot store, so artifacts use torch's zipfile
+    format, which `torch.load(mmap=True)` maps the same way.
+    """
+
+    def __init__(self, checkpoint_dir, prefix, quant_config, dtype=None):
+        self.checkpoint_dir = checkpoint_dir
+        self.prefix = prefix
+        self.quant_config = quant_config
+        self.dtype = dtype
+        self.load_time = None
+        self.hit = None
+
+    def fingerprint(self):
+        hasher = hashlib.sha256()
+        hasher.update(checkpoint_fingerprint(self.checkpoint_dir, exclude_prefix=self.prefix).encode())
+        hasher.update(repr(self.quant_config).encode())
+        hasher.update(str(self.dtype).encode())
+        hasher.update(repr(sorted(library_versions().items())).encode())
+        return hasher.hexdigest()[:16]
+
+    def path(self, fingerprint=None):
+        fingerprint = fingerprint or self.fingerprint()
+        return os.path.join(self.checkpoint_dir, f"{self.prefix}-{fingerprint}.pt")
+
+    def stale_paths(self, current):
+        return [p for p in glob.glob(os.path.join(self.checkpoint_dir, f"{self.prefix}-*.pt")) if p != current]
+
+    def load_or_quantize(self, load_model, quantize_fn, empty_model, device=None):
+        """
+        Build the model with `empty_model()` and assign the cached quantized weights into it, or load it with
+        `load_model()`, quantize it in place with `quantize_fn(model)` and write the artifact. Returns the model, on
+        `device` when given, else on the device it was loaded on (the CPU for a hit).
+        """
+        start = time.perf_counter()
+        path = self.path()
+        self.hit = os.path.exists(path)
+        if self.hit:
+            model = self.load_artifact(path, empty_model)
+            if model is None:
+                self.hit = False
+        if not self.hit:
+            model = load_model()
+            quantize_fn(model)
+            tmp_path = f"{path}.tmp"
+            torch.save(model.state_dict(), tmp_path)
+            os.replace(tmp_path, path)
+            for stale in self.stale_paths(path):
+                try:
+                    os.remove(stale)
+                except OSError as e:
+                    logger.warning(f"failed to remove stale quantized weights {stale}: {e}")
+        if device is None:
+            device = next(model.parameters()).device
+        model = model.to(device)
+        model.torchao_quantized = True
+
+        self.load_time = time.perf_counter() - start
+        logger.info(
+            f"{'warm' if self.hit else 'cold'} quantized load of {self.prefix}: {self.load_time:.2f}s "
+            f"({'loaded' if self.hit else 'quantized and saved'} {path})"
+        )
+        return model
+
+    def load_artifact(self, path, empty_model):
+        with init_empty_weights():
+            model = empty_model()
+        if self.dtype is not None:
+            # the buffers the artifact does not hold, the meta parameters are replaced below
+            model = model.to(self.dtype)
+        state_dict = torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+        model.load_state_dict(state_dict, assign=True)
+        if hasattr(model, "tie_weights"):
+            model.tie_weights()
+        missing = meta_tensors(model)
+        if missing:
+            logger.warning(f"quantized weights {path} miss {missing[:4]}, quantizing again")
+            return None
+        return model.eval().requires_grad_(False)
+
+    def stats(self):
+        return {"path": self.path(), "hit": self.hit, "load_time": self.load_time}
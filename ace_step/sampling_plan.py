@@ -0,0 +1,71 @@
+import math
+
+import torch
+
+
+def rescale_omega(omega, lower=0.9, upper=1.1, midpoint=0.0, k=0.1):
+    """The schedulers' logistic squash of `omega_scale` into [lower, upper], without the numpy round trip."""
+    if isinstance(omega, torch.Tensor):
+        return lower + (upper - lower) * torch.sigmoid(k * (omega.float() - midpoint))
+    return lower + (upper - lower) / (1 + math.exp(-k * (omega - midpoint)))
+
+
+class SamplingPlan:
+    """
+    Everything about a denoising run that is fixed before the first step, computed once.
+
+    Holds the timesteps and their sigmas, the rescaled omega, which steps fall in the guidance interval and their
+    (decayed) guidance scale, and, when built with the transformer, the timestep embedding and AdaLN modulation
+    vector of every step as one device tensor each. The loop indexes into the plan instead of recomputing them per step and per guidance
+    branch: the embeddings cost one batched pass of `timestep_embedder` / `t_block` for the whole run, guidance
+    scales are plain floats so they never touch the device.
+
+    The scheduler is told it starts at the first timestep, which spares its first `step` the timestep lookup (a
+    `nonzero` and a device sync).
+    """
+
+    def __init__(
+        self,
+        scheduler,
+        timesteps,
+        num_inference_steps=None,
+        guidance_scale=15.0,
+        guidance_interval=0.5,
+        guidance_interval_decay=0.0,
+        min_guidance_scale=3.0,
+        omega_scale=10.0,
+        transformer=None,
+        dtype=None,
+    ):
+        self.scheduler = scheduler
+        self.timesteps = timesteps
+        self.num_steps = len(timesteps)
+        # sigma of every step and of the one after it, the last step goes to 0
+        self.sigmas = torch.cat([timesteps / 1000, torch.zeros(1, device=timesteps.device, dtype=timesteps.dtype)])
+        self.omega = rescale_omega(omega_scale)
+
+        # the interval is relative to num_inference_steps, which is fewer than the timesteps for heun
+        num_inference_steps = num_inference_steps or self.num_steps
+        self.start_idx = int(num_inference_steps * ((1 - guidance_interval) / 2))
+        self.end_idx = int(num_inference_steps * (guidance_interval / 2 + 0.5))
+        self.in_guidance_interval = [self.start_idx <= i < self.end_idx for i in range(self.num_steps)]
+        self.guidance_scales = []
+        for i in range(self.num_steps):
+            scale = guidance_scale
+            if guidance_interval_decay > 0 and self.in_guidance_interval[i]:
+                # linear decay from guidance_scale towards min_guidance_scale over the interval
+                progress = (i - self.start_idx) / max(self.end_idx - self.start_idx - 1, 1)
+                scale = guidance_scale - (guidance_scale - min_guidance_scale) * progress * guidance_interval_decay
+            self.guidance_scales.append(scale)
+
+        self.embedded_timesteps = None
+        self.modulations = None
+        if transformer is not None:
+            with torch.no_grad():
+                self.embedded_timesteps, self.modulations = transformer.embed_timestep(timesteps, dtype)
+
+    def timestep_embedding(self, step):
+        """(embedded_timestep, temb) of `step` for `decode`, with a batch dimension of 1, None without a transformer."""
+        if self.embedded_timesteps is None:
+            return None
+        return self.embedded_timesteps[step:step + 1], self.modulations[step:step + 1]
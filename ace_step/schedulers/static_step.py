@@ -0,0 +1,145 @@
+"""
+Sync free, fixed shape scheduler updates for the denoising loop, written to compile with
+`torch.compile(fullgraph=True)` and to be captured as CUDA graphs (`mode="reduce-overhead"`).
+
+The update functions are the `step` bodies of the flow matching schedulers with everything that depends on the
+step index moved out: sigmas are 0-dim device tensors indexed from a precomputed table, omega is already rescaled
+(see `SamplingPlan`), the Heun state lives in the caller, and random noise is drawn into a preallocated buffer
+before the call, since generators cannot be traced. Nothing reads a tensor back to the host. Only the default
+`s_churn=0` of the Heun scheduler is supported, which is what the pipeline uses.
+
+Latents padded to a shape bucket (see `ace_step.shape_buckets`) have zero model outputs in their padded frames, the
+mean shift then takes its mean over the valid frames only (`mean_scale`, the ratio of all to valid elements) and
+pingpong draws the noise of the valid frames exactly as an unpadded run would.
+"""
+import torch
+
+
+def omega_update(sample, dx, omega, dtype, mean_scale=None):
+    # mean shift: the step keeps its mean, the deviation from it is scaled by omega
+    m = dx.mean()
+    if mean_scale is not None:
+        # dx is zero in the padded frames, the mean of the valid ones
+        m = m * mean_scale
+    return (sample + ((dx - m) * omega + m)).to(dtype)
+
+
+def euler_update(model_output, sample, sigma, sigma_next, omega, mean_scale=None):
+    sample = sample.to(torch.float32)
+    dx = (sigma_next - sigma) * model_output
+    return omega_update(sample, dx, omega, model_output.dtype, mean_scale)
+
+
+def heun_first_order_update(model_output, sample, sigma, sigma_next, omega, mean_scale=None):
+    sample = sample.to(torch.float32)
+    denoised = sample - model_output * sigma
+    derivative = (sample - denoised) / sigma
+    dt = sigma_next - sigma
+    return omega_update(sample, derivative * dt, omega, model_output.dtype, mean_scale), derivative, dt, sample
+
+
+def heun_second_order_update(
+    model_output, sample, sigma_next, prev_derivative, dt, first_order_sample, omega, mean_scale=None
+):
+    sample = sample.to(torch.float32)
+    denoised = sample - model_output * sigma_next
+    derivative = (sample - denoised) / sigma_next
+    derivative = 0.5 * (prev_derivative + derivative)
+    return omega_update(first_order_sample, derivative * dt, omega, model_output.dtype, mean_scale)
+
+
+def pingpong_update(model_output, sample, sigma, sigma_next, noise):
+    sample = sample.to(torch.float32)
+    denoised = sample - sigma * model_output
+    return ((1 - sigma_next) * denoised + sigma_next * noise).to(model_output.dtype)
+
+
+def repaint_update(target_latents, noise_pred, t_i, t_im1, x0, z0, keep_mask):
+    prev_sample = (target_latents.to(torch.float32) + (t_im1 - t_i) * noise_pred).to(noise_pred.dtype)
+    zt_src = (1 - t_im1) * x0 + t_im1 * z0
+    return torch.where(keep_mask, prev_sample, zt_src)
+
+
+class StaticSchedulerStep:
+    """
+    Drop-in for `scheduler.step(...)[0]` of a run that starts at the scheduler's first timestep, indexed by step.
+
+    With `compile=True` every update is a `torch.compile(fullgraph=True, dynamic=False)` function: the shapes are the
+    same every step, so each update compiles once per run shape and never recompiles within a run. With
+    `compile_mode="reduce-overhead"` the updates are replayed as CUDA graphs, whose outputs live in memory the next
+    replay overwrites, so they are copied out (a latent sized copy) before being handed back.
+
+    `valid_frames` is the unpadded length of latents padded to a shape bucket, None when they are not padded.
+    """
+
+    UPDATES = {
+        "euler": (euler_update,),
+        "heun": (heun_first_order_update, heun_second_order_update),
+        "pingpong": (pingpong_update,),
+    }
+
+    def __init__(self, scheduler_type, scheduler, omega, sample, compile=False, compile_mode=None, valid_frames=None):
+        if scheduler_type not in self.UPDATES:
+            raise ValueError(f"unsupported scheduler_type {scheduler_type}")
+        self.scheduler_type = scheduler_type
+        device = sample.device
+        self.sigmas = scheduler.sigmas.to(device=device, dtype=torch.float32)
+        self.omega = torch.tensor(omega, device=device, dtype=torch.float32)
+        frames = sample.shape[-1]
+        padded = valid_frames is not None and valid_frames < frames
+        # all / valid elements, a 0-dim tensor so that it is not baked into the compiled updates
+        self.mean_scale = torch.tensor(frames / valid_frames, device=device, dtype=torch.float32) if padded else None
+        # pingpong's fresh noise, drawn in place every step, zero in the padded frames
+        self.noise = None
+        self.valid_noise = None
+        if scheduler_type == "pingpong":
+            self.noise = torch.zeros(sample.shape, device=device, dtype=torch.float32)
+            if padded:
+                # drawn contiguous in the unpadded shape, so the generator fills the valid frames as without padding
+                self.valid_noise = torch.empty((*sample.shape[:-1], valid_frames), device=device, dtype=torch.float32)
+        # heun: derivative, dt and sample of the pending first order step
+        self.heun_state = None
+
+        def wrap(fn):
+            return torch.compile(fn, fullgraph=True, dynamic=False, mode=compile_mode) if compile else fn
+
+        self.updates = [wrap(fn) for fn in self.UPDATES[scheduler_type]]
+        self.repaint_update = wrap(repaint_update)
+        self.cudagraphs = compile and compile_mode == "reduce-overhead"
+
+    def run(self, update, *args):
+        if not self.cudagraphs:
+            return update(*args)
+        torch.compiler.cudagraph_mark_step_begin()
+        outputs = update(*args)
+        if isinstance(outputs, tuple):
+            return tuple(output.clone() for output in outputs)
+        return outputs.clone()
+
+    def __call__(self, step, model_output, sample, generator=None):
+        if self.scheduler_type == "euler":
+            return self.run(
+                self.updates[0], model_output, sample, self.sigmas[step], self.sigmas[step + 1], self.omega, self.mean_scale
+            )
+        if self.scheduler_type == "pingpong":
+            if self.valid_noise is None:
+                self.noise.normal_(generator=generator)
+            else:
+                self.valid_noise.normal_(generator=generator)
+                self.noise[..., :self.valid_noise.shape[-1]].copy_(self.valid_noise)
+            return self.run(self.updates[0], model_output, sample, self.sigmas[step], self.sigmas[step + 1], self.noise)
+        # heun alternates first order (even steps) and second order (odd steps) over its doubled timesteps
+        if step % 2 == 0:
+            prev_sample, *self.heun_state = self.run(
+                self.updates[0], model_output, sample, self.sigmas[step], self.sigmas[step + 1], self.omega, self.mean_scale
+            )
+            return prev_sample
+        prev_derivative, dt, first_order_sample = self.heun_state
+        self.heun_state = None
+        return self.run(
+            self.updates[1], model_output, sample, self.sigmas[step], prev_derivative, dt, first_order_sample,
+            self.omega, self.mean_scale,
+        )
+
+    def repaint(self, target_latents, noise_pred, t_i, t_im1, x0, z0, keep_mask):
+        return self.run(self.repaint_update, target_latents, noise_pred, t_i, t_im1, x0, z0, keep_mask)
@@ -0,0 +1,98 @@
+"""
+Shape buckets for compiled runs: the latent frames, prompt tokens and lyric tokens of a request are padded up to
+one of a few fixed lengths and masked out through the existing `attention_mask` / `text_attention_mask` /
+`lyric_mask`, so `torch.compile` sees a handful of shapes instead of one per duration and lyric. The padded frames
+are trimmed off before the latents are decoded.
+
+Padding does not change the valid frames: the transformer keeps padded frames out of its feed forward convolutions
+and zeroes their output (`decode(padded_frames=True)`), which keeps them out of the guidance norms, and the scheduler
+takes its mean shift over the valid frames (`StaticSchedulerStep(valid_frames=...)`). A bucketed run matches the
+unbucketed one up to float rounding.
+"""
+import math
+import os
+
+import torch
+
+LATENT_FRAMES_PER_SECOND = 44100 / 512 / 8
+
+# 30s steps up to the 240s the model generates at most
+FRAME_BUCKET_SECONDS = (30, 60, 90, 120, 150, 180, 210, 240)
+# the tokenizer truncates prompts to 256 tokens
+TEXT_BUCKETS = (32, 64, 128, 256)
+LYRIC_BUCKETS = (128, 256, 512, 1024, 2048, 4096)
+
+
+def bucket_length(length, buckets):
+    """The smallest bucket that holds `length`, `length` itself when it is longer than all of them."""
+    for size in buckets:
+        if length <= size:
+            return size
+    return length
+
+
+def pad_to(tensor, length, dim=-1, value=0):
+    pad = length - tensor.shape[dim]
+    if pad <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = pad
+    return torch.cat([tensor, tensor.new_full(shape, value)], dim=dim)
+
+
+class ShapeBuckets:
+    """Bucket lengths of the latent frames (from bucket durations in seconds), prompt tokens and lyric tokens."""
+
+    def __init__(self, frame_bucket_seconds=FRAME_BUCKET_SECONDS, text_buckets=TEXT_BUCKETS, lyric_buckets=LYRIC_BUCKETS):
+        self.frame_buckets = [math.ceil(seconds * LATENT_FRAMES_PER_SECOND) for seconds in frame_bucket_seconds]
+        self.text_buckets = text_buckets
+        self.lyric_buckets = lyric_buckets
+
+    def frames(self, frame_length):
+        return bucket_length(frame_length, self.frame_buckets)
+
+    def text(self, token_length):
+        return bucket_length(token_length, self.text_buckets)
+
+    def lyrics(self, token_length):
+        return bucket_length(token_length, self.lyric_buckets)
+
+
+# batch sizes a compiled block runs with per bucket combination: one guidance branch, two or three batched ones,
+# and one spare for a second request batch size
+BATCH_SIZES_PER_BUCKET = 4
+
+
+def bucket_combinations(shape_buckets=None):
+    """Number of (frames, text, lyrics) bucket combinations, the distinct shapes a compiled block sees per batch size."""
+    shape_buckets = shape_buckets or ShapeBuckets()
+    return len(shape_buckets.frame_buckets) * len(shape_buckets.text_buckets) * len(shape_buckets.lyric_buckets)
+
+
+def enable_compile_cache(cache_dir, recompile_limit=None, shape_buckets=None):
+    """
+    Keeps inductor's compiled graphs and kernels in `cache_dir` across processes (unless TORCHINDUCTOR_CACHE_DIR is
+    already set), and lets dynamo hold `recompile_limit` graphs per function before it falls back to eager. The
+    default is `BATCH_SIZES_PER_BUCKET` graphs for every bucket combination of `shape_buckets` (the default buckets
+    when None).
+    """
+    import torch._dynamo
+    import torch._inductor.config
+
+    if recompile_limit is None:
+        recompile_limit = BATCH_SIZES_PER_BUCKET * bucket_combinations(shape_buckets)
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+    torch._inductor.config.fx_graph_cache = True
+    if hasattr(torch._inductor.config, "autotune_local_cache"):
+        torch._inductor.config.autotune_local_cache = True
+    # cache_size_limit was renamed to recompile_limit
+    for name in ("recompile_limit", "cache_size_limit"):
+        if hasattr(torch._dynamo.config, name):
+            setattr(torch._dynamo.config, name, max(getattr(torch._dynamo.config, name), recompile_limit))
+            break
+    # the limit over all graphs of a function, identical blocks share theirs
+    for name in ("accumulated_recompile_limit", "accumulated_cache_size_limit"):
+        if hasattr(torch._dynamo.config, name):
+            setattr(torch._dynamo.config, name, max(getattr(torch._dynamo.config, name), recompile_limit))
+            break
@@ -1,26 +1,19 @@
-import torchaudio
-import tempfile
-from typing import Optional
 import torch
 import os
 import ast
 import sys
-import librosa
-
-from transformers import UMT5EncoderModel, AutoTokenizer
-from diffusers.utils.peft_utils import set_weights_and_activate_adapters
+import json
+from functools import lru_cache
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.append(current_dir)
 
-from ace_step.pipeline_ace_step import ACEStepPipeline as AP
-from ace_step.music_dcae.music_dcae_pipeline import MusicDCAE
-from ace_step.ace_models.ace_step_transformer import ACEStepTransformer2DModel
-
+# transformers, diffusers and the ACE-Step models are imported by the nodes that need them, so registering the
+# custom nodes at ComfyUI startup does not pay for them
 import folder_paths
-cache_dir = folder_paths.get_temp_directory()
 models_dir = folder_paths.models_dir
+cache_dir = folder_paths.get_temp_directory()
 model_path = os.path.join(models_dir, "TTS", "ACE-Step-v1-3.5B")
 
 torch.backends.cudnn.benchmark = False
@@ -30,29 +23,6 @@ torch.backends.cuda.matmul.allow_tf32 = True
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 
-def cache_audio_tensor(
-    cache_dir,
-    audio_tensor: torch.Tensor,
-    sample_rate: int,
-    filename_prefix: str = "cached_audio_",
-    audio_format: Optional[str] = ".wav"
-) -> str:
-    try:
-        with tempfile.NamedTemporaryFile(
-            prefix=filename_prefix,
-            suffix=audio_format,
-            dir=cache_dir,
-            delete=False 
-        ) as tmp_file:
-            temp_filepath = tmp_file.name
-        
-        torchaudio.save(temp_filepath, audio_tensor, sample_rate)
-
-        return temp_filepath
-    except Exception as e:
-        raise Exception(f"Error caching audio tensor: {e}")
-
-
 def set_all_seeds(seed):
     # import random
     # import numpy as np
@@ -70,6 +40,37 @@ def set_all_seeds(seed):
         # torch.backends.cudnn.benchmark = False     # 关闭优化（牺牲速度换取确定性）
 
 
+def batch_seeds(seed, batch_size):
+    # one distinct seed per batch item, 0 means random
+    if seed == 0:
+        return None
+    return [seed + i for i in range(batch_size)]
+
+
+def audio_output_to_comfy(audio_output):
+    # stack every waveform of the batch into one AUDIO: B x C x T
+    waveform = torch.stack([wav for wav, _ in audio_output], dim=0)
+    return {"waveform": waveform, "sample_rate": audio_output[0][1]}
+
+
+def stage_report(models):
+    # per-stage timings / peak memory of the last run, see ace_step.instrumentation
+    return json.dumps(models.last_report, indent=2)
+
+
+def compile_models(music_dcae, ace_step_transformer, text_encoder_model):
+    # the transformer blocks are compiled one by one (the caches and guidance around them stay eager), one static
+    # graph per shape bucket (see ace_step.shape_buckets) and batch size of the guidance branches, kept on disk
+    # across restarts
+    from ace_step.shape_buckets import enable_compile_cache
+
+    enable_compile_cache(os.path.join(model_path, ".inductor_cache"))
+    music_dcae = torch.compile(music_dcae)
+    ace_step_transformer.compile_blocks()
+    text_encoder_model = torch.compile(text_encoder_model)
+    return music_dcae, ace_step_transformer, text_encoder_model
+
+
 from ace_step.data_sampler import DataSampler
 
 def sample_data(json_data):
@@ -92,9 +93,21 @@ def sample_data(json_data):
             "guidance_scale_lyric": json_data["guidance_scale_lyric"] if "guidance_scale_lyric" in json_data else 0.0,
     }
 
-data_sampler = DataSampler()
-json_data = data_sampler.sample()
-jd= sample_data(json_data)
+@lru_cache(maxsize=1)
+def data_sampler():
+    # the example songs are listed the first time they are needed, not when ComfyUI imports the nodes
+    return DataSampler()
+
+
+@lru_cache(maxsize=1)
+def delicious_songs():
+    return {os.path.basename(file): file for file in data_sampler().input_params_files}
+
+
+@lru_cache(maxsize=1)
+def default_song():
+    # sampled once, the first time a node's inputs are listed, and shared by all nodes' defaults
+    return data_sampler().sample()
 
 device = torch.device("cpu")
 dtype = torch.float32
@@ -109,6 +122,7 @@ elif torch.backends.mps.is_available():
 class GenerationParameters:
     @classmethod
     def INPUT_TYPES(s):
+        jd = sample_data(default_song())
         return {"required": 
                     { "audio_duration": ("FLOAT", {"default": jd["audio_duration"], "min": 0.0, "max": 240.0, "step": 1.0, "tooltip": "0 is a random length"}),
                       "infer_step": ("INT", {"default": jd["infer_step"], "min": 1, "max": 200, "step": 1}),
@@ -128,6 +142,17 @@ class GenerationParameters:
                       "guidance_scale_lyric": ("FLOAT", {"default": jd["guidance_scale_lyric"], "min": 0.0, "max": 10.0, "step": 0.1}),
                     },
                     "optional": {
+                      "batched_guidance": ("BOOLEAN", {"default": False, "tooltip": "Run the cond/uncond (and text only) guidance passes as one batched forward. Faster, uses more VRAM."}),
+                      "batch_size": ("INT", {"default": 1, "min": 1, "max": 16, "step": 1, "tooltip": "Number of variations generated in one diffusion pass."}),
+                      "seeds": ("STRING", {"default": "", "tooltip": "Comma separated per-item seeds, e.g. 1,2,3. Empty uses seed, seed+1, ... (or random seeds when seed is 0)."}),
+                      "step_cache_threshold": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1.0, "step": 0.01, "tooltip": "Reuse the transformer output of the previous step while the input changed less than this. Higher is faster, lower is more faithful. 0 disables it."}),
+                      "adaptive_guidance_tolerance": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1.0, "step": 0.001, "tooltip": "Stop the unconditional passes once cond and uncond agree within this tolerance for adaptive_guidance_patience steps. 0 disables it."}),
+                      "adaptive_guidance_patience": ("INT", {"default": 3, "min": 1, "max": 50, "step": 1}),
+                      "adaptive_guidance_metric": (["cosine", "norm"], {"default": "cosine", "tooltip": "cosine: 1 - cosine similarity of cond and uncond. norm: ||cond - uncond|| / ||cond||."}),
+                      "compile_step": ("BOOLEAN", {"default": False, "tooltip": "Compile the scheduler update with torch.compile (CUDA graphs on GPU). The first run of each length pays the compile."}),
+                      "instrument": ("BOOLEAN", {"default": False, "tooltip": "Time every stage (text encoding, each decode branch, scheduler, DCAE, vocoder, ...) with device synchronization and peak memory. Slower, for measuring only."}),
+                      "profile_ranges": ("BOOLEAN", {"default": False, "tooltip": "Mark every stage as a torch.profiler range named ace_step.<stage>."}),
+                      "report_path": ("STRING", {"default": "", "tooltip": "Also write the stage report of each run to this JSON file. Empty disables it."}),
                     }
                 }
 
@@ -137,8 +162,14 @@ class GenerationParameters:
     CATEGORY = "🎤MW/MW-ACE-Step"
 
     def generate(self, **kwargs):
-        if kwargs["seed"] != 0:
-            kwargs["manual_seeds"] = set_all_seeds(kwargs.pop("seed")) 
+        seed = kwargs.pop("seed")
+        seeds = kwargs.pop("seeds", "").strip()
+        batch_size = kwargs.get("batch_size", 1)
+        if seeds:
+            kwargs["manual_seeds"] = [int(s) for s in seeds.split(",") if s.strip()]
+        elif seed != 0:
+            set_all_seeds(seed)
+            kwargs["manual_seeds"] = batch_seeds(seed, batch_size)
         return (str(kwargs),)
 
 
@@ -150,7 +181,7 @@ class MultiLinePromptACES:
             "required": {
                 "multi_line_prompt": ("STRING", {
                     "multiline": True, 
-                    "default": json_data["prompt"]}),
+                    "default": default_song()["prompt"]}),
                 },
         }
 
@@ -171,7 +202,7 @@ class MultiLineLyrics:
             "required": {
                 "multi_line_prompt": ("STRING", {
                     "multiline": True, 
-                    "default": json_data["lyrics"]}),
+                    "default": default_song()["lyrics"]}),
                 },
         }
 
@@ -197,6 +228,14 @@ class ACEModelLoader:
                 # "quantized": ("BOOLEAN", {"default": False}),
                 "cpu_offload": ("BOOLEAN", {"default": False}),
                 "torch_compile": ("BOOLEAN", {"default": False}),
+            },
+            "optional": {
+                "offload_memory_budget": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 256, "tooltip": "With cpu_offload, MB of VRAM that models may stay resident in during a generation. 0 keeps only the model in use."}),
+                "block_offload": ("INT", {"default": -1, "min": -1, "max": 28, "step": 1, "tooltip": "Stream the transformer block by block through VRAM, keeping this many blocks resident. -1 disables it."}),
+                "vocoder_memory_budget": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 256, "tooltip": "MB of VRAM for decoding all songs and both stereo channels in one vocoder batch. 0 decodes channel by channel (lowest VRAM)."}),
+                "compile_warmup": ("STRING", {"default": "", "tooltip": "With torch_compile, comma separated durations in seconds to compile at load, e.g. 30,60,120. Each covers a 30s bucket. Empty compiles on first use."}),
+                "compile_warmup_prompt_tokens": ("STRING", {"default": "", "tooltip": "With compile_warmup, comma separated prompt token counts to compile for, e.g. 32,64. Each covers its token bucket. Empty compiles every bucket."}),
+                "compile_warmup_lyric_tokens": ("STRING", {"default": "512", "tooltip": "With compile_warmup, comma separated lyric token counts to compile for, e.g. 256,512,1024. Each covers its token bucket. Empty compiles every bucket."}),
             }
         }
 
@@ -205,7 +244,7 @@ class ACEModelLoader:
     FUNCTION = "load"
     CATEGORY = "🎤MW/MW-ACE-Step"
 
-    def load(self, dcae_checkpoint, vocoder_checkpoint, ace_step_checkpoint, text_encoder_checkpoint, quantized=False, cpu_offload=False, torch_compile=False):
+    def load(self, dcae_checkpoint, vocoder_checkpoint, ace_step_checkpoint, text_encoder_checkpoint, quantized=False, cpu_offload=False, torch_compile=False, vocoder_memory_budget=0, offload_memory_budget=0, block_offload=-1, compile_warmup="", compile_warmup_prompt_tokens="", compile_warmup_lyric_tokens="512"):
         dcae_checkpoint = os.path.join(model_path, dcae_checkpoint)
         vocoder_checkpoint = os.path.join(model_path, vocoder_checkpoint)
         ace_step_checkpoint = os.path.join(model_path, ace_step_checkpoint)
@@ -215,6 +254,12 @@ class ACEModelLoader:
             if not os.path.exists(path):
                 raise FileNotFoundError(f"Checkpoint not found: {path}")
 
+        from transformers import UMT5EncoderModel, AutoTokenizer
+        from ace_step.pipeline_ace_step import ACEStepPipeline as AP
+        from ace_step.music_dcae.music_dcae_pipeline import MusicDCAE
+        from ace_step.ace_models.ace_step_transformer import ACEStepTransformer2DModel
+        from ace_step.shape_buckets import ShapeBuckets
+
         music_dcae = MusicDCAE(
             dcae_checkpoint_path=dcae_checkpoint,
             vocoder_checkpoint_path=vocoder_checkpoint
@@ -224,95 +269,95 @@ class ACEModelLoader:
         else:
             music_dcae = music_dcae.to(device).eval().to(dtype)
             
-        ace_step_transformer = ACEStepTransformer2DModel.from_pretrained(ace_step_checkpoint, torch_dtype=dtype)
-        if cpu_offload:
-            ace_step_transformer = (
-                ace_step_transformer.to("cpu").eval().to(dtype)
-            )
-        else:
-            ace_step_transformer = (
-                ace_step_transformer.to(device).eval().to(dtype)
-            )
+        def load_ace_step_transformer():
+            ace_step_transformer = ACEStepTransformer2DModel.from_pretrained(ace_step_checkpoint, torch_dtype=dtype)
+            if cpu_offload or block_offload >= 0:
+                return ace_step_transformer.to("cpu").eval().to(dtype)
+            return ace_step_transformer.to(device).eval().to(dtype)
+
+        def load_text_encoder():
+            text_encoder_model = UMT5EncoderModel.from_pretrained(text_encoder_checkpoint, torch_dtype=dtype)
+            if cpu_offload:
+                text_encoder_model = text_encoder_model.to("cpu").eval().to(dtype)
+            else:
+                text_encoder_model = text_encoder_model.to(device).eval().to(dtype)
+            text_encoder_model.requires_grad_(False)
+            return text_encoder_model
 
-        text_encoder_model = UMT5EncoderModel.from_pretrained(text_encoder_checkpoint, torch_dtype=dtype)
-        if cpu_offload:
-            text_encoder_model = text_encoder_model.to("cpu").eval().to(dtype)
-        else:
-            text_encoder_model = text_encoder_model.to(device).eval().to(dtype)
-            
-        text_encoder_model.requires_grad_(False)
         text_tokenizer = AutoTokenizer.from_pretrained(text_encoder_checkpoint)
 
         if torch_compile:
-            music_dcae = torch.compile(music_dcae)
-            ace_step_transformer = torch.compile(ace_step_transformer)
-            text_encoder_model = torch.compile(text_encoder_model)
+            music_dcae, ace_step_transformer, text_encoder_model = compile_models(
+                music_dcae, load_ace_step_transformer(), load_text_encoder()
+            )
 
         elif quantized:
             from torchao.quantization import (
                 quantize_,
                 Int4WeightOnlyConfig,
             )
+            from transformers import UMT5Config
+
+            from ace_step.quant_cache import QuantizedArtifactCache
 
             group_size = 128
             use_hqq = True
-
-            music_dcae = torch.compile(music_dcae)
-            ace_step_transformer = torch.compile(ace_step_transformer)
-            text_encoder_model = torch.compile(text_encoder_model)
-            
-            quant_ace_path = os.path.join(ace_step_checkpoint, "diffusion_pytorch_model_int4wo.bin")
-            if not os.path.exists(quant_ace_path):
-                quantize_(
-                    ace_step_transformer,
-                    Int4WeightOnlyConfig(group_size=group_size, use_hqq=use_hqq),
-                )
-            # save quantized weights
-            torch.save(
-                ace_step_transformer.state_dict(),
-                os.path.join(
-                    ace_step_checkpoint, "diffusion_pytorch_model_int4wo.bin"
-                ),
+            quant_config = {"method": "int4wo", "group_size": group_size, "use_hqq": use_hqq}
+
+            def quantize(model):
+                quantize_(model, Int4WeightOnlyConfig(group_size=group_size, use_hqq=use_hqq))
+
+            # quantized once per fingerprint of the weights, config and library versions, then memory mapped into
+            # models built from their configs, the full precision checkpoints are only read to quantize
+            ace_quant_cache = QuantizedArtifactCache(ace_step_checkpoint, "diffusion_pytorch_model_int4wo", quant_config, dtype)
+            ace_step_transformer = ace_quant_cache.load_or_quantize(
+                load_ace_step_transformer,
+                quantize,
+                lambda: ACEStepTransformer2DModel.from_config(ACEStepTransformer2DModel.load_config(ace_step_checkpoint)),
+                device="cpu" if cpu_offload or block_offload >= 0 else device,
             )
-            print("Quantized Weights Saved to: ", quant_ace_path,)
-
-            ace_step_transformer.load_state_dict(
-                torch.load(quant_ace_path, map_location=device,),
-                assign=True
+            encoder_quant_cache = QuantizedArtifactCache(text_encoder_checkpoint, "pytorch_model_int4wo", quant_config, dtype)
+            text_encoder_model = encoder_quant_cache.load_or_quantize(
+                load_text_encoder,
+                quantize,
+                lambda: UMT5EncoderModel(UMT5Config.from_pretrained(text_encoder_checkpoint)),
+                device="cpu" if cpu_offload else device,
             )
-            ace_step_transformer.torchao_quantized = True
-
-            quant_encoder_path = os.path.join(text_encoder_checkpoint, "pytorch_model_int4wo.bin")
-            if not os.path.exists(quant_encoder_path):
-                quantize_(
-                    text_encoder_model,
-                    Int4WeightOnlyConfig(group_size=group_size, use_hqq=use_hqq),
-                )
-
-                torch.save(
-                    text_encoder_model.state_dict(),
-                    quant_encoder_path
-                )
-                print("Quantized Weights Saved to: ", quant_encoder_path)
-
-            text_encoder_model.load_state_dict(
-                torch.load(quant_encoder_path, map_location=device,),
-                assign=True
+            print(
+                f"Quantized weights: transformer {ace_quant_cache.load_time:.2f}s ({'warm' if ace_quant_cache.hit else 'cold'}), "
+                f"text encoder {encoder_quant_cache.load_time:.2f}s ({'warm' if encoder_quant_cache.hit else 'cold'})"
             )
-            text_encoder_model.torchao_quantized = True
 
-            text_tokenizer = AutoTokenizer.from_pretrained(
-                text_encoder_checkpoint
+            music_dcae, ace_step_transformer, text_encoder_model = compile_models(
+                music_dcae, ace_step_transformer, text_encoder_model
             )
 
-        models = (
+        else:
+            ace_step_transformer = load_ace_step_transformer()
+            text_encoder_model = load_text_encoder()
+
+        compiled = torch_compile or quantized
+        # build the pipeline once, the generation nodes share and reuse it
+        models = AP(
             music_dcae,
             ace_step_transformer,
             text_encoder_model,
             text_tokenizer,
             device,
-            dtype
+            dtype,
+            cpu_offload=cpu_offload,
+            latent_cache_dir=os.path.join(cache_dir, "ace_step_latents"),
+            vocoder_memory_budget=vocoder_memory_budget or None,
+            offload_memory_budget=offload_memory_budget,
+            block_offload_resident_blocks=None if block_offload < 0 else block_offload,
+            shape_buckets=ShapeBuckets() if compiled else None,
         )
+        if compiled and compile_warmup.strip():
+            models.warmup(
+                [float(d) for d in compile_warmup.split(",") if d.strip()],
+                text_lengths=[int(n) for n in compile_warmup_prompt_tokens.split(",") if n.strip()] or None,
+                lyric_lengths=[int(n) for n in compile_warmup_lyric_tokens.split(",") if n.strip()] or None,
+            )
         return (models,)
 
 
@@ -338,23 +383,29 @@ class ACELoRALoader:
     CATEGORY = "🎤MW/MW-ACE-Step"
 
     def load(self, models, lora_name, lora_weight):
+        from diffusers.utils.peft_utils import set_weights_and_activate_adapters
+
         lora_path = os.path.join(model_path, "loras", lora_name)
+        # LoRA layers change the block weights, stream them again afterwards
+        block_streamer = models.block_streamer
+        if block_streamer is not None:
+            block_streamer.detach()
+
         if not all((lora_name, self.lora_weight)) or self.lora_name != lora_name or self.lora_weight != lora_weight:
-            models[1].unload_lora()
+            models.ace_step_transformer.unload_lora()
 
-        models[1].load_lora_adapter(
+        models.ace_step_transformer.load_lora_adapter(
             os.path.join(lora_path, "pytorch_lora_weights.safetensors"),
             adapter_name="ace_step_lora",
             with_alpha=True,
         )
-        set_weights_and_activate_adapters(models[1], ["ace_step_lora"], [lora_weight])
+        set_weights_and_activate_adapters(models.ace_step_transformer, ["ace_step_lora"], [lora_weight])
+        if block_streamer is not None:
+            block_streamer.attach(block_streamer.model, block_streamer.groups)
         return (models,)
 
 
 class ACEStepGen:
-    files = DataSampler().input_params_files
-    songs = {os.path.basename(file): file for file in files}
-
     @classmethod
     def INPUT_TYPES(cls):
                
@@ -370,13 +421,13 @@ class ACEStepGen:
                 "ref_audio": ("AUDIO",),
                 "ref_audio_strength": ("FLOAT", {"default": 0.5, "min": 0.01, "max": 1.0, "step": 0.01}),
                 "overlapped_decode": ("BOOLEAN", {"default": False}),
-                "delicious_song": (list(cls.songs.keys()) + ["None"],{"default": "None"}),
+                "delicious_song": (list(delicious_songs()) + ["None"],{"default": "None"}),
                 },
         }
 
     CATEGORY = "🎤MW/MW-ACE-Step"
-    RETURN_TYPES = ("AUDIO", "STRING", "STRING",)
-    RETURN_NAMES = ("music", "delicious_song_prompt", "delicious_song_lyrics",)
+    RETURN_TYPES = ("AUDIO", "STRING", "STRING", "STRING",)
+    RETURN_NAMES = ("music", "delicious_song_prompt", "delicious_song_lyrics", "report",)
     FUNCTION = "acestepgen"
     
     def acestepgen(self, 
@@ -392,7 +443,7 @@ class ACEStepGen:
         ):
         
         if delicious_song != "None":
-            json_data = data_sampler.load_json(ACEStepGen.songs[delicious_song])
+            json_data = data_sampler().load_json(delicious_songs()[delicious_song])
             prompt = json_data["prompt"]
             lyrics = json_data["lyrics"]
             parameters = sample_data(json_data)
@@ -401,18 +452,15 @@ class ACEStepGen:
             assert parameters and prompt and lyrics, "parameters, prompt and lyrics are required"
             parameters = ast.literal_eval(parameters)
 
-        ap = AP(*models, overlapped_decode=overlapped_decode)
-
         audio2audio_enable = False
         ref_audio_input = None
 
         if ref_audio is not None:
-            ref_audio_path = cache_audio_tensor(cache_dir, ref_audio["waveform"].squeeze(0), ref_audio["sample_rate"], filename_prefix="ref_audio_")
             audio2audio_enable = True
             ref_audio_strength = ref_audio_strength
-            ref_audio_input = ref_audio_path
+            ref_audio_input = (ref_audio["waveform"][0], ref_audio["sample_rate"])
     
-        audio_output = ap(
+        audio_output = models(
             prompt=prompt, 
             negative_prompt=negative_prompt.strip(),
             lyrics=lyrics, 
@@ -420,11 +468,10 @@ class ACEStepGen:
             audio2audio_enable=audio2audio_enable, 
             ref_audio_strength=ref_audio_strength, 
             ref_audio_input=ref_audio_input, 
+            overlapped_decode=overlapped_decode,
             **parameters
             )
-        audio, sr = audio_output[0][0].unsqueeze(0), audio_output[0][1]
-        
-        return ({"waveform": audio, "sample_rate": sr}, prompt, lyrics)
+        return (audio_output_to_comfy(audio_output), prompt, lyrics, stage_report(models))
 
 
 class ACEStepRepainting:
@@ -448,8 +495,8 @@ class ACEStepRepainting:
         }
 
     CATEGORY = "🎤MW/MW-ACE-Step"
-    RETURN_TYPES = ("AUDIO",)
-    RETURN_NAMES = ("music",)
+    RETURN_TYPES = ("AUDIO", "STRING",)
+    RETURN_NAMES = ("music", "report",)
     FUNCTION = "acesteprepainting"
     
     def acesteprepainting(self, 
@@ -467,34 +514,30 @@ class ACEStepRepainting:
         ):
         if seed != 0:
             set_all_seeds(seed)
-        retake_seeds = [str(seed)]
 
-        src_audio_path = cache_audio_tensor(cache_dir, src_audio["waveform"].squeeze(0), src_audio["sample_rate"], filename_prefix="src_audio_")
-        
-        audio_duration = librosa.get_duration(filename=src_audio_path)
+        src_waveform, src_sr = src_audio["waveform"][0], src_audio["sample_rate"]
+        audio_duration = src_waveform.shape[-1] / src_sr
         if repaint_end > audio_duration:
             repaint_end = audio_duration
 
         parameters = ast.literal_eval(parameters)
         parameters["audio_duration"] = audio_duration
+        retake_seeds = batch_seeds(seed, parameters.get("batch_size", 1))
         
-        ap = AP(*models, overlapped_decode=overlapped_decode)
-
-        audio_output = ap(
+        audio_output = models(
             prompt=prompt, 
             negative_prompt=negative_prompt.strip(),
             lyrics=lyrics, 
             task="repaint", 
             retake_seeds=retake_seeds, 
-            src_audio_path=src_audio_path, 
+            src_audio=(src_waveform, src_sr), 
             repaint_start=repaint_start, 
             repaint_end=repaint_end, 
             retake_variance=repaint_variance, 
+            overlapped_decode=overlapped_decode,
             **parameters)
             
-        audio, sr = audio_output[0][0].unsqueeze(0), audio_output[0][1]
-        
-        return ({"waveform": audio, "sample_rate": sr},)
+        return (audio_output_to_comfy(audio_output), stage_report(models))
 
 
 class ACEStepEdit:
@@ -515,11 +558,15 @@ class ACEStepEdit:
                 "seed": ("INT", {"default":0, "min": 0, "max": 0xFFFFFFFFFFFFFFFF, "step": 1}),
                 "overlapped_decode": ("BOOLEAN", {"default": False}),
                 },
+            "optional": {
+                "edit_n_avg": ("INT", {"default": 1, "min": 1, "max": 16, "step": 1, "tooltip": "Noise draws averaged per edit step, all of them run as one batch."}),
+                "edit_micro_batch_size": ("INT", {"default": 0, "min": 0, "max": 256, "step": 1, "tooltip": "Max rows per transformer call when batching the edit branches. 0 runs them all at once (most VRAM)."}),
+                },
         }
 
     CATEGORY = "🎤MW/MW-ACE-Step"
-    RETURN_TYPES = ("AUDIO",)
-    RETURN_NAMES = ("music",)
+    RETURN_TYPES = ("AUDIO", "STRING",)
+    RETURN_NAMES = ("music", "report",)
     FUNCTION = "acestepedit"
     
     def acestepedit(self, 
@@ -533,35 +580,35 @@ class ACEStepEdit:
         edit_n_min, 
         edit_n_max, 
         seed, 
-        overlapped_decode=False
+        overlapped_decode=False,
+        edit_n_avg=1,
+        edit_micro_batch_size=0,
         ):
         if seed!= 0:
             set_all_seeds(seed)
-        retake_seeds = [str(seed)]
 
-        src_audio_path = cache_audio_tensor(cache_dir, src_audio["waveform"].squeeze(0), src_audio["sample_rate"], filename_prefix="src_audio_")
-        
-        audio_duration = librosa.get_duration(filename=src_audio_path)
+        src_waveform, src_sr = src_audio["waveform"][0], src_audio["sample_rate"]
+        audio_duration = src_waveform.shape[-1] / src_sr
         parameters = ast.literal_eval(parameters)
         parameters["audio_duration"] = audio_duration
+        retake_seeds = batch_seeds(seed, parameters.get("batch_size", 1))
         
-        ap = AP(*models, overlapped_decode=overlapped_decode)
-
-        audio_output = ap(
+        audio_output = models(
             prompt=prompt, 
             lyrics=lyrics, 
             task="edit", 
             retake_seeds=retake_seeds, 
-            src_audio_path=src_audio_path, 
+            src_audio=(src_waveform, src_sr), 
             edit_target_prompt = edit_prompt,
             edit_target_lyrics = edit_lyrics,
             edit_n_min = edit_n_min,
             edit_n_max = edit_n_max,
+            edit_n_avg = edit_n_avg,
+            edit_micro_batch_size = edit_micro_batch_size or None,
+            overlapped_decode=overlapped_decode,
             **parameters)
             
-        audio, sr = audio_output[0][0].unsqueeze(0), audio_output[0][1]
-        
-        return ({"waveform": audio, "sample_rate": sr},)
+        return (audio_output_to_comfy(audio_output), stage_report(models))
 
 
 class ACEStepExtend:
@@ -584,8 +631,8 @@ class ACEStepExtend:
         }
 
     CATEGORY = "🎤MW/MW-ACE-Step"
-    RETURN_TYPES = ("AUDIO",)
-    RETURN_NAMES = ("music",)
+    RETURN_TYPES = ("AUDIO", "STRING",)
+    RETURN_NAMES = ("music", "report",)
     FUNCTION = "acestepextend"
     
     def acestepextend(self, 
@@ -602,34 +649,30 @@ class ACEStepExtend:
         ):
         if seed!= 0:
             set_all_seeds(seed)
-        retake_seeds = [str(seed)]
 
-        src_audio_path = cache_audio_tensor(cache_dir, src_audio["waveform"].squeeze(0), src_audio["sample_rate"], filename_prefix="src_audio_")
-        
-        audio_duration = librosa.get_duration(filename=src_audio_path)
+        src_waveform, src_sr = src_audio["waveform"][0], src_audio["sample_rate"]
+        audio_duration = src_waveform.shape[-1] / src_sr
         repaint_start = -left_extend_length
         repaint_end = audio_duration + right_extend_length
 
         parameters = ast.literal_eval(parameters)
         parameters["audio_duration"] = audio_duration
+        retake_seeds = batch_seeds(seed, parameters.get("batch_size", 1))
         
-        ap = AP(*models, overlapped_decode=overlapped_decode)
-
-        audio_output = ap(
+        audio_output = models(
             prompt=prompt, 
             negative_prompt=negative_prompt.strip(),
             lyrics=lyrics, 
             task="extend", 
             retake_seeds=retake_seeds, 
-            src_audio_path=src_audio_path, 
+            src_audio=(src_waveform, src_sr), 
             repaint_start=repaint_start, 
             repaint_end=repaint_end, 
             retake_variance=1.0,
+            overlapped_decode=overlapped_decode,
             **parameters)
             
-        audio, sr = audio_output[0][0].unsqueeze(0), audio_output[0][1]
-        
-        return ({"waveform": audio, "sample_rate": sr},)
+        return (audio_output_to_comfy(audio_output), stage_report(models))
 
 
 from .text2lyric import LyricsLangSwitch
@@ -0,0 +1,61 @@
+"""
+Edit latency of FlowEdit against the number of averaged noise draws.
+
+Source / target branches and all `n_avg` draws run as one batched transformer call per step (or a few with
+`--micro_batch_size`), so the time per edit should grow sublinearly in `n_avg`.
+
+    python benchmarks/bench_flowedit.py --checkpoint_dir models/TTS/ACE-Step-v1-3.5B --src_audio song.wav
+"""
+import argparse
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ace_step.pipeline_ace_step import ACEStepPipeline
+from bench_pipeline_startup import load_models, timed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkpoint_dir", type=str, required=True)
+    parser.add_argument("--src_audio", type=str, required=True)
+    parser.add_argument("--n_avg", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--micro_batch_size", type=int, default=None)
+    parser.add_argument("--infer_step", type=int, default=30)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+    pipeline = ACEStepPipeline(*load_models(args.checkpoint_dir, device, dtype), device, dtype)
+
+    edit_kwargs = dict(
+        prompt="pop, piano, female vocals",
+        lyrics="[verse]\nhello world",
+        task="edit",
+        src_audio_path=args.src_audio,
+        edit_target_prompt="rock, electric guitar, male vocals",
+        edit_target_lyrics="[verse]\nhello world",
+        edit_n_min=0.6,
+        infer_step=args.infer_step,
+        manual_seeds=[42],
+        retake_seeds=[42],
+        edit_micro_batch_size=args.micro_batch_size,
+    )
+
+    # warm up the K/V caches, kernels and the latent cache of the source audio
+    pipeline(edit_n_avg=1, **edit_kwargs)
+
+    baseline = None
+    for n_avg in args.n_avg:
+        timings = sorted(timed(lambda: pipeline(edit_n_avg=n_avg, **edit_kwargs)) for _ in range(args.runs))
+        median = timings[len(timings) // 2]
+        baseline = baseline or median / n_avg
+        print(f"n_avg {n_avg:>2}: {median:.3f}s per edit ({median / (baseline * n_avg):.2f}x of linear scaling)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Import cost of the custom node package, the part ComfyUI pays at every startup.
+
+Imports the package the way ComfyUI does, in a fresh interpreter under `python -X importtime`, with torch and
+`folder_paths` already loaded (ComfyUI has imported both before it loads custom nodes). Prints the slowest
+imports, fails when the package takes longer than `--budget_ms` or when a heavy dependency that should only be
+imported by a node run shows up.
+
+    python benchmarks/bench_import_time.py --comfyui_dir /path/to/ComfyUI --budget_ms 300
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imported by the model loader / lyric front-ends on first use, never when the nodes are registered
+DEFERRED_MODULES = [
+    "transformers", "diffusers", "librosa", "torchaudio", "spacy", "pypinyin", "opencc", "hangul_romanize",
+    "num2words", "cutlet", "py3langid", "peft", "torchao",
+]
+
+CHILD = """
+import importlib.util, sys, time
+sys.path.insert(0, {comfyui_dir!r})
+import torch, folder_paths
+print("PACKAGE_IMPORT_START", file=sys.stderr, flush=True)
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location(
+    "ace_step_custom_nodes", {init!r}, submodule_search_locations=[{package_dir!r}]
+)
+module = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = module
+spec.loader.exec_module(module)
+print(f"PACKAGE_IMPORT_MS {{(time.perf_counter() - start) * 1000:.1f}}")
+"""
+
+
+def parse_importtime(stderr):
+    # "import time:      self [us] |  cumulative | imported package", only what is imported after the marker,
+    # python startup, torch and folder_paths are not ours
+    rows = []
+    started = False
+    for line in stderr.splitlines():
+        if line.startswith("PACKAGE_IMPORT_START"):
+            started = True
+        if not started or not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--comfyui_dir", type=str, required=True, help="ComfyUI checkout, for `folder_paths`")
+    parser.add_argument("--budget_ms", type=float, default=300.0)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    code = CHILD.format(
+        comfyui_dir=os.path.abspath(args.comfyui_dir),
+        init=os.path.join(PACKAGE_DIR, "__init__.py"),
+        package_dir=PACKAGE_DIR,
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=os.path.abspath(args.comfyui_dir),
+    )
+    if result.returncode != 0:
+        print(result.stderr[-4000:])
+        sys.exit(result.returncode)
+
+    elapsed_ms = next(
+        float(line.split()[1]) for line in result.stdout.splitlines() if line.startswith("PACKAGE_IMPORT_MS")
+    )
+    package_rows = parse_importtime(result.stderr)
+    for self_us, cumulative_us, name in sorted(package_rows, key=lambda row: -row[1])[:args.top]:
+        print(f"{cumulative_us / 1000:9.1f}ms cumulative {self_us / 1000:9.1f}ms self  {name}")
+
+    imported = {name.strip().split(".")[0] for _, _, name in package_rows}
+    leaked = [module for module in DEFERRED_MODULES if module in imported]
+
+    print(f"package import: {elapsed_ms:.1f}ms (budget {args.budget_ms:.0f}ms)")
+    if leaked:
+        print(f"FAIL: imported at startup, should be deferred to a node run: {', '.join(leaked)}")
+    if elapsed_ms > args.budget_ms:
+        print("FAIL: over budget")
+    if leaked or elapsed_ms > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
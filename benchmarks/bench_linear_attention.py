@@ -0,0 +1,92 @@
+"""
+Peak memory and latency of the transformer's linear self-attention against song duration and chunk size.
+
+Runs one self-attention layer of the released transformer's width on the latent sequence of each duration
+(44100 / 512 / 8 frames per second), with cond / uncond batched, for every `--chunk_sizes` value (0 computes the
+whole sequence at once). Also checks the chunked result against the original one-shot formula.
+
+    python benchmarks/bench_linear_attention.py --durations 30 60 120 240 --chunk_sizes 0 256 1024
+"""
+import argparse
+import os
+import sys
+
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ace_step.ace_models.customer_attention_processor import Attention, CustomLiteLAProcessor2_0
+from bench_pipeline_startup import synchronize, timed
+
+LATENT_FRAMES_PER_SECOND = 44100 / 512 / 8
+
+
+def reference_linear_attention(query, key, value, eps=1e-15):
+    # the one-shot form the processor used before chunking: float32 copies of q / k / v and a padded value
+    query, key, value = query.float(), key.float(), value.float()
+    value = F.pad(value, (0, 0, 0, 1), mode="constant", value=1.0)
+    hidden_states = torch.matmul(torch.matmul(value, key), query)
+    return hidden_states[:, :, :-1] / (hidden_states[:, :, -1:] + eps)
+
+
+def peak_memory(fn):
+    if not torch.cuda.is_available():
+        return None
+    synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    baseline = torch.cuda.memory_allocated()
+    fn()
+    synchronize()
+    return torch.cuda.max_memory_allocated() - baseline
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--durations", type=float, nargs="+", default=[30.0, 60.0, 120.0, 240.0])
+    parser.add_argument("--chunk_sizes", type=int, nargs="+", default=[0, 256, 1024])
+    parser.add_argument("--batch_size", type=int, default=2, help="rows per call, 2 is cond + uncond")
+    parser.add_argument("--heads", type=int, default=20)
+    parser.add_argument("--head_dim", type=int, default=128)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+    dim = args.heads * args.head_dim
+    processor = CustomLiteLAProcessor2_0()
+    attn = Attention(
+        query_dim=dim, dim_head=args.head_dim, heads=args.heads, out_dim=dim, bias=True, qk_norm="rms_norm",
+        processor=processor,
+    ).to(device, dtype).eval()
+
+    torch.manual_seed(0)
+    with torch.no_grad():
+        # chunked against the original formula, on kernel-activated inputs like the processor feeds it
+        query = torch.relu(torch.randn(2, 4, 64, 700, device=device, dtype=dtype))
+        key = torch.relu(torch.randn(2, 4, 700, 64, device=device, dtype=dtype))
+        value = torch.randn(2, 4, 64, 700, device=device, dtype=dtype)
+        reference = reference_linear_attention(query, key, value).to(dtype)
+        for chunk_size in args.chunk_sizes:
+            processor.chunk_size = chunk_size or None
+            error = (processor.linear_attention(query, key, value).float() - reference.float()).abs().max().item()
+            print(f"chunk {chunk_size or 'none':>5}: max abs difference to the one-shot formula {error:.2e}")
+
+        for duration in args.durations:
+            frames = int(duration * LATENT_FRAMES_PER_SECOND)
+            hidden_states = torch.randn(args.batch_size, frames, dim, device=device, dtype=dtype)
+            for chunk_size in args.chunk_sizes:
+                processor.chunk_size = chunk_size or None
+                run = lambda: attn(hidden_states=hidden_states)
+                run()
+                timings = sorted(timed(run) for _ in range(args.runs))
+                peak = peak_memory(run)
+                peak_text = f"{peak / 1024**2:8.1f}MB peak" if peak is not None else "peak n/a (cpu)"
+                print(
+                    f"{duration:5.0f}s ({frames:>4} frames) chunk {chunk_size or 'none':>5}: "
+                    f"{timings[len(timings) // 2] * 1000:8.2f}ms  {peak_text}"
+                )
+
+
+if __name__ == "__main__":
+    main()
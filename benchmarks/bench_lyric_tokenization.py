@@ -0,0 +1,74 @@
+"""
+Lyric tokenization microbenchmark over the bundled example lyrics.
+
+Tokenizes every `ace_step/examples/input_params/*.json` and `ace_step/examples/zh_rap_lora/*.json` lyrics with an
+empty cache (cold), then again with the line cache only (new lyrics, repeated lines) and with the whole-lyrics cache
+(same lyrics, new seed).
+
+    python benchmarks/bench_lyric_tokenization.py --repeats 3
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+from ace_step.lyric_processor import LyricProcessor
+
+
+def load_lyrics():
+    lyrics = []
+    for pattern in ("input_params/*.json", "zh_rap_lora/*.json"):
+        for file in sorted(glob.glob(os.path.join(root_dir, "ace_step", "examples", pattern))):
+            with open(file, "r", encoding="utf-8") as f:
+                lyrics.append(json.load(f)["lyrics"])
+    return lyrics
+
+
+def run(processor, all_lyrics):
+    start = time.perf_counter()
+    tokens = [processor.tokenize_lyrics(lyrics) for lyrics in all_lyrics]
+    return time.perf_counter() - start, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    all_lyrics = load_lyrics()
+    num_lines = sum(len([line for line in lyrics.split("\n") if line.strip()]) for lyrics in all_lyrics)
+    unique_lines = len({line.strip() for lyrics in all_lyrics for line in lyrics.split("\n") if line.strip()})
+    print(f"{len(all_lyrics)} songs, {num_lines} lines, {unique_lines} unique lines")
+
+    processor = LyricProcessor()
+    cold, reference = [], None
+    line_cached, lyrics_cached = [], []
+    for _ in range(args.repeats):
+        processor.clear_cache()
+        elapsed, reference = run(processor, all_lyrics)
+        cold.append(elapsed)
+
+        # new lyrics every time: only per-line entries can hit
+        processor.lyrics_cache.clear()
+        elapsed, tokens = run(processor, all_lyrics)
+        assert tokens == reference
+        line_cached.append(elapsed)
+
+        # same lyrics re-run with a new seed
+        elapsed, tokens = run(processor, all_lyrics)
+        assert tokens == reference
+        lyrics_cached.append(elapsed)
+
+    for name, timings in (("cold", cold), ("line cache", line_cached), ("lyrics cache", lyrics_cached)):
+        best = min(timings)
+        print(f"{name:>12}: {best * 1000:.2f} ms total, {best / len(all_lyrics) * 1000:.3f} ms / song")
+    print(f"line cache: {processor.line_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
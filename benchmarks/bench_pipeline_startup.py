@@ -0,0 +1,94 @@
+"""
+Startup latency of the ACE-Step pipeline: first generation vs. the Nth one.
+
+Compares building a fresh `ACEStepPipeline` for every run (what the nodes used to do) with reusing the pipeline
+built once by the model loader.
+
+    python benchmarks/bench_pipeline_startup.py --checkpoint_dir models/TTS/ACE-Step-v1-3.5B --runs 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformers import UMT5EncoderModel, AutoTokenizer
+
+from ace_step.pipeline_ace_step import ACEStepPipeline
+from ace_step.music_dcae.music_dcae_pipeline import MusicDCAE
+from ace_step.ace_models.ace_step_transformer import ACEStepTransformer2DModel
+
+
+def load_models(checkpoint_dir, device, dtype):
+    music_dcae = MusicDCAE(
+        dcae_checkpoint_path=os.path.join(checkpoint_dir, "music_dcae_f8c8"),
+        vocoder_checkpoint_path=os.path.join(checkpoint_dir, "music_vocoder"),
+    ).to(device).eval().to(dtype)
+    ace_step_transformer = ACEStepTransformer2DModel.from_pretrained(
+        os.path.join(checkpoint_dir, "ace_step_transformer"), torch_dtype=dtype
+    ).to(device).eval().to(dtype)
+    text_encoder_checkpoint = os.path.join(checkpoint_dir, "umt5-base")
+    text_encoder_model = UMT5EncoderModel.from_pretrained(text_encoder_checkpoint, torch_dtype=dtype)
+    text_encoder_model = text_encoder_model.to(device).eval().to(dtype)
+    text_encoder_model.requires_grad_(False)
+    text_tokenizer = AutoTokenizer.from_pretrained(text_encoder_checkpoint)
+    return music_dcae, ace_step_transformer, text_encoder_model, text_tokenizer
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def timed(fn):
+    synchronize()
+    start = time.perf_counter()
+    fn()
+    synchronize()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkpoint_dir", type=str, required=True)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--audio_duration", type=float, default=10.0)
+    parser.add_argument("--infer_step", type=int, default=10)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+
+    start = time.perf_counter()
+    models = load_models(args.checkpoint_dir, device, dtype)
+    print(f"model loading: {time.perf_counter() - start:.3f}s")
+
+    generation_kwargs = dict(
+        prompt="pop, piano, female vocals",
+        lyrics="[verse]\nhello world",
+        audio_duration=args.audio_duration,
+        infer_step=args.infer_step,
+        manual_seeds=[42],
+    )
+
+    results = {}
+    for mode in ("per_run", "persistent"):
+        timings = []
+        pipeline = ACEStepPipeline(*models, device, dtype) if mode == "persistent" else None
+        for _ in range(args.runs):
+            def run():
+                ap = pipeline if pipeline is not None else ACEStepPipeline(*models, device, dtype)
+                ap(**generation_kwargs)
+            timings.append(timed(run))
+        results[mode] = timings
+
+    for mode, timings in results.items():
+        steady = sorted(timings[1:])[len(timings[1:]) // 2] if len(timings) > 1 else timings[0]
+        print(f"{mode:>10}: first {timings[0]:.3f}s, Nth (median of runs 2..{len(timings)}) {steady:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Graph breaks, recompiles and per-step latency of the static scheduler update against `scheduler.step`.
+
+For every scheduler the static update first runs eagerly against `scheduler.step` on the same model outputs (and
+noise, for pingpong) to check it is the same update, then each update function goes through `torch._dynamo.explain`
+for its graph breaks, and a compiled run at every `--durations` latent length counts the graphs dynamo compiled:
+one per update function, anything above that is a recompile within the run. Works on CPU (inductor) and
+CUDA (`--mode reduce-overhead` for CUDA graphs).
+
+    python benchmarks/bench_static_step.py --schedulers euler heun pingpong --durations 30 60 --infer_step 60
+"""
+import argparse
+import os
+import sys
+
+import torch
+import torch._dynamo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ace_step.sampling_plan import rescale_omega
+from ace_step.schedulers.scheduling_flow_match_euler_discrete import FlowMatchEulerDiscreteScheduler
+from ace_step.schedulers.scheduling_flow_match_heun_discrete import FlowMatchHeunDiscreteScheduler
+from ace_step.schedulers.scheduling_flow_match_pingpong import FlowMatchPingPongScheduler
+from ace_step.schedulers.static_step import StaticSchedulerStep
+from bench_pipeline_startup import timed
+
+LATENT_FRAMES_PER_SECOND = 44100 / 512 / 8
+
+SCHEDULERS = {
+    "euler": FlowMatchEulerDiscreteScheduler,
+    "heun": FlowMatchHeunDiscreteScheduler,
+    "pingpong": FlowMatchPingPongScheduler,
+}
+
+
+def make_scheduler(scheduler_type, infer_step, device):
+    scheduler = SCHEDULERS[scheduler_type](num_train_timesteps=1000, shift=3.0)
+    scheduler.set_timesteps(infer_step, device=device)
+    scheduler.set_begin_index(0)
+    return scheduler
+
+
+def model_outputs(num_steps, frames, device, dtype, seed=0):
+    generator = torch.Generator(device=device).manual_seed(seed)
+    return [torch.randn((1, 8, 16, frames), generator=generator, device=device, dtype=dtype) for _ in range(num_steps)]
+
+
+def run_reference(scheduler_type, infer_step, sample, outputs, omega_scale, seed):
+    # scheduler.step rescales omega_scale itself, every step
+    scheduler = make_scheduler(scheduler_type, infer_step, sample.device)
+    generator = torch.Generator(device=sample.device).manual_seed(seed)
+    for t, model_output in zip(scheduler.timesteps, outputs):
+        sample = scheduler.step(
+            model_output=model_output, timestep=t, sample=sample, return_dict=False,
+            omega=omega_scale, generator=generator,
+        )[0]
+    return sample
+
+
+def run_static(static_step, sample, outputs, seed):
+    generator = torch.Generator(device=sample.device).manual_seed(seed)
+    for i, model_output in enumerate(outputs):
+        sample = static_step(i, model_output, sample, generator=generator)
+    return sample
+
+
+def count_graph_breaks(static_step, sample, outputs):
+    # explain traces each update function on the arguments the static step would pass it
+    breaks = {}
+    sigmas, omega = static_step.sigmas, static_step.omega
+    model_output = outputs[0]
+    if static_step.scheduler_type == "heun":
+        state = torch.zeros_like(sample, dtype=torch.float32)
+        calls = {
+            "heun_first_order_update": (static_step.updates[0], (model_output, sample, sigmas[0], sigmas[1], omega)),
+            "heun_second_order_update": (
+                static_step.updates[1], (model_output, sample, sigmas[1], state, sigmas[1] - sigmas[0], state, omega)
+            ),
+        }
+    elif static_step.scheduler_type == "pingpong":
+        calls = {"pingpong_update": (static_step.updates[0], (model_output, sample, sigmas[0], sigmas[1], static_step.noise))}
+    else:
+        calls = {"euler_update": (static_step.updates[0], (model_output, sample, sigmas[0], sigmas[1], omega))}
+    for name, (fn, args) in calls.items():
+        explanation = torch._dynamo.explain(fn)(*args)
+        breaks[name] = (explanation.graph_count, explanation.graph_break_count, explanation.break_reasons)
+    return breaks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schedulers", type=str, nargs="+", default=list(SCHEDULERS), choices=list(SCHEDULERS))
+    parser.add_argument("--durations", type=float, nargs="+", default=[30.0, 60.0])
+    parser.add_argument("--infer_step", type=int, default=60)
+    parser.add_argument("--omega_scale", type=float, default=10.0)
+    parser.add_argument("--mode", type=str, default=None, help="torch.compile mode, e.g. reduce-overhead on cuda")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+    omega = rescale_omega(args.omega_scale)
+    seed = 42
+
+    with torch.no_grad():
+        for scheduler_type in args.schedulers:
+            print(f"{scheduler_type}:")
+            for duration in args.durations:
+                frames = int(duration * LATENT_FRAMES_PER_SECOND)
+                scheduler = make_scheduler(scheduler_type, args.infer_step, device)
+                num_steps = len(scheduler.timesteps)
+                sample = torch.randn((1, 8, 16, frames), device=device, dtype=dtype)
+                outputs = model_outputs(num_steps, frames, device, dtype)
+
+                reference = run_reference(scheduler_type, args.infer_step, sample, outputs, args.omega_scale, seed)
+                eager = StaticSchedulerStep(scheduler_type, scheduler, omega, sample)
+                error = (run_static(eager, sample, outputs, seed).float() - reference.float()).abs().max().item()
+
+                torch._dynamo.reset()
+                breaks = count_graph_breaks(eager, sample, outputs)
+                torch._dynamo.reset()
+                torch._dynamo.utils.counters.clear()
+                compiled = StaticSchedulerStep(scheduler_type, scheduler, omega, sample, compile=True, compile_mode=args.mode)
+                compiled_error = (run_static(compiled, sample, outputs, seed).float() - reference.float()).abs().max().item()
+                graphs = torch._dynamo.utils.counters["stats"]["unique_graphs"]
+                recompiles = graphs - len(compiled.updates)
+
+                timings = {}
+                for name, run in (
+                    ("scheduler.step", lambda: run_reference(scheduler_type, args.infer_step, sample, outputs, args.omega_scale, seed)),
+                    ("static eager", lambda: run_static(eager, sample, outputs, seed)),
+                    ("static compiled", lambda: run_static(compiled, sample, outputs, seed)),
+                ):
+                    run()
+                    runs = sorted(timed(run) for _ in range(args.runs))
+                    timings[name] = runs[len(runs) // 2] / num_steps
+
+                print(f"  {duration:5.0f}s ({frames:>4} frames, {num_steps} steps)")
+                print(f"    max abs difference to scheduler.step: eager {error:.2e}, compiled {compiled_error:.2e}")
+                for name, (graph_count, graph_break_count, reasons) in breaks.items():
+                    print(f"    {name}: {graph_count} graph(s), {graph_break_count} graph break(s)")
+                    for reason in reasons:
+                        print(f"      {reason.reason}")
+                print(f"    compiled graphs {graphs}, recompiles within the run {recompiles}")
+                print("    " + "  ".join(f"{name} {seconds * 1e6:8.1f}us/step" for name, seconds in timings.items()))
+
+
+if __name__ == "__main__":
+    main()
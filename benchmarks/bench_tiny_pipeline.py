@@ -0,0 +1,151 @@
+"""
+Per-stage CPU timings of the whole pipeline on tiny random models, for tracking regressions without checkpoints.
+
+Runs every task (text2music, repaint, extend, edit, audio2audio) at several durations through
+`ACEStepPipeline.__call__` with `instrument=True` and reports the median wall time of every stage of
+`ace_step.instrumentation`. With `--baseline` the result is compared against a JSON baseline and the script fails
+when a stage got slower than `--threshold` (relative), `--update_baseline` writes the baseline instead.
+
+    python benchmarks/bench_tiny_pipeline.py --baseline benchmarks/tiny_baseline.json --update_baseline
+    python benchmarks/bench_tiny_pipeline.py --baseline benchmarks/tiny_baseline.json --threshold 0.25
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ace_step.pipeline_ace_step import ACEStepPipeline
+from tiny_models import build_tiny_models
+
+TASKS = ["text2music", "repaint", "extend", "edit", "audio2audio"]
+
+PROMPT = "pop, piano, female vocals"
+LYRICS = "[verse]\nhello world\nthe night is young\n[chorus]\nsing along"
+
+
+def source_audio(duration, sample_rate=44100):
+    # a stereo chord, what the DCAE encodes does not matter for timing but silence is a degenerate input
+    t = torch.arange(int(duration * sample_rate)) / sample_rate
+    wave = sum(torch.sin(2 * math.pi * f * t) for f in (220.0, 277.2, 329.6)) / 3
+    return torch.stack([wave, wave * 0.8]), sample_rate
+
+
+def task_kwargs(task, duration, infer_step):
+    kwargs = dict(
+        prompt=PROMPT,
+        lyrics=LYRICS,
+        audio_duration=duration,
+        infer_step=infer_step,
+        manual_seeds=[42],
+        retake_seeds=[42],
+        task=task,
+    )
+    if task == "repaint":
+        kwargs.update(src_audio=source_audio(duration), repaint_start=0, repaint_end=duration / 2, retake_variance=0.5)
+    elif task == "extend":
+        kwargs.update(src_audio=source_audio(duration), repaint_start=-2, repaint_end=duration + 2, retake_variance=1.0)
+    elif task == "edit":
+        kwargs.update(
+            src_audio=source_audio(duration),
+            edit_target_prompt="rock, electric guitar, male vocals",
+            edit_target_lyrics=LYRICS,
+            edit_n_min=0.6,
+        )
+    elif task == "audio2audio":
+        kwargs.update(audio2audio_enable=True, ref_audio_input=source_audio(duration), ref_audio_strength=0.5)
+    return kwargs
+
+
+def run_case(pipeline, task, duration, infer_step, runs):
+    kwargs = task_kwargs(task, duration, infer_step)
+    # warm up, the later runs hit the latent / text embedding caches the way repeated node runs do
+    pipeline(instrument=True, **kwargs)
+    reports = []
+    for _ in range(runs):
+        pipeline(instrument=True, **kwargs)
+        reports.append(pipeline.last_report["stages"])
+
+    stages = {}
+    for name in reports[0]:
+        timings = sorted(report[name]["wall_time"] for report in reports if name in report)
+        stages[name] = {
+            "calls": reports[0][name]["calls"],
+            "wall_time": timings[len(timings) // 2],
+        }
+    return stages
+
+
+def compare(results, baseline, threshold, min_time):
+    regressions = []
+    for case, stages in results.items():
+        for name, entry in stages.items():
+            reference = baseline.get("cases", {}).get(case, {}).get(name)
+            if reference is None or reference["wall_time"] < min_time:
+                continue
+            ratio = entry["wall_time"] / reference["wall_time"]
+            if ratio > 1 + threshold:
+                regressions.append((case, name, reference["wall_time"], entry["wall_time"], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=str, nargs="+", default=TASKS, choices=TASKS)
+    parser.add_argument("--durations", type=float, nargs="+", default=[10.0, 30.0, 60.0])
+    parser.add_argument("--infer_step", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=4, help="torch CPU threads, fixed so timings are comparable")
+    parser.add_argument("--baseline", type=str, default=None)
+    parser.add_argument("--update_baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown per stage")
+    parser.add_argument("--min_time", type=float, default=0.005, help="stages faster than this (s) are not compared")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    device = torch.device("cpu")
+    pipeline = ACEStepPipeline(*build_tiny_models(), device, torch.float32)
+
+    results = {}
+    for task in args.tasks:
+        for duration in args.durations:
+            case = f"{task}@{duration:g}s"
+            results[case] = run_case(pipeline, task, duration, args.infer_step, args.runs)
+            print(f"{case}:")
+            for name, entry in results[case].items():
+                print(f"  {name:<24} {entry['wall_time'] * 1000:9.1f}ms  ({entry['calls']} calls)")
+
+    if not args.baseline:
+        return
+    if args.update_baseline:
+        baseline = {
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+            "threads": args.threads,
+            "infer_step": args.infer_step,
+            "cases": results,
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("infer_step") != args.infer_step or baseline.get("threads") != args.threads:
+        print("WARNING: baseline was recorded with different --infer_step / --threads")
+    regressions = compare(results, baseline, args.threshold, args.min_time)
+    for case, name, before, after, ratio in regressions:
+        print(f"REGRESSION {case} {name}: {before * 1000:.1f}ms -> {after * 1000:.1f}ms ({ratio:.2f}x)")
+    if regressions:
+        sys.exit(1)
+    print(f"no stage slower than {1 + args.threshold:.2f}x the baseline")
+
+
+if __name__ == "__main__":
+    main()
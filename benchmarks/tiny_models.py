@@ -0,0 +1,127 @@
+"""
+Randomly initialized, scaled-down ACE-Step models for benchmarks that must run on CPU without checkpoints.
+
+Widths are cut down, everything that fixes a shape or a code path keeps the value of the released `config.json`
+files: 8 latent channels, patch size [16, 1], a 16 x 8 mel to latent compression of 2 channel, 128 bin mels at
+44100 / 512 frames per second (so 44100 / 512 / 8 latent frames per second), a vocoder that upsamples by 512, the
+transformer / lyric encoder / UMT5 depths the ERG layer ranges point into, and the lyric vocabulary.
+"""
+import os
+import tempfile
+
+import torch
+from diffusers import AutoencoderDC
+from transformers import UMT5Config, UMT5EncoderModel
+
+from ace_step.music_dcae.music_dcae_pipeline import MusicDCAE
+from ace_step.music_dcae.music_vocoder import ADaMoSHiFiGANV1
+from ace_step.ace_models.ace_step_transformer import ACEStepTransformer2DModel
+
+
+TEXT_EMBEDDING_DIM = 32
+
+TRANSFORMER_CONFIG = dict(
+    in_channels=8,
+    out_channels=8,
+    num_layers=24,
+    num_attention_heads=2,
+    attention_head_dim=32,
+    mlp_ratio=2.0,
+    speaker_embedding_dim=512,
+    text_embedding_dim=TEXT_EMBEDDING_DIM,
+    ssl_encoder_depths=[2, 2],
+    ssl_latent_dims=[32, 32],
+    lyric_encoder_vocab_size=6693,
+    lyric_hidden_size=32,
+    lyric_encoder_attention_heads=2,
+    lyric_encoder_linear_units=64,
+    lyric_encoder_num_blocks=6,
+    patch_size=[16, 1],
+    max_height=16,
+    max_width=4096,
+)
+
+DCAE_CONFIG = dict(
+    in_channels=2,
+    latent_channels=8,
+    attention_head_dim=8,
+    encoder_block_types=["ResBlock", "ResBlock", "EfficientViTBlock", "EfficientViTBlock"],
+    decoder_block_types=["ResBlock", "ResBlock", "EfficientViTBlock", "EfficientViTBlock"],
+    encoder_block_out_channels=[8, 16, 32, 64],
+    decoder_block_out_channels=[8, 16, 32, 64],
+    encoder_layers_per_block=[1, 1, 1, 1],
+    decoder_layers_per_block=[1, 1, 1, 1],
+    encoder_qkv_multiscales=[[], [], [5], [5]],
+    decoder_qkv_multiscales=[[], [], [5], [5]],
+    upsample_block_type="interpolate",
+    downsample_block_type="Conv",
+    decoder_norm_types="rms_norm",
+    decoder_act_fns="silu",
+    scaling_factor=0.41407,
+)
+
+VOCODER_CONFIG = dict(
+    input_channels=128,
+    depths=[1, 1, 1, 1],
+    dims=[16, 32, 32, 32],
+    num_mels=32,
+    # 7 upsampling layers halve the channels 7 times, 128 is the smallest width that keeps one channel
+    upsample_initial_channel=128,
+    upsample_rates=(4, 4, 2, 2, 2, 2, 2),
+    upsample_kernel_sizes=(8, 8, 4, 4, 4, 4, 4),
+    sampling_rate=44100,
+    hop_length=512,
+    n_mels=128,
+)
+
+UMT5_CONFIG = dict(
+    vocab_size=384,
+    d_model=TEXT_EMBEDDING_DIM,
+    d_kv=16,
+    d_ff=64,
+    num_layers=12,
+    num_heads=2,
+)
+
+
+class ByteTokenizer:
+    """Stand-in for the UMT5 tokenizer: one id per UTF-8 byte, enough to drive the text encoder."""
+
+    pad_token_id = 0
+
+    def __call__(self, texts, return_tensors="pt", padding=True, truncation=True, max_length=256):
+        ids = [[b + 1 for b in text.encode("utf-8")] or [self.pad_token_id] for text in texts]
+        if truncation:
+            ids = [row[:max_length] for row in ids]
+        length = max(len(row) for row in ids)
+        input_ids = torch.full((len(ids), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(ids), length), dtype=torch.long)
+        for i, row in enumerate(ids):
+            input_ids[i, :len(row)] = torch.tensor(row)
+            attention_mask[i, :len(row)] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+def build_music_dcae(checkpoint_dir):
+    # MusicDCAE only loads its parts from disk, the random ones are written to checkpoint_dir first
+    dcae_path = os.path.join(checkpoint_dir, "music_dcae_f8c8")
+    vocoder_path = os.path.join(checkpoint_dir, "music_vocoder")
+    AutoencoderDC(**DCAE_CONFIG).save_pretrained(dcae_path)
+    ADaMoSHiFiGANV1(**VOCODER_CONFIG).save_pretrained(vocoder_path)
+    return MusicDCAE(dcae_checkpoint_path=dcae_path, vocoder_checkpoint_path=vocoder_path)
+
+
+def build_tiny_models(seed=0, checkpoint_dir=None):
+    """
+    Returns `(music_dcae, ace_step_transformer, text_encoder_model, text_tokenizer)`, the positional arguments of
+    `ACEStepPipeline`. The DCAE / vocoder weights go through `checkpoint_dir`, a temporary directory when None.
+    """
+    torch.manual_seed(seed)
+    if checkpoint_dir is None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            music_dcae = build_music_dcae(tmp_dir)
+    else:
+        music_dcae = build_music_dcae(checkpoint_dir)
+    ace_step_transformer = ACEStepTransformer2DModel(**TRANSFORMER_CONFIG)
+    text_encoder_model = UMT5EncoderModel(UMT5Config(**UMT5_CONFIG))
+    return music_dcae.eval(), ace_step_transformer.eval(), text_encoder_model.eval(), ByteTokenizer()
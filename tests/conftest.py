@@ -0,0 +1,63 @@
+"""
+Tests run on CPU against the randomly initialized tiny models of `benchmarks/tiny_models.py`, no checkpoints needed.
+"""
+import contextlib
+import os
+import sys
+
+import pytest
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from tiny_models import TEXT_EMBEDDING_DIM, TRANSFORMER_CONFIG, build_tiny_models
+
+
+@pytest.fixture(scope="session")
+def tiny_models():
+    return build_tiny_models()
+
+
+@pytest.fixture
+def tiny_pipeline(tiny_models):
+    from ace_step.pipeline_ace_step import ACEStepPipeline
+
+    return ACEStepPipeline(*tiny_models, torch.device("cpu"), torch.float32)
+
+
+def diffusion_inputs(text_length=12, lyric_length=24, seed=0):
+    """Random prompt embeddings and lyric tokens in the layout `text2music_diffusion_process` takes them."""
+    generator = torch.Generator().manual_seed(seed)
+    return dict(
+        encoder_text_hidden_states=torch.randn(1, text_length, TEXT_EMBEDDING_DIM, generator=generator),
+        text_attention_mask=torch.ones(1, text_length),
+        speaker_embds=torch.zeros(1, TRANSFORMER_CONFIG["speaker_embedding_dim"]),
+        lyric_token_ids=torch.randint(1, 1000, (1, lyric_length), generator=generator),
+        lyric_mask=torch.ones(1, lyric_length, dtype=torch.long),
+    )
+
+
+def generators(seed=42):
+    return [torch.Generator().manual_seed(seed)]
+
+
+@contextlib.contextmanager
+def temperature_hooks(modules, tau=0.01):
+    """The forward hooks ERG used before `AttentionTemperature`: the output of each of `modules` is scaled by `tau`."""
+
+    def hook(module, input, output):
+        output[:] *= tau
+        return output
+
+    handles = [module.register_forward_hook(hook) for module in modules]
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+def lyric_query_layers(transformer, l_min=4, l_max=6):
+    return [transformer.lyric_encoder.encoders[i].self_attn.linear_q for i in range(l_min, l_max)]
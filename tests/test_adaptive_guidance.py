@@ -0,0 +1,60 @@
+import pytest
+import torch
+
+from ace_step.apg_guidance import AdaptiveGuidanceTruncation
+
+from conftest import diffusion_inputs, generators
+
+INFER_STEPS = 6
+
+
+def test_truncates_after_patience_consecutive_agreeing_steps():
+    truncation = AdaptiveGuidanceTruncation(tolerance=0.01, patience=3)
+    pred_cond = torch.randn(2, 8, 16, 10)
+    # agree, agree, disagree, then agree from step 3 on: the streak restarts and reaches 3 at step 5
+    for step, agrees in enumerate([True, True, False, True, True, True, True]):
+        value = truncation.update(step, pred_cond, pred_cond if agrees else -pred_cond)
+        assert value.ndim == 0
+        if truncation.truncated:
+            break
+    assert truncation.truncated_at == 5
+
+
+def decode_calls_per_step(pipeline, monkeypatch, **kwargs):
+    calls = {}
+    transformer = pipeline.ace_step_transformer
+    decode = transformer.decode
+
+    def counting_decode(*args, timestep, **decode_kwargs):
+        calls[float(timestep[0])] = calls.get(float(timestep[0]), 0) + 1
+        return decode(*args, timestep=timestep, **decode_kwargs)
+
+    monkeypatch.setattr(transformer, "decode", counting_decode)
+    with torch.no_grad():
+        pipeline.text2music_diffusion_process(
+            duration=3.0,
+            random_generators=generators(),
+            infer_steps=INFER_STEPS,
+            guidance_interval=1.0,
+            **kwargs,
+            **diffusion_inputs(),
+        )
+    return [calls[t] for t in sorted(calls, reverse=True)]
+
+
+@pytest.mark.parametrize("cfg_type", ["apg", "cfg", "cfg_star"])
+def test_truncated_steps_run_the_conditional_pass_only(tiny_pipeline, monkeypatch, cfg_type):
+    # every cosine is >= 1 - 2, so the streak reaches patience on the second guided step
+    calls = decode_calls_per_step(
+        tiny_pipeline, monkeypatch, cfg_type=cfg_type, adaptive_guidance_tolerance=2.0, adaptive_guidance_patience=2
+    )
+    assert calls == [2, 2] + [1] * (INFER_STEPS - 2)
+
+
+@pytest.mark.parametrize("cfg_type", ["apg", "cfg", "cfg_star"])
+def test_disagreeing_steps_keep_guidance(tiny_pipeline, monkeypatch, cfg_type):
+    calls = decode_calls_per_step(
+        tiny_pipeline, monkeypatch, cfg_type=cfg_type, adaptive_guidance_tolerance=1e-9,
+        adaptive_guidance_metric="norm", adaptive_guidance_patience=2,
+    )
+    assert calls == [2] * INFER_STEPS
@@ -0,0 +1,79 @@
+import pytest
+import torch
+
+from ace_step.ace_models.customer_attention_processor import AttentionTemperature
+
+from conftest import diffusion_inputs, lyric_query_layers, temperature_hooks
+
+TAU = 0.01
+
+
+def diffusion_query_layers(transformer, l_min=15, l_max=20):
+    blocks = transformer.transformer_blocks[l_min:l_max]
+    return [block.attn.to_q for block in blocks] + [block.cross_attn.to_q for block in blocks]
+
+
+def decode_inputs(transformer, frames=40):
+    inputs = diffusion_inputs()
+    with torch.no_grad():
+        encoder_hidden_states, encoder_hidden_mask = transformer.encode(
+            inputs["encoder_text_hidden_states"], inputs["text_attention_mask"], inputs["speaker_embds"],
+            inputs["lyric_token_ids"], inputs["lyric_mask"],
+        )
+    # two rows: cond states, then the same states as the branch ERG weakens
+    return dict(
+        hidden_states=torch.randn(2, 8, 16, frames, generator=torch.Generator().manual_seed(3)),
+        attention_mask=torch.ones(2, frames),
+        encoder_hidden_states=torch.cat([encoder_hidden_states] * 2),
+        encoder_hidden_mask=torch.cat([encoder_hidden_mask] * 2),
+        timestep=torch.full((2,), 500.0),
+        output_length=frames,
+    )
+
+
+def rows(inputs, index):
+    return {name: value[index] if torch.is_tensor(value) else value for name, value in inputs.items()}
+
+
+def test_decode_temperature_matches_query_hooks(tiny_models):
+    transformer = tiny_models[1]
+    inputs = decode_inputs(transformer)
+    with torch.no_grad():
+        with temperature_hooks(diffusion_query_layers(transformer), TAU):
+            hooked = transformer.decode(**inputs).sample
+        native = transformer.decode(**inputs, attn_temperature=AttentionTemperature(TAU, 15, 20)).sample
+    assert torch.allclose(native, hooked, rtol=1e-4, atol=1e-5)
+
+
+def test_decode_temperature_on_a_batch_slice_matches_separate_calls(tiny_models):
+    # batched guidance: only the last row is weakened, the first one runs as without ERG
+    transformer = tiny_models[1]
+    inputs = decode_inputs(transformer)
+    with torch.no_grad():
+        cond = transformer.decode(**rows(inputs, slice(0, 1))).sample
+        with temperature_hooks(diffusion_query_layers(transformer), TAU):
+            weak = transformer.decode(**rows(inputs, slice(1, 2))).sample
+        native = transformer.decode(
+            **inputs, attn_temperature=AttentionTemperature(TAU, 15, 20, rows=slice(1, None))
+        ).sample
+    assert torch.allclose(native, torch.cat([cond, weak]), rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("weak_rows", [slice(None), slice(1, None)])
+def test_lyric_encoder_temperature_matches_query_hooks(tiny_models, weak_rows):
+    transformer = tiny_models[1]
+    inputs = [diffusion_inputs(seed=0), diffusion_inputs(seed=1)]
+    lyric_token_idx = torch.cat([row["lyric_token_ids"] for row in inputs])
+    lyric_mask = torch.cat([row["lyric_mask"] for row in inputs])
+    with torch.no_grad():
+        plain = transformer.forward_lyric_encoder(lyric_token_idx=lyric_token_idx, lyric_mask=lyric_mask)
+        with temperature_hooks(lyric_query_layers(transformer), TAU):
+            hooked = transformer.forward_lyric_encoder(lyric_token_idx=lyric_token_idx, lyric_mask=lyric_mask)
+        native = transformer.forward_lyric_encoder(
+            lyric_token_idx=lyric_token_idx,
+            lyric_mask=lyric_mask,
+            attn_temperature=AttentionTemperature(TAU, 4, 6, rows=weak_rows),
+        )
+    expected = plain.clone()
+    expected[weak_rows] = hooked[weak_rows]
+    assert torch.allclose(native, expected, rtol=1e-4, atol=1e-5)
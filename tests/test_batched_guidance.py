@@ -0,0 +1,31 @@
+import pytest
+import torch
+
+from conftest import diffusion_inputs, generators
+
+
+@pytest.mark.parametrize(
+    "guidance",
+    [
+        dict(cfg_type="apg"),
+        dict(cfg_type="cfg"),
+        dict(cfg_type="cfg_star"),
+        # cond / text only / uncond
+        dict(guidance_scale_text=5.0, guidance_scale_lyric=1.5),
+        dict(cfg_type="apg", use_erg_diffusion=True),
+    ],
+)
+def test_batched_guidance_matches_sequential(tiny_pipeline, guidance):
+    outputs = {}
+    with torch.no_grad():
+        for batched_guidance in (False, True):
+            outputs[batched_guidance] = tiny_pipeline.text2music_diffusion_process(
+                duration=3.0,
+                random_generators=generators(),
+                infer_steps=6,
+                guidance_interval=1.0,
+                batched_guidance=batched_guidance,
+                **guidance,
+                **diffusion_inputs(),
+            )
+    assert torch.allclose(outputs[True], outputs[False], rtol=1e-4, atol=1e-5)
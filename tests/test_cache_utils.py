@@ -0,0 +1,39 @@
+import os
+
+import torch
+
+from ace_step.cache_utils import LatentCache
+
+
+def latents(value, frames=64):
+    return torch.full((1, 8, 16, frames), float(value))
+
+
+def test_latent_disk_tier_is_bounded(tmp_path):
+    entry_bytes = latents(0).numel() * 4
+    cache = LatentCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=int(2.5 * entry_bytes))
+    for i in range(5):
+        cache.put(f"key{i}", latents(i))
+        # distinct modification times on coarse grained file systems
+        os.utime(cache._disk_path(f"key{i}"), ns=(i * 10**9, i * 10**9))
+    cache._evict_disk()
+
+    assert cache.disk_stats()["entries"] == 2
+    assert cache.disk_stats()["bytes"] <= cache.disk_max_bytes
+    assert not os.path.exists(cache._disk_path("key0"))
+    assert torch.equal(cache.get("key4", torch.device("cpu")), latents(4))
+
+
+def test_latent_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = LatentCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_entries=2)
+    cache.put("a", latents(1))
+    cache.put("b", latents(2))
+    os.utime(cache._disk_path("a"), ns=(10**9, 10**9))
+    os.utime(cache._disk_path("b"), ns=(2 * 10**9, 2 * 10**9))
+    # reading "a" makes "b" the least recently used file
+    assert cache.get("a", torch.device("cpu")) is not None
+    cache.put("c", latents(3))
+
+    assert os.path.exists(cache._disk_path("a"))
+    assert not os.path.exists(cache._disk_path("b"))
+    assert os.path.exists(cache._disk_path("c"))
@@ -0,0 +1,88 @@
+import pytest
+import torch
+
+from conftest import diffusion_inputs, lyric_query_layers, temperature_hooks
+
+
+def batch(*inputs):
+    return {name: torch.cat([row[name] for row in inputs], dim=0) for name in inputs[0]}
+
+
+def reference_branches(pipeline, inputs, use_erg_lyric, do_double_condition_guidance, null_text, neg_text):
+    # the separate `encode` calls of each branch, ERG through forward hooks on the lyric encoder's queries
+    transformer = pipeline.ace_step_transformer
+    text, text_mask, speaker = inputs["encoder_text_hidden_states"], inputs["text_attention_mask"], inputs["speaker_embds"]
+    lyrics, lyric_mask = inputs["lyric_token_ids"], inputs["lyric_mask"]
+    zero_speaker = torch.zeros_like(speaker)
+
+    def weak_encode(*args):
+        with temperature_hooks(lyric_query_layers(transformer)):
+            return transformer.encode(*args)[0]
+
+    encoder_hidden_states, encoder_hidden_mask = transformer.encode(text, text_mask, speaker, lyrics, lyric_mask)
+    if use_erg_lyric:
+        null_text = null_text if null_text is not None else torch.zeros_like(text)
+        encoder_hidden_states_null = weak_encode(null_text, text_mask, zero_speaker, lyrics, lyric_mask)
+    else:
+        null_text = neg_text if neg_text is not None else torch.zeros_like(text)
+        encoder_hidden_states_null = transformer.encode(
+            null_text, text_mask, zero_speaker, torch.zeros_like(lyrics), lyric_mask
+        )[0]
+    encoder_hidden_states_no_lyric = None
+    if do_double_condition_guidance:
+        if use_erg_lyric:
+            encoder_hidden_states_no_lyric = weak_encode(text, text_mask, zero_speaker, lyrics, lyric_mask)
+        else:
+            encoder_hidden_states_no_lyric = transformer.encode(
+                text, text_mask, zero_speaker, torch.zeros_like(lyrics), lyric_mask
+            )[0]
+    return encoder_hidden_states, encoder_hidden_mask, encoder_hidden_states_null, encoder_hidden_states_no_lyric
+
+
+@pytest.mark.parametrize("use_erg_lyric", [False, True])
+@pytest.mark.parametrize("do_double_condition_guidance", [False, True])
+@pytest.mark.parametrize(
+    "rows",
+    [
+        "single",
+        # the lyrics are encoded once and broadcast over the batch
+        "same_lyrics",
+        "different_lyrics",
+    ],
+)
+@pytest.mark.parametrize("null_prompt", [None, "given"])
+def test_stacked_encode_matches_separate_encodes(
+    tiny_pipeline, use_erg_lyric, do_double_condition_guidance, rows, null_prompt
+):
+    if rows == "single":
+        inputs = diffusion_inputs(seed=0)
+    elif rows == "same_lyrics":
+        inputs = batch(diffusion_inputs(seed=0), diffusion_inputs(seed=0))
+        inputs["encoder_text_hidden_states"][1].normal_()
+        inputs["speaker_embds"][1].normal_()
+    else:
+        inputs = batch(diffusion_inputs(seed=0), diffusion_inputs(seed=1))
+        inputs["speaker_embds"][1].normal_()
+    # the ERG weakened prompt with ERG, the negative prompt without
+    other_prompt = torch.randn_like(inputs["encoder_text_hidden_states"]) if null_prompt else None
+    null_text = other_prompt if use_erg_lyric else None
+    neg_text = None if use_erg_lyric else other_prompt
+
+    with torch.no_grad():
+        stacked = tiny_pipeline.encode_condition_branches(
+            **inputs,
+            use_erg_lyric=use_erg_lyric,
+            do_double_condition_guidance=do_double_condition_guidance,
+            encoder_text_hidden_states_null=null_text,
+            neg_encoder_text_hidden_states=neg_text,
+        )
+        reference = reference_branches(
+            tiny_pipeline, inputs, use_erg_lyric, do_double_condition_guidance, null_text, neg_text
+        )
+
+    for name, output, expected in zip(["cond", "mask", "null", "no_lyric"], stacked, reference):
+        if expected is None:
+            assert output is None, name
+            continue
+        assert output.shape == expected.shape, name
+        assert torch.allclose(output, expected, rtol=1e-4, atol=1e-5), name
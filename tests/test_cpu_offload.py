@@ -0,0 +1,85 @@
+import torch
+
+from ace_step.cpu_offload import ModelResidencyManager
+from ace_step.pipeline_ace_step import ACEStepPipeline
+
+
+class RecordingManager(ModelResidencyManager):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acquired = []
+        self.released = []
+
+    def acquire(self, model):
+        self.acquired.append(model)
+        return super().acquire(model)
+
+    def release(self, model):
+        self.released.append(model)
+        return super().release(model)
+
+
+def test_residency_accounting_of_a_text2music_run(tiny_models):
+    pipeline = ACEStepPipeline(*tiny_models, torch.device("cpu"), torch.float32, cpu_offload=True)
+    # a zero budget keeps only the model in use on the device
+    manager = pipeline.residency_manager = RecordingManager("cpu", memory_budget=0, accounting_only=True)
+    models = (pipeline.text_encoder_model, pipeline.ace_step_transformer, pipeline.music_dcae)
+
+    pipeline(audio_duration=3.0, prompt="pop, piano", lyrics="", infer_step=2, manual_seeds=[42])
+    assert {id(model) for model in manager.acquired} == {id(model) for model in models}
+    assert len(manager.acquired) == len(manager.released)
+    assert manager.in_use == {} and len(manager.resident) == 0
+    # prompt and ERG prompt share the text encoder's single load, then the transformer and the DCAE
+    assert manager.stats()["transfers_to_device"] == 3
+    assert manager.stats()["transfers_to_host"] == 3
+    assert manager.stats()["bytes_to_device"] == manager.stats()["bytes_to_host"]
+
+    # the prompt embeddings are cached, the text encoder is not needed again
+    manager.reset_stats()
+    manager.acquired.clear()
+    manager.released.clear()
+    pipeline(audio_duration=3.0, prompt="pop, piano", lyrics="", infer_step=2, manual_seeds=[42])
+    assert all(model is not pipeline.text_encoder_model for model in manager.acquired)
+    assert len(manager.acquired) == len(manager.released)
+    assert manager.stats()["transfers_to_device"] == 2
+    assert manager.stats()["transfers_to_host"] == 2
+
+
+def test_residency_manager_loads_models_in_their_dtype(tiny_models):
+    music_dcae = tiny_models[0]
+    manager = ModelResidencyManager("cpu", memory_budget=None)
+    with manager.use(music_dcae):
+        pass
+    music_dcae.to(torch.bfloat16)
+    try:
+        with manager.use(music_dcae):
+            assert music_dcae.dtype == torch.float32
+    finally:
+        music_dcae.to(torch.float32)
+
+
+def test_block_streamer_transfers_each_streamed_block_once_per_forward():
+    from ace_step.cpu_offload import BlockStreamer
+
+    blocks = torch.nn.Sequential(*(torch.nn.Linear(4, 4) for _ in range(4)))
+    block_bytes = sum(t.numel() * t.element_size() for t in blocks[0].parameters())
+    for resident_blocks in (0, 1):
+        streamer = BlockStreamer("cpu", resident_blocks=resident_blocks, accounting_only=True).attach(blocks, [blocks])
+        streamer.reset_stats()
+        streamed = len(blocks) - resident_blocks
+        with torch.no_grad():
+            for _ in range(2):
+                blocks(torch.randn(1, 4))
+                # nothing is left loaded or in flight for the next forward
+                assert streamer.loaded == streamer.permanent
+                assert streamer.pending == {}
+        assert streamer.stats() == {
+            "transfers_to_device": 2 * streamed,
+            "bytes_to_device": 2 * streamed * block_bytes,
+            # every block but the first is prefetched by the one before it
+            "prefetches": 2 * (len(blocks) - 1),
+            "evictions": 2 * streamed,
+            # the resident blocks, the running block and the prefetched one
+            "peak_loaded_blocks": resident_blocks + 2,
+        }
+        streamer.detach()
@@ -0,0 +1,62 @@
+import torch
+
+from ace_step.ace_models.customer_attention_processor import CrossAttnKVCache
+
+from conftest import diffusion_inputs
+
+
+def encoded(transformer, seed):
+    inputs = diffusion_inputs(seed=seed)
+    return transformer.encode(
+        inputs["encoder_text_hidden_states"], inputs["text_attention_mask"], inputs["speaker_embds"],
+        inputs["lyric_token_ids"], inputs["lyric_mask"],
+    )
+
+
+def decode(transformer, encoder_hidden_states, encoder_hidden_mask, timestep, cache=None, frames=40):
+    hidden_states = torch.randn(1, 8, 16, frames, generator=torch.Generator().manual_seed(int(timestep)))
+    return transformer.decode(
+        hidden_states=hidden_states,
+        attention_mask=torch.ones(1, frames),
+        encoder_hidden_states=encoder_hidden_states,
+        encoder_hidden_mask=encoder_hidden_mask,
+        timestep=torch.tensor([timestep]),
+        output_length=frames,
+        cross_attn_kv_cache=cache,
+    ).sample
+
+
+def test_cached_steps_match_uncached(tiny_models):
+    transformer = tiny_models[1]
+    cache = CrossAttnKVCache()
+    with torch.no_grad():
+        encoder_hidden_states, encoder_hidden_mask = encoded(transformer, seed=0)
+        for timestep in (900.0, 500.0, 100.0):
+            cached = decode(transformer, encoder_hidden_states, encoder_hidden_mask, timestep, cache)
+            assert len(cache) == len(transformer.transformer_blocks)
+            uncached = decode(transformer, encoder_hidden_states, encoder_hidden_mask, timestep)
+            assert torch.allclose(cached, uncached, rtol=1e-5, atol=1e-6)
+
+
+def test_new_encoder_states_invalidate_the_cache(tiny_models):
+    transformer = tiny_models[1]
+    cache = CrossAttnKVCache()
+    with torch.no_grad():
+        first_states, first_mask = encoded(transformer, seed=0)
+        decode(transformer, first_states, first_mask, 900.0, cache)
+        entries = dict(cache.entries)
+
+        # the next request: different encoder states, the first request's K/V must not be used
+        second_states, second_mask = encoded(transformer, seed=1)
+        cached = decode(transformer, second_states, second_mask, 500.0, cache)
+        uncached = decode(transformer, second_states, second_mask, 500.0)
+        assert torch.allclose(cached, uncached, rtol=1e-5, atol=1e-6)
+        assert not torch.allclose(cached, decode(transformer, first_states, first_mask, 500.0))
+        assert all(cache.entries[key] is not entries[key] for key in entries)
+
+        # the same states keep the entries, equal values in a new tensor are a new encode and recompute them
+        entries = dict(cache.entries)
+        decode(transformer, second_states, second_mask, 100.0, cache)
+        assert all(cache.entries[key] is entries[key] for key in entries)
+        decode(transformer, second_states.clone(), second_mask, 100.0, cache)
+        assert all(cache.entries[key] is not entries[key] for key in entries)
@@ -0,0 +1,105 @@
+import pytest
+import torch
+from diffusers.pipelines.stable_diffusion_3.pipeline_stable_diffusion_3 import retrieve_timesteps
+from diffusers.utils.torch_utils import randn_tensor
+
+from ace_step.apg_guidance import MomentumBuffer, apg_forward
+from ace_step.schedulers.scheduling_flow_match_euler_discrete import FlowMatchEulerDiscreteScheduler
+
+from conftest import diffusion_inputs, generators
+
+
+def flowedit_inputs():
+    source = diffusion_inputs(text_length=12, lyric_length=24, seed=0)
+    # the target prompt is shorter and the lyrics longer, so their encoder states are padded to be stacked
+    target = diffusion_inputs(text_length=9, lyric_length=30, seed=1)
+    inputs = dict(source)
+    inputs.update({
+        "target_encoder_text_hidden_states": target["encoder_text_hidden_states"],
+        "target_text_attention_mask": target["text_attention_mask"],
+        "target_speaker_embeds": target["speaker_embds"],
+        "target_lyric_token_ids": target["lyric_token_ids"],
+        "target_lyric_mask": target["lyric_mask"],
+        "src_latents": torch.randn(1, 8, 16, 40, generator=torch.Generator().manual_seed(2)),
+    })
+    return inputs
+
+
+def with_uncond(tensor):
+    return torch.cat([tensor, torch.zeros_like(tensor)], 0)
+
+
+def velocity(transformer, latents, t, text, text_mask, speaker, lyrics, lyric_mask, guidance_scale, momentum_buffer):
+    # one full forward of a branch, cond and uncond rows, as the per-sample loop ran it
+    latent_model_input = torch.cat([latents, latents])
+    noise_pred = transformer(
+        hidden_states=latent_model_input,
+        attention_mask=torch.ones(2, latents.shape[-1]),
+        encoder_text_hidden_states=with_uncond(text),
+        text_attention_mask=torch.cat([text_mask] * 2),
+        speaker_embeds=with_uncond(speaker),
+        lyric_token_idx=with_uncond(lyrics),
+        lyric_mask=with_uncond(lyric_mask),
+        timestep=t.expand(2),
+    ).sample
+    cond, uncond = noise_pred.chunk(2)
+    return apg_forward(pred_cond=cond, pred_uncond=uncond, guidance_scale=guidance_scale, momentum_buffer=momentum_buffer)
+
+
+def reference_flowedit(transformer, inputs, random_generators, infer_steps, guidance_scale, n_min, n_max, n_avg):
+    # per noise draw src / tar loop of FlowEdit before its branches were batched, euler only
+    x_src = inputs["src_latents"]
+    source = (
+        inputs["encoder_text_hidden_states"], inputs["text_attention_mask"], inputs["speaker_embds"],
+        inputs["lyric_token_ids"], inputs["lyric_mask"],
+    )
+    target = (
+        inputs["target_encoder_text_hidden_states"], inputs["target_text_attention_mask"],
+        inputs["target_speaker_embeds"], inputs["target_lyric_token_ids"], inputs["target_lyric_mask"],
+    )
+    scheduler = FlowMatchEulerDiscreteScheduler(num_train_timesteps=1000, shift=3.0)
+    timesteps, _ = retrieve_timesteps(scheduler, infer_steps, x_src.device, timesteps=None)
+    momentum_buffer = MomentumBuffer()
+    momentum_buffer_tar = MomentumBuffer()
+    zt_edit = x_src.clone()
+    xt_tar = None
+    n_min = int(infer_steps * n_min)
+    n_max = int(infer_steps * n_max)
+    for i, t in enumerate(timesteps):
+        if i < n_min:
+            continue
+        t_i = t / 1000
+        t_im1 = timesteps[i + 1] / 1000 if i + 1 < len(timesteps) else torch.zeros_like(t_i)
+        if i < n_max:
+            V_delta_avg = torch.zeros_like(x_src)
+            for _ in range(n_avg):
+                fwd_noise = randn_tensor(shape=x_src.shape, generator=random_generators, device=x_src.device, dtype=x_src.dtype)
+                zt_src = (1 - t_i) * x_src + t_i * fwd_noise
+                zt_tar = zt_edit + zt_src - x_src
+                Vt_src = velocity(transformer, zt_src, t, *source, guidance_scale, momentum_buffer)
+                Vt_tar = velocity(transformer, zt_tar, t, *target, guidance_scale, None)
+                V_delta_avg += (1 / n_avg) * (Vt_tar - Vt_src)
+            zt_edit = (zt_edit.to(torch.float32) + (t_im1 - t_i) * V_delta_avg).to(V_delta_avg.dtype)
+        else:
+            if i == n_max:
+                fwd_noise = randn_tensor(shape=x_src.shape, generator=random_generators, device=x_src.device, dtype=x_src.dtype)
+                scheduler._init_step_index(t)
+                sigma = scheduler.sigmas[scheduler.step_index]
+                xt_src = sigma * fwd_noise + (1.0 - sigma) * x_src
+                xt_tar = zt_edit + xt_src - x_src
+            Vt_tar = velocity(transformer, xt_tar, t, *target, guidance_scale, momentum_buffer_tar)
+            xt_tar = (xt_tar.to(torch.float32) + (t_im1 - t_i) * Vt_tar).to(Vt_tar.dtype)
+    return zt_edit if xt_tar is None else xt_tar
+
+
+@pytest.mark.parametrize("n_avg, micro_batch_size", [(1, None), (2, None), (3, 3), (2, 1)])
+def test_batched_flowedit_matches_per_sample_loop(tiny_pipeline, n_avg, micro_batch_size):
+    # 4 rows per noise draw (src / tar x cond / uncond), micro-batches of 3 split draws and branches
+    settings = dict(infer_steps=6, guidance_scale=15.0, n_min=0.2, n_max=0.7, n_avg=n_avg)
+    inputs = flowedit_inputs()
+    with torch.no_grad():
+        batched = tiny_pipeline.flowedit_diffusion_process(
+            random_generators=generators(), micro_batch_size=micro_batch_size, **settings, **inputs
+        )
+        reference = reference_flowedit(tiny_pipeline.ace_step_transformer, inputs, generators(), **settings)
+    assert torch.allclose(batched, reference, rtol=1e-4, atol=1e-5)
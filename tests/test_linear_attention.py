@@ -0,0 +1,35 @@
+import pytest
+import torch
+
+from ace_step.ace_models.customer_attention_processor import CustomLiteLAProcessor2_0
+from bench_linear_attention import reference_linear_attention
+
+TOLERANCES = {torch.float32: dict(rtol=1e-4, atol=1e-5), torch.bfloat16: dict(rtol=1e-2, atol=1e-2)}
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16])
+@pytest.mark.parametrize("chunk_size", [None, 1, 64, 128, 256, 1024])
+def test_chunked_linear_attention_matches_padded_formula(dtype, chunk_size):
+    # 300 positions: not a multiple of any chunk size above but 1
+    generator = torch.Generator().manual_seed(0)
+    query = torch.relu(torch.randn(2, 4, 32, 300, generator=generator)).to(dtype)
+    key = torch.relu(torch.randn(2, 4, 300, 32, generator=generator)).to(dtype)
+    value = torch.randn(2, 4, 32, 300, generator=generator).to(dtype)
+    processor = CustomLiteLAProcessor2_0(chunk_size=chunk_size)
+
+    hidden_states = processor.linear_attention(query, key, value)
+    reference = reference_linear_attention(query, key, value, eps=processor.eps).to(dtype)
+    assert hidden_states.dtype == dtype
+    assert hidden_states.shape == query.shape
+    torch.testing.assert_close(hidden_states, reference, **TOLERANCES[dtype])
+
+
+def test_cross_attention_length_differs_from_query_length():
+    generator = torch.Generator().manual_seed(1)
+    query = torch.relu(torch.randn(1, 2, 16, 100, generator=generator))
+    key = torch.relu(torch.randn(1, 2, 37, 16, generator=generator))
+    value = torch.randn(1, 2, 16, 37, generator=generator)
+    processor = CustomLiteLAProcessor2_0(chunk_size=8)
+    torch.testing.assert_close(
+        processor.linear_attention(query, key, value), reference_linear_attention(query, key, value), rtol=1e-4, atol=1e-5
+    )
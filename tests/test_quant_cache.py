@@ -0,0 +1,54 @@
+import torch
+
+from ace_step.quant_cache import QuantizedArtifactCache, init_empty_weights, meta_tensors
+
+
+class Model(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(8, 8)
+        # not in the state dict, rebuilt by the constructor
+        self.register_buffer("freqs", torch.arange(8.0), persistent=False)
+
+    def forward(self, x):
+        return self.linear(x) + self.freqs
+
+
+def round_weights(model):
+    # stands in for the quantization, the cached weights must be the transformed ones
+    with torch.no_grad():
+        for param in model.parameters():
+            param.copy_(param.round())
+
+
+def test_empty_weights_are_meta_and_buffers_are_not():
+    with init_empty_weights():
+        model = Model()
+    assert model.linear.weight.is_meta and model.linear.bias.is_meta
+    assert not model.freqs.is_meta
+    assert sorted(meta_tensors(model)) == ["linear.bias", "linear.weight"]
+
+
+def test_hit_builds_an_empty_model_and_assigns_the_artifact(tmp_path):
+    torch.save({}, tmp_path / "model.safetensors")
+    loads = []
+
+    def load_model():
+        loads.append(1)
+        torch.manual_seed(0)
+        model = Model()
+        with torch.no_grad():
+            model.linear.weight.mul_(10)
+        return model
+
+    cold = QuantizedArtifactCache(str(tmp_path), "model_int", {"method": "round"}, torch.float32)
+    cold_model = cold.load_or_quantize(load_model, round_weights, Model, device="cpu")
+    assert not cold.hit and len(loads) == 1
+
+    warm = QuantizedArtifactCache(str(tmp_path), "model_int", {"method": "round"}, torch.float32)
+    warm_model = warm.load_or_quantize(load_model, round_weights, Model, device="cpu")
+    # the full precision model is not loaded again
+    assert warm.hit and len(loads) == 1
+    assert meta_tensors(warm_model) == []
+    x = torch.randn(2, 8)
+    assert torch.equal(warm_model(x), cold_model(x))
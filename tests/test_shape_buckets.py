@@ -0,0 +1,118 @@
+import pytest
+import torch
+import torch._dynamo
+
+from ace_step.ace_models.customer_attention_processor import make_cross_attention_mask
+from ace_step.pipeline_ace_step import ACEStepPipeline
+from ace_step.shape_buckets import BATCH_SIZES_PER_BUCKET, ShapeBuckets, bucket_combinations, enable_compile_cache
+
+from conftest import build_tiny_models, diffusion_inputs, generators
+
+# one bucket per length, 7s (75 frames), 12 prompt and 24 lyric tokens are all padded
+BUCKETS = dict(frame_bucket_seconds=(10,), text_buckets=(32,), lyric_buckets=(32,))
+
+
+def diffusion(pipeline, duration=7.0, text_length=12, lyric_length=24, **kwargs):
+    with torch.no_grad():
+        return pipeline.text2music_diffusion_process(
+            duration=duration,
+            random_generators=generators(),
+            infer_steps=4,
+            guidance_interval=1.0,
+            **kwargs,
+            **diffusion_inputs(text_length, lyric_length),
+        )
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        dict(scheduler_type="euler"),
+        dict(scheduler_type="heun"),
+        dict(scheduler_type="pingpong"),
+        dict(scheduler_type="euler", batched_guidance=True, use_erg_diffusion=True, use_erg_lyric=True),
+        dict(scheduler_type="euler", guidance_scale_text=5.0, guidance_scale_lyric=1.5),
+    ],
+)
+def test_padded_run_matches_unpadded(tiny_pipeline, kwargs):
+    unpadded = diffusion(tiny_pipeline, **kwargs)
+    tiny_pipeline.shape_buckets = ShapeBuckets(**BUCKETS)
+    padded = diffusion(tiny_pipeline, **kwargs)
+    assert padded.shape == unpadded.shape
+    assert torch.allclose(padded, unpadded, rtol=1e-4, atol=1e-5)
+
+
+def test_cross_attention_mask():
+    attention_mask = torch.tensor([[1.0, 1.0, 0.0]])
+    encoder_attention_mask = torch.tensor([[1.0, 0.0]])
+    mask = make_cross_attention_mask(attention_mask, encoder_attention_mask, 2, torch.float32)
+    # unchanged: masked query rows attend to nothing
+    expected = torch.where(
+        (attention_mask[:, :, None] * encoder_attention_mask[:, None, :]) == 1, 0.0, -torch.inf
+    )[:, None].expand(-1, 2, -1, -1)
+    assert torch.equal(mask, expected)
+
+    padded = make_cross_attention_mask(attention_mask, encoder_attention_mask, 2, torch.float32, padded_queries=True)
+    assert torch.equal(padded[:, :, :2], mask[:, :, :2])
+    # the padded query attends to the valid encoder tokens, its attention stays finite
+    assert torch.equal(padded[0, 0, 2], torch.tensor([0.0, -torch.inf]))
+    query, key = torch.randn(1, 2, 3, 4), torch.randn(1, 2, 2, 4)
+    assert torch.isfinite(torch.nn.functional.scaled_dot_product_attention(query, key, key, attn_mask=padded)).all()
+
+
+def compiled_pipeline():
+    # fresh models, compile_blocks replaces the blocks' forward
+    music_dcae, transformer, text_encoder, tokenizer = build_tiny_models()
+    transformer.compile_blocks(backend="eager")
+    return ACEStepPipeline(
+        music_dcae, transformer, text_encoder, tokenizer, torch.device("cpu"), torch.float32,
+        shape_buckets=ShapeBuckets(**BUCKETS),
+    )
+
+
+def unique_graphs():
+    return torch._dynamo.utils.counters["stats"]["unique_graphs"]
+
+
+def test_requests_in_one_bucket_do_not_recompile():
+    torch._dynamo.reset()
+    torch._dynamo.utils.counters.clear()
+    pipeline = compiled_pipeline()
+    diffusion(pipeline, duration=7.0, text_length=12, lyric_length=24)
+    graphs = unique_graphs()
+    assert graphs > 0
+    diffusion(pipeline, duration=9.0, text_length=20, lyric_length=30)
+    assert unique_graphs() == graphs
+
+
+def test_warmup_compiles_every_token_bucket():
+    torch._dynamo.reset()
+    torch._dynamo.utils.counters.clear()
+    pipeline = compiled_pipeline()
+    pipeline.shape_buckets = ShapeBuckets(frame_bucket_seconds=(10,), text_buckets=(16, 32), lyric_buckets=(16, 32))
+    erg = dict(use_erg_diffusion=True, use_erg_lyric=True)
+    pipeline.warmup([7.0], infer_step=4, guidance_interval=1.0, **erg)
+    graphs = unique_graphs()
+    for text_length, lyric_length in ((12, 24), (20, 10), (30, 30)):
+        diffusion(pipeline, text_length=text_length, lyric_length=lyric_length, **erg)
+    assert unique_graphs() == graphs
+
+
+def test_default_recompile_limit_covers_every_bucket_combination(tmp_path, monkeypatch):
+    import torch._inductor.config
+
+    monkeypatch.delenv("TORCHINDUCTOR_CACHE_DIR", raising=False)
+    monkeypatch.setattr(torch._inductor.config, "fx_graph_cache", torch._inductor.config.fx_graph_cache)
+    names = [name for name in ("recompile_limit", "cache_size_limit") if hasattr(torch._dynamo.config, name)][:1]
+    names += [
+        name for name in ("accumulated_recompile_limit", "accumulated_cache_size_limit")
+        if hasattr(torch._dynamo.config, name)
+    ][:1]
+    for name in names:
+        monkeypatch.setattr(torch._dynamo.config, name, 8)
+
+    enable_compile_cache(str(tmp_path))
+    # 8 frame x 4 text x 6 lyric buckets
+    assert bucket_combinations() == 192
+    for name in names:
+        assert getattr(torch._dynamo.config, name) == BATCH_SIZES_PER_BUCKET * 192
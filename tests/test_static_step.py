@@ -0,0 +1,42 @@
+import pytest
+import torch
+import torch._dynamo
+
+from ace_step.sampling_plan import rescale_omega
+from ace_step.schedulers.static_step import StaticSchedulerStep
+from bench_static_step import count_graph_breaks, make_scheduler, model_outputs, run_reference, run_static
+
+INFER_STEPS = 6
+FRAMES = 32
+SEED = 42
+
+
+def inputs(scheduler_type):
+    scheduler = make_scheduler(scheduler_type, INFER_STEPS, torch.device("cpu"))
+    sample = torch.randn((1, 8, 16, FRAMES), generator=torch.Generator().manual_seed(0))
+    outputs = model_outputs(len(scheduler.timesteps), FRAMES, torch.device("cpu"), torch.float32)
+    reference = run_reference(scheduler_type, INFER_STEPS, sample, outputs, 10.0, SEED)
+    return scheduler, sample, outputs, reference
+
+
+@pytest.mark.parametrize("scheduler_type", ["euler", "heun", "pingpong"])
+def test_static_step_matches_scheduler_step(scheduler_type):
+    scheduler, sample, outputs, reference = inputs(scheduler_type)
+    static_step = StaticSchedulerStep(scheduler_type, scheduler, rescale_omega(10.0), sample)
+    assert torch.allclose(run_static(static_step, sample, outputs, SEED), reference, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("scheduler_type", ["euler", "heun", "pingpong"])
+def test_static_step_compiles_without_graph_breaks(scheduler_type):
+    scheduler, sample, outputs, reference = inputs(scheduler_type)
+    torch._dynamo.reset()
+    eager = StaticSchedulerStep(scheduler_type, scheduler, rescale_omega(10.0), sample)
+    for name, (graph_count, graph_break_count, reasons) in count_graph_breaks(eager, sample, outputs).items():
+        assert graph_count == 1 and graph_break_count == 0, f"{name}: {reasons}"
+
+    torch._dynamo.reset()
+    torch._dynamo.utils.counters.clear()
+    compiled = StaticSchedulerStep(scheduler_type, scheduler, rescale_omega(10.0), sample, compile=True)
+    assert torch.allclose(run_static(compiled, sample, outputs, SEED), reference, rtol=1e-4, atol=1e-5)
+    # one graph per update function, nothing recompiles over the run's steps
+    assert torch._dynamo.utils.counters["stats"]["unique_graphs"] == len(compiled.updates)
@@ -0,0 +1,57 @@
+import torch
+
+from ace_step.ace_models.step_cache import StepCache, StepCacheSchedule
+
+from conftest import diffusion_inputs, generators
+
+
+def run_branch(cache, hidden_states, blocks):
+    if cache.should_reuse(hidden_states):
+        return cache.apply(hidden_states)
+    output = blocks(hidden_states)
+    cache.store(output)
+    return output
+
+
+def test_schedule_decides_once_for_every_branch():
+    schedule = StepCacheSchedule(threshold=1.0, warmup_steps=1)
+    cond, uncond = StepCache(schedule), StepCache(schedule)
+    probe = torch.ones(1, 4, 8)
+    hidden_states = torch.randn(1, 4, 8)
+    num_steps = 5
+    for step in range(num_steps):
+        # a small change every step, always under the threshold
+        schedule.decide(step, num_steps, probe * (1 + 0.01 * step))
+        run_branch(cond, hidden_states, lambda x: 2 * x)
+        # the uncond branch only runs from step 2 on, like a guidance interval
+        if step >= 2:
+            run_branch(uncond, hidden_states, lambda x: 2 * x)
+    # warmup and last step computed, the rest skipped
+    assert cond.stats() == {"computed_steps": 2, "skipped_steps": 3}
+    # its residual is not from the schedule's last computed step (0), so it computes until the last step
+    assert uncond.stats() == {"computed_steps": 3, "skipped_steps": 0}
+
+
+def test_schedule_accumulates_until_the_threshold():
+    schedule = StepCacheSchedule(threshold=0.25, warmup_steps=1)
+    probe = torch.ones(1, 4, 8)
+    decisions = [schedule.decide(step, 10, probe * (1 + 0.1 * step)) for step in range(10)]
+    assert decisions[0] is False and decisions[-1] is False
+    assert any(decisions) and not all(decisions[1:-1])
+    # the total stays a device tensor between decisions
+    assert schedule.accumulated is None or isinstance(schedule.accumulated, torch.Tensor)
+
+
+def test_pipeline_branches_skip_the_same_steps(tiny_pipeline):
+    with torch.no_grad():
+        tiny_pipeline.text2music_diffusion_process(
+            duration=3.0,
+            random_generators=generators(),
+            infer_steps=8,
+            guidance_interval=1.0,
+            step_cache_threshold=10.0,
+            **diffusion_inputs(),
+        )
+    stats = tiny_pipeline.step_cache_stats
+    assert stats["cond"]["skipped_steps"] > 0
+    assert stats["cond"] == stats["null"]
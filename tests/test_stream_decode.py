@@ -0,0 +1,50 @@
+import pytest
+import torch
+
+LATENT_FRAMES_PER_SECOND = 44100 / 512 / 8
+
+
+def stream(music_dcae, latents, sr):
+    blocks = {}
+    for idx, block in music_dcae.decode_overlap_stream(latents, sr=sr):
+        blocks.setdefault(idx, []).append(block)
+    return [torch.cat(blocks[idx], dim=1) for idx in sorted(blocks)]
+
+
+@pytest.mark.parametrize("sr", [None, 48000, 32000])
+@pytest.mark.parametrize(
+    "frames",
+    [
+        # one vocoder window, shorter than its 64 latent frames
+        40,
+        # several vocoder windows, the last one partial
+        200,
+        # two DCAE windows of 512 latent frames
+        700,
+    ],
+)
+def test_stream_matches_overlapped_decode(tiny_models, sr, frames):
+    music_dcae = tiny_models[0]
+    latents = torch.randn(2, 8, 16, frames, generator=torch.Generator().manual_seed(frames))
+    with torch.no_grad():
+        _, expected = music_dcae.decode_overlap(latents, sr=sr)
+    streamed = stream(music_dcae, latents, sr)
+    assert len(streamed) == len(expected)
+    for wav, expected_wav in zip(streamed, expected):
+        assert wav.shape == expected_wav.shape
+        assert torch.allclose(wav, expected_wav.float(), rtol=1e-4, atol=1e-5)
+
+
+def test_streamed_call_reports_the_decode_stages(tiny_pipeline):
+    wav_blocks = tiny_pipeline(
+        prompt="pop, piano", lyrics="[verse]\nhello world", audio_duration=3.0, infer_step=2,
+        manual_seeds=[42], stream_decode=True,
+    )
+    # the report of the call itself, before the generator runs
+    assert "vocoder" not in tiny_pipeline.last_report["stages"]
+    blocks = list(wav_blocks)
+    assert blocks
+    stages = tiny_pipeline.last_report["stages"]
+    assert stages["vocoder"]["calls"] >= 1
+    assert stages["dcae_decode"]["calls"] >= 1
+    assert stages["resampling"]["calls"] >= 1
@@ -0,0 +1,72 @@
+import torch
+
+from ace_step.pipeline_ace_step import ACEStepPipeline
+
+
+class CountingTextEncoder(torch.nn.Module):
+    """The tiny UMT5 encoder, counting its forward calls."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        # the ERG hooks go on encoder.block[i]
+        self.encoder = model.encoder
+        self.config = model.config
+        self.calls = 0
+
+    @property
+    def device(self):
+        return self.model.device
+
+    def forward(self, **inputs):
+        self.calls += 1
+        return self.model(**inputs)
+
+
+def counting_pipeline(tiny_models):
+    music_dcae, transformer, text_encoder, tokenizer = tiny_models
+    text_encoder = CountingTextEncoder(text_encoder)
+    pipeline = ACEStepPipeline(music_dcae, transformer, text_encoder, tokenizer, torch.device("cpu"), torch.float32)
+    return pipeline, text_encoder
+
+
+def stats(pipeline):
+    cache_stats = pipeline.text_embedding_cache.stats()
+    return cache_stats["hits"], cache_stats["misses"]
+
+
+def test_hit_skips_the_text_encoder(tiny_models):
+    pipeline, text_encoder = counting_pipeline(tiny_models)
+    device = torch.device("cpu")
+
+    hidden_states, mask = pipeline.get_text_embeddings(["pop, piano"], device)
+    assert text_encoder.calls == 1 and stats(pipeline) == (0, 1)
+    cached_states, cached_mask = pipeline.get_text_embeddings(["pop, piano"], device)
+    assert text_encoder.calls == 1 and stats(pipeline) == (1, 1)
+    assert torch.equal(cached_states, hidden_states) and torch.equal(cached_mask, mask)
+
+    pipeline.get_text_embeddings(["rock"], device)
+    pipeline.get_text_embeddings(["pop, piano"], device, text_max_length=8)
+    assert text_encoder.calls == 3 and stats(pipeline) == (1, 3)
+
+
+def test_keys_cover_the_erg_settings_and_dtype(tiny_models):
+    pipeline, text_encoder = counting_pipeline(tiny_models)
+    device = torch.device("cpu")
+    texts = ["pop, piano"]
+
+    pipeline.get_text_embeddings(texts, device)
+    # the ERG weakened embeddings are not the plain ones
+    weak = pipeline.get_text_embeddings_null(texts, device)
+    assert text_encoder.calls == 2 and stats(pipeline) == (0, 2)
+    assert torch.equal(pipeline.get_text_embeddings_null(texts, device), weak)
+    assert text_encoder.calls == 2 and stats(pipeline) == (1, 2)
+
+    for settings in (dict(tau=0.02), dict(l_min=7), dict(l_max=11)):
+        pipeline.get_text_embeddings_null(texts, device, **settings)
+    assert text_encoder.calls == 5 and stats(pipeline) == (1, 5)
+
+    pipeline.dtype = torch.bfloat16
+    pipeline.get_text_embeddings(texts, device)
+    pipeline.get_text_embeddings_null(texts, device)
+    assert text_encoder.calls == 7 and stats(pipeline) == (1, 7)
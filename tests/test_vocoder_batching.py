@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+
+@pytest.mark.parametrize("sr", [None, 48000])
+@pytest.mark.parametrize(
+    "rows_per_chunk",
+    [
+        # 2 items x 2 channels: one row per chunk, an uneven 3 + 1 split, and all four together
+        1,
+        3,
+        4,
+    ],
+)
+def test_batched_vocoder_matches_per_channel_decode(tiny_models, monkeypatch, sr, rows_per_chunk):
+    music_dcae = tiny_models[0]
+    latents = torch.randn(2, 8, 16, 30, generator=torch.Generator().manual_seed(0))
+    audio_lengths = [30 * 512 * 8, 20 * 512 * 8]
+    mel_frames = latents.shape[-1] * 8
+    # a budget just over `rows_per_chunk` rows
+    memory_budget = (rows_per_chunk + 0.5) * music_dcae.vocoder_bytes_per_frame(torch.float32) * mel_frames
+
+    calls = []
+    vocoder_decode = music_dcae.vocoder.decode
+
+    def counting_decode(mels):
+        calls.append(mels.shape[0])
+        return vocoder_decode(mels)
+
+    with torch.no_grad():
+        _, expected = music_dcae.decode(latents, audio_lengths=audio_lengths, sr=sr, vocoder_memory_budget=0)
+        monkeypatch.setattr(music_dcae.vocoder, "decode", counting_decode)
+        _, batched = music_dcae.decode(latents, audio_lengths=audio_lengths, sr=sr, vocoder_memory_budget=memory_budget)
+
+    assert calls == [min(rows_per_chunk, 4 - start) for start in range(0, 4, rows_per_chunk)]
+    assert len(batched) == len(expected)
+    for wav, expected_wav in zip(batched, expected):
+        assert wav.shape == expected_wav.shape
+        assert torch.allclose(wav, expected_wav, rtol=1e-4, atol=1e-5)
@@ -6,8 +6,7 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.append(current_dir)
 
-from ace_step.language_segmentation import LangSegment
-from ace_step.ace_models.lyrics_utils.lyric_tokenizer import VoiceBpeTokenizer
+from functools import lru_cache
 
 SUPPORT_LANGUAGES = {
     "en": 259, "de": 260, "fr": 262, "es": 284, "it": 285, 
@@ -15,20 +14,35 @@ SUPPORT_LANGUAGES = {
     "nl": 297, "ar": 5022, "zh": 5023, "ja": 5412, "hu": 5753,
     "ko": 6152, "hi": 6680
 }
-lyric_tokenizer = VoiceBpeTokenizer()
-lang_segment = LangSegment()
-lang_segment.langid.set_languages(list(SUPPORT_LANGUAGES.keys()))
-lang_segment.setfilters([
-            'af', 'am', 'an', 'ar', 'as', 'az', 'be', 'bg', 'bn', 'br', 'bs', 'ca', 'cs', 'cy', 'da', 'de', 'dz', 'el',
-            'en', 'eo', 'es', 'et', 'eu', 'fa', 'fi', 'fo', 'fr', 'ga', 'gl', 'gu', 'he', 'hi', 'hr', 'ht', 'hu', 'hy',
-            'id', 'is', 'it', 'ja', 'jv', 'ka', 'kk', 'km', 'kn', 'ko', 'ku', 'ky', 'la', 'lb', 'lo', 'lt', 'lv', 'mg',
-            'mk', 'ml', 'mn', 'mr', 'ms', 'mt', 'nb', 'ne', 'nl', 'nn', 'no', 'oc', 'or', 'pa', 'pl', 'ps', 'pt', 'qu',
-            'ro', 'ru', 'rw', 'se', 'si', 'sk', 'sl', 'sq', 'sr', 'sv', 'sw', 'ta', 'te', 'th', 'tl', 'tr', 'ug', 'uk',
-            'ur', 'vi', 'vo', 'wa', 'xh', 'zh', 'zu'
-        ])
+
+
+@lru_cache(maxsize=1)
+def get_lyric_tokenizer():
+    from ace_step.ace_models.lyrics_utils.lyric_tokenizer import VoiceBpeTokenizer
+
+    return VoiceBpeTokenizer()
+
+
+@lru_cache(maxsize=1)
+def get_lang_segment():
+    # the langid model is unpickled on construction, so it is built on the first node run rather than at import
+    from ace_step.language_segmentation import LangSegment
+
+    lang_segment = LangSegment()
+    lang_segment.langid.set_languages(list(SUPPORT_LANGUAGES.keys()))
+    lang_segment.setfilters([
+        'af', 'am', 'an', 'ar', 'as', 'az', 'be', 'bg', 'bn', 'br', 'bs', 'ca', 'cs', 'cy', 'da', 'de', 'dz', 'el',
+        'en', 'eo', 'es', 'et', 'eu', 'fa', 'fi', 'fo', 'fr', 'ga', 'gl', 'gu', 'he', 'hi', 'hr', 'ht', 'hu', 'hy',
+        'id', 'is', 'it', 'ja', 'jv', 'ka', 'kk', 'km', 'kn', 'ko', 'ku', 'ky', 'la', 'lb', 'lo', 'lt', 'lv', 'mg',
+        'mk', 'ml', 'mn', 'mr', 'ms', 'mt', 'nb', 'ne', 'nl', 'nn', 'no', 'oc', 'or', 'pa', 'pl', 'ps', 'pt', 'qu',
+        'ro', 'ru', 'rw', 'se', 'si', 'sk', 'sl', 'sq', 'sr', 'sv', 'sw', 'ta', 'te', 'th', 'tl', 'tr', 'ug', 'uk',
+        'ur', 'vi', 'vo', 'wa', 'xh', 'zh', 'zu'
+    ])
+    return lang_segment
 
 
 def get_lang(text, default_lang, threshold):
+    lang_segment = get_lang_segment()
     language = "en"
     try:
         words = lang_segment.getTexts(text)
@@ -67,7 +81,7 @@ def tokenize_lyrics(lyrics, default_lang, threshold):
             if structure_pattern.match(line):
                 lyric_token_idx.append(line + "\n")
             else:
-                token_idx = lyric_tokenizer.preprocess_text(line, lang)
+                token_idx = get_lyric_tokenizer().preprocess_text(line, lang)
                 lyric_token_idx.append(f"[{lang}]" + token_idx + "\n")
         except Exception as e:
             print("tokenize error", e, "for line", line, "major_language", lang)